@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+
+class EntityIdCache:
+
+    def __init__(self, max_entries = 100000):
+        self.max_entries = max_entries
+        self.entity_ids = OrderedDict()
+        self.run_keys = {}
+        self.hits, self.misses = 0, 0
+
+        # Flask serves requests from multiple threads
+        self.lock = threading.Lock()
+
+    def get_key(self, run_id, entity_name, entity_type, source_id):
+        return (str(run_id), str(entity_name), str(entity_type), str(source_id))
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entity_ids:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entity_ids.move_to_end(key)
+            return self.entity_ids[key]
+
+    def put(self, key, entity_id):
+        with self.lock:
+            self.entity_ids[key] = entity_id
+            self.entity_ids.move_to_end(key)
+            run_id = key[0]
+            if run_id not in self.run_keys:
+                self.run_keys[run_id] = set()
+            self.run_keys[run_id].add(key)
+
+            # Drop the least recently used entities once we are over the size limit
+            while len(self.entity_ids) > self.max_entries:
+                removed_key, _ = self.entity_ids.popitem(last = False)
+                self.remove_from_run(removed_key)
+
+    def remove_from_run(self, key):
+        run_id = key[0]
+        self.run_keys[run_id].discard(key)
+        if len(self.run_keys[run_id]) == 0:
+            del self.run_keys[run_id]
+
+    def invalidate_run(self, run_id):
+        with self.lock:
+            for key in self.run_keys.pop(str(run_id), set()):
+                del self.entity_ids[key]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "hits" : self.hits,
+                "misses" : self.misses,
+                "size" : len(self.entity_ids),
+                "num_runs" : len(self.run_keys)
+            }
@@ -4,7 +4,11 @@ import sqlalchemy
 from sqlalchemy.orm import declarative_base
 from sqlalchemy import text
 import json
+import os
+import argparse
 import traceback
+import pyarrow as pa
+import pyarrow.parquet as pq
 from datetime import datetime, timezone
 
 from re_detail_adder import *
@@ -44,94 +48,133 @@ def print_schema():
                 for column in inspector.get_columns(table_name, schema=schema):
                     print("Table: %s, Column: %s" % (table_name, column))
 
-def get_relationships(connection, run_id, source_id):
-    query_to_run = f"""
-    SELECT R.src, R.relationship_type, R.dst
-    FROM macrostrat_kg.relationships AS R, macrostrat_kg.relationships_extracted AS RE
-    WHERE RE.run_id = '{run_id}' AND R.run_id = '{run_id}'
-    AND R.relationship_id = RE.relationship_id
-    AND RE.source_id = {source_id}
-    """
+SOURCE_FIELDS = ["preprocessor_id", "paper_id", "hashed_text", "weaviate_id", "paragraph_text"]
+RELATIONSHIP_FIELDS = ["src", "relationship_type", "dst"]
 
-    all_relationships = []
-    query_result = connection.execute(text(query_to_run))
-    for row in query_result:
-        relationship = row._mapping
-        all_relationships.append({
-            "src" : relationship["src"],
-            "relationship_type" : relationship["relationship_type"],
-            "dst" : relationship["dst"]
-        })
-        
-    return all_relationships
-
-def get_result_for_run(connection, run_id):
-    # Get the unique sources run
-    unique_sources_query = f"""
-    SELECT weaviate_id, MIN(source_id)
+# Join every kept source of a run with its relationships, keeping the first source for each paragraph
+RUN_ROWS_QUERY = text("""
+SELECT S.source_id, S.preprocessor_id, S.paper_id, S.hashed_text, S.weaviate_id, S.paragraph_text,
+    R.relationship_id, R.src, R.relationship_type, R.dst
+FROM macrostrat_kg.sources AS S
+LEFT JOIN (
+    macrostrat_kg.relationships_extracted AS RE
+    JOIN macrostrat_kg.relationships AS R ON R.run_id = RE.run_id AND R.relationship_id = RE.relationship_id
+) ON RE.run_id = S.run_id AND RE.source_id = S.source_id
+WHERE S.run_id = :run_id
+AND S.source_id IN (
+    SELECT MIN(source_id)
     FROM macrostrat_kg.sources
-    WHERE run_id = '{run_id}'  
+    WHERE run_id = :run_id
     GROUP BY weaviate_id
-    """
-    query_result = connection.execute(text(unique_sources_query)).all()
-    valid_source_ids = ",".join(["'" + str(data[1]) + "'" for data in query_result])
+)
+ORDER BY S.source_id
+""")
 
-    sources_query = f"""
-    SELECT *
-    FROM macrostrat_kg.sources
-    WHERE run_id = '{run_id}'
-    AND source_id IN ({valid_source_ids})
-    """
+PARQUET_SCHEMA = pa.schema([(field_name, pa.string()) for field_name in SOURCE_FIELDS + RELATIONSHIP_FIELDS])
+
+def stream_run_rows(connection, run_id, batch_size):
+    # Use a server side cursor so only batch_size rows are held in memory at once
+    streaming_connection = connection.execution_options(stream_results = True, yield_per = batch_size)
+    for row in streaming_connection.execute(RUN_ROWS_QUERY, {"run_id" : run_id}):
+        yield row._mapping
+
+def stream_run_results(connection, run_id, batch_size):
+    # The rows are ordered by source so we can group the relationships of each source as they arrive
+    curr_source_id, curr_result = None, None
+    for row in stream_run_rows(connection, run_id, batch_size):
+        if curr_result is None or row["source_id"] != curr_source_id:
+            if curr_result is not None:
+                yield curr_result
+
+            curr_source_id = row["source_id"]
+            curr_result = {
+                "text" : {field_name : row[field_name] for field_name in SOURCE_FIELDS},
+                "relationships" : []
+            }
+
+        # Sources without any relationships still get one row from the left join
+        if row["relationship_id"] is not None:
+            curr_result["relationships"].append({field_name : row[field_name] for field_name in RELATIONSHIP_FIELDS})
+
+    if curr_result is not None:
+        yield curr_result
 
-    all_results = []
-    fields_to_keep = ["preprocessor_id", "paper_id", "hashed_text", "weaviate_id", "paragraph_text"]
-    result = connection.execute(text(sources_query))
-    for row in result:
-        sources_row = row._mapping
-        # Get the txt data
-        txt_map = {}
-        for field_name in fields_to_keep:
-            txt_map[field_name] = sources_row[field_name]
-        
-        all_results.append({
-            "text" : txt_map,
-            "relationships" : get_relationships(connection, run_id, sources_row["source_id"])
-        })
-    
-    return all_results
+def save_run_json(connection, metadata_row, save_dir, batch_size):
+    # Write the results one at a time rather than building the whole run in memory
+    run_id = metadata_row["run_id"]
+    save_path = os.path.join(save_dir, run_id + ".json")
+    with open(save_path + ".tmp", "w+") as writer:
+        writer.write("{")
+        for field_name in ["run_id", "extraction_pipeline_id", "model_id"]:
+            writer.write(json.dumps(field_name) + ": " + json.dumps(metadata_row[field_name]) + ", ")
+
+        writer.write('"results": [')
+        for result_idx, result in enumerate(stream_run_results(connection, run_id, batch_size)):
+            if result_idx > 0:
+                writer.write(", ")
+            writer.write(json.dumps(result))
+        writer.write("]}")
+
+    os.replace(save_path + ".tmp", save_path)
+
+def save_run_parquet(connection, metadata_row, save_dir, batch_size):
+    # Write one row per relationship into the run's partition, a row group at a time
+    run_id = metadata_row["run_id"]
+    run_dir = os.path.join(save_dir, "run_id=" + str(run_id))
+    os.makedirs(run_dir, exist_ok = True)
+    save_path = os.path.join(run_dir, "part-0.parquet")
+    schema = PARQUET_SCHEMA.with_metadata({
+        "extraction_pipeline_id" : str(metadata_row["extraction_pipeline_id"]),
+        "model_id" : str(metadata_row["model_id"])
+    })
+
+    with pq.ParquetWriter(save_path + ".tmp", schema) as writer:
+        columns = {field_name : [] for field_name in schema.names}
+        for row in stream_run_rows(connection, run_id, batch_size):
+            for field_name in schema.names:
+                columns[field_name].append(None if row[field_name] is None else str(row[field_name]))
+
+            if len(columns[schema.names[0]]) >= batch_size:
+                writer.write_table(pa.Table.from_pydict(columns, schema = schema))
+                columns = {field_name : [] for field_name in schema.names}
+
+        if len(columns[schema.names[0]]) > 0:
+            writer.write_table(pa.Table.from_pydict(columns, schema = schema))
+
+    os.replace(save_path + ".tmp", save_path)
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--format", type=str, default="parquet", choices=["parquet", "json"], help = "The format to export the runs in")
+    parser.add_argument("--save_dir", type=str, default="db_extracted_runs", help = "The directory to save the exported runs to")
+    parser.add_argument("--batch_size", type=int, default=10000, help = "The number of rows fetched from the database and written at once")
+    return parser.parse_args()
 
 def main():
-    save_dir = "db_extracted_runs"
+    args = read_args()
+    os.makedirs(args.save_dir, exist_ok = True)
+    save_run = save_run_parquet if args.format == "parquet" else save_run_json
     all_runs_query = """
     SELECT *
     FROM macrostrat_kg.metadata
     """
 
     with engine.connect() as connection:
-        result = connection.execute(text(all_runs_query))
-        for row in result:
+        # Load the runs first so the run streams don't share a cursor with this query
+        all_runs = [row._mapping for row in connection.execute(text(all_runs_query))]
+        for metadata_row in all_runs:
             # Don't process example row
-            metadata_row = row._mapping
             is_example = False
             for value in metadata_row.values():
-                if "example" in value:
+                if isinstance(value, str) and "example" in value:
                     is_example = True
                     break
             
             if is_example:
                 continue
             
-            run_id = metadata_row["run_id"]
-            json_to_save = {
-                "run_id" : run_id,
-                "extraction_pipeline_id" : metadata_row["extraction_pipeline_id"],
-                "model_id" : metadata_row["model_id"],
-                "results" : get_result_for_run(connection, run_id)
-            }
-
-            save_path = os.path.join(save_dir, run_id + ".json")
-            with open(save_path, "w+") as writer:
-                json.dump(json_to_save, writer, indent = 4)
+            save_run(connection, metadata_row, args.save_dir, args.batch_size)
+            print("Exported run", metadata_row["run_id"])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
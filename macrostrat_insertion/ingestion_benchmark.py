@@ -0,0 +1,80 @@
+import argparse
+import random
+import time
+
+from updated_server import *
+
+LITHS = ["sandstone", "shale", "limestone", "basalt", "dolomite", "siltstone", "conglomerate", "andesite"]
+ATTRIBUTES = ["red", "fine grained", "massive", "thin bedded", "gray", "coarse", "cross bedded", "fossiliferous"]
+
+def make_request_data(run_id, num_results, relationships_per_result, seed):
+    # Build a synthetic payload in the same format the tree extraction pipeline produces
+    rng = random.Random(seed)
+    results = []
+    for result_idx in range(num_results):
+        strat_name = "formation " + str(rng.randint(0, num_results))
+        relationships = []
+        for _ in range(relationships_per_result):
+            lith = rng.choice(LITHS)
+            relationships.append({"src" : strat_name, "relationship_type" : "strat_to_lith", "dst" : lith})
+            relationships.append({"src" : lith, "relationship_type" : "att_of_lith", "dst" : rng.choice(ATTRIBUTES)})
+
+        results.append({
+            "text" : {
+                "preprocessor_id" : "benchmark",
+                "paper_id" : "paper_" + str(result_idx),
+                "hashed_text" : "hash_" + str(result_idx),
+                "weaviate_id" : run_id + "_paragraph_" + str(result_idx),
+                "paragraph_text" : "The " + strat_name + " consists of " + ", ".join(LITHS[:relationships_per_result]) + "."
+            },
+            "relationships" : relationships,
+            "just_entities" : [{"entity" : strat_name + " member", "entity_type" : "strat_name"}]
+        })
+
+    return {
+        "run_id" : run_id,
+        "extraction_pipeline_id" : "0",
+        "model_id" : "ingestion_benchmark",
+        "results" : results
+    }
+
+def count_rows(request_data):
+    # Count the rows the request writes, before deduplication
+    num_rows = 1
+    for result in request_data["results"]:
+        num_rows += 1 + 3 * len(result["relationships"]) + len(result["just_entities"])
+    return num_rows
+
+def time_ingestion(process_function, request_data):
+    start_time = time.time()
+    sucessful, error_msg = process_function(request_data)
+    if not sucessful:
+        raise Exception("Ingestion failed due to error " + error_msg)
+
+    return time.time() - start_time
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--num_results", type=int, default=200, help = "The number of paragraphs in each request")
+    parser.add_argument("--relationships_per_result", type=int, default=5, help = "The number of strat to lith relationships per paragraph")
+    parser.add_argument("--repeat", type=int, default=3, help = "The number of requests to time for each path")
+    parser.add_argument("--seed", type=int, default=42, help = "The seed used to generate the requests")
+    return parser.parse_args()
+
+def main():
+    # Every request uses a new run id so both paths insert the same number of new rows
+    args = read_args()
+    benchmark_id = "benchmark_" + datetime.now(timezone.utc).strftime("%Y-%m-%d_%H:%M:%S.%f")
+    with app.app_context():
+        for path_name, process_function in [("per row", process_input_request), ("bulk", process_input_request_bulk)]:
+            total_rows, total_time = 0, 0.0
+            for repeat_idx in range(args.repeat):
+                run_id = benchmark_id + "_" + path_name.replace(" ", "_") + "_" + str(repeat_idx)
+                request_data = make_request_data(run_id, args.num_results, args.relationships_per_result, args.seed + repeat_idx)
+                total_rows += count_rows(request_data)
+                total_time += time_ingestion(process_function, request_data)
+
+            print("The", path_name, "path wrote", total_rows, "rows in", round(total_time, 3), "seconds for", round(total_rows/total_time, 1), "rows/sec")
+
+if __name__ == "__main__":
+    main()
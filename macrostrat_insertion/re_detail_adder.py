@@ -1,5 +1,6 @@
 import json
 import os
+import functools
 
 def load_json_file(json_file):
     with open(json_file, 'r') as reader:
@@ -8,14 +9,28 @@ def load_json_file(json_file):
 
 class REProcessor:
 
-    def __init__(self, ids_folder):
+    def __init__(self, ids_folder, cache_size = 65536):
         self.ids_maps = {
             "lith_map" : load_json_file(os.path.join(ids_folder, "lith_id_map.json")),
             "lith_att_map" : load_json_file(os.path.join(ids_folder, "lith_att_id_map.json")),
             "strat_name_map" : load_json_file(os.path.join(ids_folder, "strat_names_map.json"))
         }
     
+        # The same few hundred entities show up over and over so memoize the lookups
+        self.cached_lookup = functools.lru_cache(maxsize = cache_size)(self.lookup_entity_id)
+
     def get_entity_id(self, entity_name, entity_type):
+        return self.cached_lookup(entity_name.lower(), entity_type)
+
+    def get_cache_stats(self):
+        cache_info = self.cached_lookup.cache_info()
+        return {
+            "hits" : cache_info.hits,
+            "misses" : cache_info.misses,
+            "size" : cache_info.currsize
+        }
+
+    def lookup_entity_id(self, entity_name, entity_type):
         type_id_map = self.ids_maps[entity_type + "_map"]
         entity_name = entity_name.lower()
         entity_id = -1
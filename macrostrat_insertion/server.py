@@ -39,16 +39,52 @@ MAX_TRIES = 5
 CONFIG_FILE_PATH = "local_postgres.json"
 app, db = load_flask_app(CONFIG_FILE_PATH)
 
-def get_new_record_id(table):
-    num_tries = 0
-    while num_tries < MAX_TRIES:
-        try:
-            return db.session.scalar(sqlalchemy.select(sqlalchemy.func.count()).select_from(table)) + 1
-        except Exception as e:
-            print("Got exception in get of", traceback.format_exc())
-        num_tries += 1
+def get_sequence_name(table, id_column):
+    return DEFAULT_SCHEMA + "." + table.name + "_" + id_column + "_seq"
+
+def create_id_sequence(table, id_column):
+    # Move the sequence past the ids that were handed out by counting rows. Once the sequence is in use the max id
+    # never exceeds its last value, so this never moves it backwards under other writers
+    sequence_name = get_sequence_name(table, id_column)
+    table_name = DEFAULT_SCHEMA + "." + table.name
+    db.session.execute(sqlalchemy.text("CREATE SEQUENCE IF NOT EXISTS " + sequence_name))
+    db.session.execute(sqlalchemy.text(
+        "SELECT setval('" + sequence_name + "', max_id) FROM (SELECT MAX(" + id_column + ") AS max_id FROM " + table_name + ") AS table_max " +
+        "WHERE max_id >= (SELECT last_value FROM " + sequence_name + ")"
+    ))
+    db.session.commit()
+
+def get_new_record_ids(table, id_column, num_ids):
+    # Reserve a block of ids in a single round trip, sequences never hand out the same id twice
+    if num_ids == 0:
+        return []
+
+    sequence_name = get_sequence_name(table, id_column)
+    ids_query = sqlalchemy.text("SELECT nextval('" + sequence_name + "') FROM generate_series(1, :num_ids)")
+    return [int(record_id) for record_id in db.session.scalars(ids_query, {"num_ids" : num_ids})]
+
+def get_new_record_id(table, id_column):
+    return get_new_record_ids(table, id_column, 1)[0]
+
+ID_COLUMNS = {
+    "macrostrat_kg.sources" : "source_id",
+    "macrostrat_kg.relationships" : "relationship_id"
+}
+with app.app_context():
+    for table_name, id_column in ID_COLUMNS.items():
+        create_id_sequence(db.metadata.tables[table_name], id_column)
+
+def insert_rows(table, rows):
+    # Rows with the same columns can be inserted together in one executemany
+    rows_by_columns = {}
+    for row in rows:
+        row_columns = tuple(sorted(row.keys()))
+        if row_columns not in rows_by_columns:
+            rows_by_columns[row_columns] = []
+        rows_by_columns[row_columns].append(row)
     
-    raise Exception("Unable to generate new record id")
+    for columns_rows in rows_by_columns.values():
+        db.session.execute(sqlalchemy.insert(table), columns_rows)
 
 def insert_run_metadata(request_data):
     # Ensure we have a run id
@@ -105,59 +141,45 @@ def insert_result(result, run_id):
         else:
             text_record[required_key] = text_data[required_key]
     
-    source_id = -1
+    # Determine the relationships to record
+    all_relationships = []
+    for current_relationship in result["relationships"]:
+        updated_relationship = relationship_processor.get_relationship_json(current_relationship)
+        if updated_relationship is not None:
+            all_relationships.append(updated_relationship)
+
     try:
-        # Determine the new source id
+        # Insert the source
         sources_table = db.metadata.tables['macrostrat_kg.sources']
-        source_id = get_new_record_id(sources_table)
+        source_id = get_new_record_id(sources_table, "source_id")
         text_record["source_id"] = source_id
-        
-        # Insert the source
         insert_stmt = sqlalchemy.insert(sources_table).values(**text_record)
         db.session.execute(insert_stmt)
-        db.session.commit()
-    except:
-        db.session.rollback()
-        return False, traceback.format_exc()
-    
-    # Insert the resulting relationship
-    failed_relationship = 0
-    for current_relationship in result["relationships"]:
-        updated_relationship = relationship_processor.get_relationship_json(current_relationship)
-        if updated_relationship is None:
-            continue
         
-        try:
-            # Get the new relationship id
-            relationship_table = db.metadata.tables['macrostrat_kg.relationships']
-            relationship_id = get_new_record_id(relationship_table)
+        # Insert all of the relationships with a single block of ids
+        relationship_table = db.metadata.tables['macrostrat_kg.relationships']
+        relationship_ids = get_new_record_ids(relationship_table, "relationship_id", len(all_relationships))
+        relationship_extracted_records = []
+        for relationship_id, updated_relationship in zip(relationship_ids, all_relationships):
             updated_relationship["relationship_id"] = relationship_id
-
-            # Insert new relationship
             updated_relationship["run_id"] = run_id
-            relationship_insert_stmt = sqlalchemy.insert(relationship_table).values(**updated_relationship)
-            db.session.execute(relationship_insert_stmt)
-            db.session.commit()
 
             # Record the relationship <-> source relationship
-            relationship_extracted = {
+            relationship_extracted_records.append({
                 "run_id" : run_id,
                 "relationship_id" : relationship_id,
                 "source_id" : source_id
-            }
-            relationship_extracted_table = db.metadata.tables['macrostrat_kg.relationships_extracted']
-            relationship_extracted_insert_stmt = sqlalchemy.insert(relationship_extracted_table).values(**relationship_extracted)
-            db.session.execute(relationship_extracted_insert_stmt)
-            db.session.commit()
-
-        except:
-            print("Failed to insert into relationship due to error", traceback.format_exc())
-            db.session.rollback()
-            failed_relationship += 1
-            continue
-    
-    if failed_relationship > 0:
-        return False, "Failed to insert " + str(failed_relationship) + " relationships"
+            })
+        insert_rows(relationship_table, all_relationships)
+
+        relationship_extracted_table = db.metadata.tables['macrostrat_kg.relationships_extracted']
+        insert_rows(relationship_extracted_table, relationship_extracted_records)
+
+        # Record the source and its relationships together
+        db.session.commit()
+    except:
+        db.session.rollback()
+        return False, "Failed to insert result due to error: " + traceback.format_exc()
 
     return True, ""
 
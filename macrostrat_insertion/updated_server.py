@@ -10,6 +10,7 @@ import traceback
 from datetime import datetime, timezone
 
 from re_detail_adder import *
+from entity_id_cache import *
 
 DEFAULT_SCHEMA = "macrostrat_kg_new"
 def load_flask_app(config_file):
@@ -43,6 +44,7 @@ CONFIG_FILE_PATH = "dev_macrostrat.json"
 app, db = load_flask_app(CONFIG_FILE_PATH)
 CORS(app)
 re_processor = REProcessor("id_maps")
+entity_id_cache = EntityIdCache()
 
 ENTITY_TYPE_TO_ID_MAP = {
     "strat_name" : "macrostrat_strat_id",
@@ -50,6 +52,12 @@ ENTITY_TYPE_TO_ID_MAP = {
     "lith_att" : "macrostrat_lith_att_id"
 }
 def get_db_entity_id(run_id, entity_name, entity_type, source_id):
+    # Skip the database if we already resolved this entity
+    cache_key = entity_id_cache.get_key(run_id, entity_name, entity_type, source_id)
+    cached_entity_id = entity_id_cache.get(cache_key)
+    if cached_entity_id is not None:
+        return True, str(cached_entity_id)
+
     # Create the entity value
     entity_unique_rows = ["run_id", "entity_name", "entity_type", "source_id"]
     entities_table = db.metadata.tables['macrostrat_kg_new.entities']
@@ -93,6 +101,7 @@ def get_db_entity_id(run_id, entity_name, entity_type, source_id):
         # Extract the sources id
         first_row = entities_result[0]._mapping
         entity_id = str(first_row["entity_id"])
+        entity_id_cache.put(cache_key, first_row["entity_id"])
     except:
         error_msg =  "Failed to get sources id for entity " + str(entity_name)
         error_msg += " for run " + str(run_id) + " due to error: " + traceback.format_exc()
@@ -297,8 +306,12 @@ def process_input_request(request_data):
         metadata_table = db.metadata.tables['macrostrat_kg_new.metadata']
         metadata_insert_statement = INSERT_STATEMENT(metadata_table).values(**metadata_values)
         metadata_insert_statement = metadata_insert_statement.on_conflict_do_nothing(index_elements=["run_id"])
-        db.session.execute(metadata_insert_statement)
+        metadata_result = db.session.execute(metadata_insert_statement)
         db.session.commit()
+
+        # Any entities cached for a newly created run are stale
+        if metadata_result.rowcount > 0:
+            entity_id_cache.invalidate_run(metadata_values["run_id"])
     except Exception:
         return False, "Failed to insert run " + str(metadata_values["run_id"]) + " due to error: " + traceback.format_exc()
 
@@ -311,10 +324,240 @@ def process_input_request(request_data):
 
     return True, ""
 
+BULK_CHUNK_SIZE = 1000
+def get_chunks(rows, chunk_size = BULK_CHUNK_SIZE):
+    # Keep each statement well below postgres's limit on the number of bound parameters
+    for chunk_start in range(0, len(rows), chunk_size):
+        yield rows[chunk_start : chunk_start + chunk_size]
+
+def bulk_insert_rows(table, rows, unique_columns):
+    for rows_chunk in get_chunks(rows):
+        insert_statement = INSERT_STATEMENT(table).values(rows_chunk)
+        insert_statement = insert_statement.on_conflict_do_nothing(index_elements = unique_columns)
+        db.session.execute(insert_statement)
+
+def bulk_insert_and_get_ids(table, rows, unique_columns, id_column):
+    # Deduplicate the rows, keeping the first one like the per row inserts
+    unique_rows = {}
+    for row in rows:
+        row_key = tuple(row[column] for column in unique_columns)
+        if row_key not in unique_rows:
+            unique_rows[row_key] = row
+
+    # Insert the rows and get the ids of the newly created ones in the same round trip
+    key_columns = [table.c[column] for column in unique_columns]
+    key_to_id = {}
+    for rows_chunk in get_chunks(list(unique_rows.values())):
+        insert_statement = INSERT_STATEMENT(table).values(rows_chunk)
+        insert_statement = insert_statement.on_conflict_do_nothing(index_elements = unique_columns)
+        insert_statement = insert_statement.returning(table.c[id_column], *key_columns)
+        for row in db.session.execute(insert_statement):
+            row_values = row._mapping
+            key_to_id[tuple(row_values[column] for column in unique_columns)] = row_values[id_column]
+
+    # Rows that already existed aren't returned so look all of them up at once
+    missing_keys = [row_key for row_key in unique_rows if row_key not in key_to_id]
+    for keys_chunk in get_chunks(missing_keys):
+        select_statement = SELECT_STATEMENT(table.c[id_column], *key_columns)
+        select_statement = select_statement.where(sqlalchemy.tuple_(*key_columns).in_(keys_chunk))
+        for row in db.session.execute(select_statement):
+            row_values = row._mapping
+            key_to_id[tuple(row_values[column] for column in unique_columns)] = row_values[id_column]
+
+    # Ensure every row got an id
+    for row_key in unique_rows:
+        if row_key not in key_to_id:
+            raise Exception("Failed to get " + id_column + " for row with key " + str(row_key) + " in table " + str(table.name))
+    
+    return key_to_id
+
+def get_entity_row(run_id, entity_name, entity_type, source_id):
+    # Every row in a multi row insert needs the same columns
+    entity_values = {
+        "run_id" : run_id,
+        "entity_name" : entity_name,
+        "entity_type" : entity_type,
+        "source_id" : source_id
+    }
+    for key_name in ENTITY_TYPE_TO_ID_MAP.values():
+        entity_values[key_name] = None
+
+    # Get the entity id
+    entity_id = re_processor.get_entity_id(entity_name, entity_type)
+    if entity_id != -1:
+        entity_values[ENTITY_TYPE_TO_ID_MAP[entity_type]] = entity_id
+    
+    return entity_values
+
+def get_relationship_types(relationship):
+    # Verify the fields
+    for field in ["src", "relationship_type", "dst"]:
+        if field not in relationship:
+            return False, "Request relationship missing field " + field
+    
+    # Extract the types
+    provided_relationship_type = relationship["relationship_type"]
+    for key_name in RELATIONSHIP_DETAILS:
+        if provided_relationship_type.startswith(key_name):
+            return True, RELATIONSHIP_DETAILS[key_name]
+    
+    # Ignore this type
+    return True, None
+
+def collect_source_rows(run_id, request_data):
+    # Validate all of the results before we write anything
+    source_fields = ["preprocessor_id", "paper_id", "hashed_text", "weaviate_id", "paragraph_text"]
+    source_rows, results = [], []
+    for result in request_data.get("results", []):
+        if "text" not in result:
+            return False, "result is missing text field"
+        
+        source_values = {"run_id" : run_id}
+        text_data = result["text"]
+        for field_name in source_fields:
+            if field_name not in text_data:
+                return False, "Request text is missing field " + str(field_name)
+            source_values[field_name] = text_data[field_name]
+        
+        # Remove non ascii data from text
+        paragraph_txt = source_values["paragraph_text"]
+        source_values["paragraph_text"] = paragraph_txt.encode("ascii", errors="ignore").decode()
+        source_rows.append(source_values)
+        results.append(result)
+
+    return True, (source_rows, results)
+
+def collect_entity_and_relationship_rows(run_id, results, source_ids):
+    entity_rows, relationships = [], []
+    for result, source_id in zip(results, source_ids):
+        # Like the per row path, we skip the entities of results without relationships
+        if "relationships" not in result:
+            continue
+
+        for relationship in result["relationships"]:
+            sucessful, relationship_types = get_relationship_types(relationship)
+            if not sucessful:
+                return False, relationship_types
+            
+            if relationship_types is None:
+                continue
+            
+            db_relationship_type, src_entity_type, dst_entity_type = relationship_types
+            src_row = get_entity_row(run_id, relationship["src"], src_entity_type, source_id)
+            dst_row = get_entity_row(run_id, relationship["dst"], dst_entity_type, source_id)
+            entity_rows.extend([src_row, dst_row])
+            relationships.append((src_row, dst_row, source_id, db_relationship_type))
+        
+        # Record the entities
+        required_entity_keys = ["entity", "entity_type"]
+        for entity_data in result.get("just_entities", []):
+            # Ensure that it has all the required keys
+            for key in required_entity_keys:
+                if key not in entity_data:
+                    return False, "Provided just entities missing key " + str(key) 
+            
+            # Only record strats
+            if entity_data["entity_type"].startswith("strat"):
+                entity_rows.append(get_entity_row(run_id, entity_data["entity"], "strat_name", source_id))
+    
+    return True, (entity_rows, relationships)
+
+def process_input_request_bulk(request_data):
+    # Get the metadata fields
+    metadata_fields = ["run_id", "extraction_pipeline_id", "model_id"]
+    metadata_values = {}
+    for field_name in metadata_fields:
+        if field_name not in request_data:
+            return False, "Request data is missing field " + str(field_name)
+        metadata_values[field_name] = request_data[field_name]
+    
+    run_id = request_data["run_id"]
+    sucessful, collected_sources = collect_source_rows(run_id, request_data)
+    if not sucessful:
+        return sucessful, collected_sources
+    source_rows, results = collected_sources
+
+    # Write the entire request in a single transaction
+    try:
+        # Determine if this is user provided feedback
+        if "user_name" in request_data:
+            users_table = db.metadata.tables['macrostrat_kg_new.users']
+            user_ids = bulk_insert_and_get_ids(users_table, [{"user_name" : request_data["user_name"]}], ["user_name"], "user_id")
+            metadata_values["user_id"] = str(user_ids[(request_data["user_name"], )])
+
+        # Insert this run to the metadata, any entities cached for a newly created run are stale
+        metadata_table = db.metadata.tables['macrostrat_kg_new.metadata']
+        metadata_insert_statement = INSERT_STATEMENT(metadata_table).values(**metadata_values)
+        metadata_insert_statement = metadata_insert_statement.on_conflict_do_nothing(index_elements=["run_id"])
+        if db.session.execute(metadata_insert_statement).rowcount > 0:
+            entity_id_cache.invalidate_run(run_id)
+
+        # Insert the sources
+        sources_table = db.metadata.tables['macrostrat_kg_new.sources']
+        source_key_to_id = bulk_insert_and_get_ids(sources_table, source_rows, ["run_id", "weaviate_id"], "source_id")
+        source_ids = [source_key_to_id[(run_id, source_row["weaviate_id"])] for source_row in source_rows]
+
+        sucessful, collected_rows = collect_entity_and_relationship_rows(run_id, results, source_ids)
+        if not sucessful:
+            db.session.rollback()
+            return sucessful, collected_rows
+        entity_rows, relationships = collected_rows
+
+        # Only the entities we haven't resolved before need to go to the database
+        entity_unique_rows = ["run_id", "entity_name", "entity_type", "source_id"]
+        entity_key_to_id, uncached_rows = {}, []
+        for entity_row in entity_rows:
+            entity_key = tuple(entity_row[column] for column in entity_unique_rows)
+            if entity_key in entity_key_to_id:
+                continue
+
+            cached_entity_id = entity_id_cache.get(entity_id_cache.get_key(*entity_key))
+            if cached_entity_id is not None:
+                entity_key_to_id[entity_key] = cached_entity_id
+            else:
+                uncached_rows.append(entity_row)
+
+        # Insert the remaining entities and resolve their ids
+        entities_table = db.metadata.tables['macrostrat_kg_new.entities']
+        new_entity_ids = bulk_insert_and_get_ids(entities_table, uncached_rows, entity_unique_rows, "entity_id")
+        entity_key_to_id.update(new_entity_ids)
+
+        # Insert all of the relationships
+        relationship_rows = []
+        for src_row, dst_row, source_id, db_relationship_type in relationships:
+            relationship_rows.append({
+                "run_id" : run_id,
+                "src_entity_id" : entity_key_to_id[tuple(src_row[column] for column in entity_unique_rows)],
+                "dst_entity_id" : entity_key_to_id[tuple(dst_row[column] for column in entity_unique_rows)],
+                "source_id" : source_id,
+                "relationship_type" : db_relationship_type
+            })
+        
+        unique_columns = ["run_id", "src_entity_id", "dst_entity_id", "relationship_type", "source_id"]
+        relationship_tables = db.metadata.tables['macrostrat_kg_new.relationship']
+        bulk_insert_rows(relationship_tables, relationship_rows, unique_columns)
+        db.session.commit()
+
+        # Only cache the ids once they are committed
+        for entity_key, entity_id in new_entity_ids.items():
+            entity_id_cache.put(entity_id_cache.get_key(*entity_key), entity_id)
+    except Exception:
+        db.session.rollback()
+        return False, "Failed to record run " + str(run_id) + " due to error: " + traceback.format_exc()
+
+    return True, ""
+
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    return jsonify({
+        "entity_id_cache" : entity_id_cache.get_stats(),
+        "entity_lookup_cache" : re_processor.get_cache_stats()
+    }), 200
+
 @app.route("/record_run", methods=["POST"])
 def record_run():
     # Record the run
-    sucessful, error_msg = process_input_request(request.get_json())
+    sucessful, error_msg = process_input_request_bulk(request.get_json())
     if not sucessful:
         print("Returning error of", error_msg)
         return jsonify({"error" : error_msg}), 400
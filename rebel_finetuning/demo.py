@@ -4,6 +4,8 @@ from transformers import AutoConfig, AutoModelForSeq2SeqLM, AutoTokenizer
 from time import time
 import torch
 
+from src.triplet_parser import TripletParser
+
 @st.cache(
     allow_output_mutation=True,
     hash_funcs={
@@ -54,6 +56,7 @@ def extract_triplets(text):
 
 
 tokenizer, model, dataset = load_models()
+triplet_parser = TripletParser(tokenizer)
 
 agree = st.checkbox('Free input', False)
 if agree:
@@ -94,6 +97,6 @@ st.title('Prediction text')
 decoded_preds = [text.replace('<s>', '').replace('</s>', '').replace('<pad>', '') for text in decoded_preds]
 st.write(decoded_preds)
 
-for idx, sentence in enumerate(decoded_preds):
+for idx, triplets in enumerate(triplet_parser.extract_triplets_batch(generated_tokens)):
     st.title(f'Prediction triplets sentence {idx}')
-    st.write(extract_triplets(sentence))
+    st.write([(triplet['head'], triplet['type'], triplet['tail']) for triplet in triplets])
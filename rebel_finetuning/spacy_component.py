@@ -5,90 +5,7 @@ from transformers import pipeline
 from typing import List
 import re
 
-def extract_triplets(text: str) -> List[str]:
-    """
-    parses the text to triplets
-    1. Split the text into tokens
-    2. If the token is <triplet>, <subj>, or <obj>, then set the current variable to the appropriate value
-    3. If the token is not one of the above, then append it to the appropriate variable
-    4. If the current variable is <subj>, then append the triplet to the list of triplets
-
-    :param text: str - the text to be parsed
-    :type text: str
-    :return: A list of dictionaries.
-    """
-
-    triplets = []
-    relation, subject, relation, object_ = "", "", "", ""
-    text = text.strip()
-    current = "x"
-
-    for token in text.replace("<s>", "").replace("<pad>", "").replace("</s>", "").split():
-
-        if (token == "<triplet>"):
-
-            current = "t"
-
-            if (relation != ""):
-
-                triplets.append(
-                        {
-                            "head": subject.strip(),
-                            "type": relation.strip(),
-                            "tail": object_.strip()
-                            }
-                        )
-                relation = ""
-
-            subject = ""
-
-        elif (token == "<subj>"):
-
-            current = "s"
-
-            if (relation != ""):
-
-                triplets.append(
-                    {
-                        "head": subject.strip(),
-                        "type": relation.strip(),
-                        "tail": object_.strip()
-                        }
-                    )
-
-            object_ = ""
-
-        elif (token == "<obj>"):
-
-            current = "o"
-            relation = ""
-
-        else:
-
-            if (current == "t"):
-
-                subject += " " + token
-
-            elif (current == "s"):
-
-                object_ += " " + token
-
-            elif (current == "o"):
-
-                relation += " " + token
-
-    if ((subject != "") and (relation != "") and (object_ != "")):
-
-        triplets.append(
-                {
-                    "head": subject.strip(),
-                    "type": relation.strip(),
-                    "tail": object_.strip()
-                    }
-                )
-
-    return triplets
-
+from src.triplet_parser import TripletParser, deduplicate_triplets
 
 @Language.factory(
         "rebel",
@@ -116,6 +33,7 @@ class RebelComponent:
                 tokenizer = model_name,
                 device = device
                 )
+        self.triplet_parser = TripletParser(self.triplet_extractor.tokenizer)
 
         # Register custom extension on the Doc
         if (not Doc.has_extension("rel")):
@@ -127,9 +45,9 @@ class RebelComponent:
         1. We pass the text of the sentence to the triplet extractor.
         2. The triplet extractor returns a list of dictionaries.
         3. We extract the token ids from the dictionaries.
-        4. We decode the token ids into text.
-        5. We extract the triplets from the text.
-        6. We return the triplets.
+        4. We split the token ids on the triplet, subject and object token ids.
+        5. We decode only the subject, object and relation slices.
+        6. We return the triplets without duplicates.
 
         The triplet extractor is a model that takes a sentence as input and returns a list of dictionaries.
         Each dictionary contains the token ids of the extracted triplets.
@@ -137,8 +55,7 @@ class RebelComponent:
         The token ids are the numbers that represent the words in the sentence.
         For example, the token id of the word "the" is 2.
 
-        The token ids are decoded into text using the tokenizer.
-        The tokenizer is a model that takes a list of token ids as input and returns a list of words.
+        Only the slices between the special token ids are decoded into text using the tokenizer.
 
         :param sents: List[Span]
         :type sents: List[Span]
@@ -150,16 +67,13 @@ class RebelComponent:
                 return_tensors = True,
                 return_text = False
                 )  # [0]["generated_token_ids"]
-        extracted_texts = self.triplet_extractor.tokenizer.batch_decode(
-            [out["generated_token_ids"] for out in output_ids]
-            )
         extracted_triplets = []
 
-        for text in extracted_texts:
+        for out in output_ids:
 
-            extracted_triplets.extend(extract_triplets(text))
+            extracted_triplets.extend(self.triplet_parser.extract_triplets(out["generated_token_ids"]))
 
-        return extracted_triplets
+        return deduplicate_triplets(extracted_triplets)
 
     def set_annotations(self, doc: Doc, triplets: List[dict]):
         """
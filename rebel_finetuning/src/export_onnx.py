@@ -0,0 +1,134 @@
+import os
+import argparse
+import torch
+from transformers import AutoModelForSeq2SeqLM
+
+# These names have to match the ones read by rebel_kg/onnx_backend.py
+ENCODER_FILE = "encoder_model.onnx"
+DECODER_FILE = "decoder_model.onnx"
+DECODER_WITH_PAST_FILE = "decoder_with_past_model.onnx"
+PAST_KEY_NAMES = ["decoder.key", "decoder.value", "encoder.key", "encoder.value"]
+
+class EncoderForExport(torch.nn.Module):
+
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.get_encoder()
+
+    def forward(self, input_ids, attention_mask):
+        return self.encoder(input_ids = input_ids, attention_mask = attention_mask, return_dict = True).last_hidden_state
+
+class DecoderForExport(torch.nn.Module):
+
+    def __init__(self, model):
+        super().__init__()
+        self.decoder = model.get_decoder()
+        self.num_layers = model.config.decoder_layers
+
+    def run_decoder(self, input_ids, encoder_hidden_states, encoder_attention_mask, past_key_values):
+        outputs = self.decoder(input_ids = input_ids, encoder_hidden_states = encoder_hidden_states, encoder_attention_mask = encoder_attention_mask,
+            past_key_values = past_key_values, use_cache = True, return_dict = True)
+        return (outputs.last_hidden_state, ) + tuple(tensor for layer_past in outputs.past_key_values for tensor in layer_past)
+
+    def forward(self, input_ids, encoder_hidden_states, encoder_attention_mask):
+        return self.run_decoder(input_ids, encoder_hidden_states, encoder_attention_mask, None)
+
+class DecoderWithPastForExport(DecoderForExport):
+
+    def forward(self, input_ids, encoder_attention_mask, *past_values):
+        # The cache comes in flattened as the four tensors of each layer
+        past_key_values = tuple(tuple(past_values[4 * layer_idx : 4 * (layer_idx + 1)]) for layer_idx in range(self.num_layers))
+
+        # With a cache the cross attention reuses the cached encoder keys and values, it only checks that encoder
+        # states were passed in. Leaving them out of the inputs stops the exporter from dropping an unused input.
+        return self.run_decoder(input_ids, past_values[2], encoder_attention_mask, past_key_values)
+
+def get_past_names(prefix, num_layers):
+    return [prefix + "." + str(layer_idx) + "." + key_name for layer_idx in range(num_layers) for key_name in PAST_KEY_NAMES]
+
+def get_past_axes(names, decoder_axis_name):
+    # The decoder cache grows every step while the encoder cache has the length of the input
+    past_axes = {}
+    for name in names:
+        sequence_axis = decoder_axis_name if ".decoder." in name else "encoder_sequence"
+        past_axes[name] = {0 : "batch", 2 : sequence_axis}
+    return past_axes
+
+def export_encoder(model, save_path, opset):
+    input_ids = torch.ones((2, 8), dtype = torch.long)
+    attention_mask = torch.ones((2, 8), dtype = torch.long)
+    torch.onnx.export(EncoderForExport(model), (input_ids, attention_mask), save_path, opset_version = opset, do_constant_folding = True,
+        input_names = ["input_ids", "attention_mask"], output_names = ["last_hidden_state"],
+        dynamic_axes = {
+            "input_ids" : {0 : "batch", 1 : "encoder_sequence"},
+            "attention_mask" : {0 : "batch", 1 : "encoder_sequence"},
+            "last_hidden_state" : {0 : "batch", 1 : "encoder_sequence"}
+        })
+
+def export_decoder(model, save_path, opset, with_past):
+    # Generation feeds one token at a time, so the graphs are traced with a single decoder token
+    config = model.config
+    batch_size, encoder_length, past_length = 2, 8, 3
+    input_ids = torch.ones((batch_size, 1), dtype = torch.long)
+    encoder_hidden_states = torch.rand((batch_size, encoder_length, config.d_model))
+    encoder_attention_mask = torch.ones((batch_size, encoder_length), dtype = torch.long)
+
+    past_values, past_names = [], []
+    if with_past:
+        head_dim = config.d_model // config.decoder_attention_heads
+        for _ in range(config.decoder_layers):
+            past_values.append(torch.rand((batch_size, config.decoder_attention_heads, past_length, head_dim)))
+            past_values.append(torch.rand((batch_size, config.decoder_attention_heads, past_length, head_dim)))
+            past_values.append(torch.rand((batch_size, config.decoder_attention_heads, encoder_length, head_dim)))
+            past_values.append(torch.rand((batch_size, config.decoder_attention_heads, encoder_length, head_dim)))
+        past_names = get_past_names("past_key_values", config.decoder_layers)
+
+    present_names = get_past_names("present", config.decoder_layers)
+    dynamic_axes = {
+        "input_ids" : {0 : "batch", 1 : "decoder_sequence"},
+        "encoder_hidden_states" : {0 : "batch", 1 : "encoder_sequence"},
+        "encoder_attention_mask" : {0 : "batch", 1 : "encoder_sequence"},
+        "last_hidden_state" : {0 : "batch", 1 : "decoder_sequence"}
+    }
+    dynamic_axes.update(get_past_axes(past_names, "past_sequence"))
+    dynamic_axes.update(get_past_axes(present_names, "past_sequence_plus_one"))
+
+    if with_past:
+        export_model, export_inputs = DecoderWithPastForExport(model), [input_ids, encoder_attention_mask] + past_values
+        input_names = ["input_ids", "encoder_attention_mask"] + past_names
+    else:
+        export_model, export_inputs = DecoderForExport(model), [input_ids, encoder_hidden_states, encoder_attention_mask]
+        input_names = ["input_ids", "encoder_hidden_states", "encoder_attention_mask"]
+    dynamic_axes = {name : axes for name, axes in dynamic_axes.items() if name in input_names + ["last_hidden_state"] + present_names}
+
+    torch.onnx.export(export_model, tuple(export_inputs), save_path, opset_version = opset, do_constant_folding = True,
+        input_names = input_names, output_names = ["last_hidden_state"] + present_names, dynamic_axes = dynamic_axes)
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model_path', type = str, required = True, help = "The directory with the model saved by checkpoint_to_model.py")
+    parser.add_argument('--save_dir', type = str, default = None, help = "The directory to write the onnx graphs to, defaults to the onnx folder in the model directory")
+    parser.add_argument('--opset', type = int, default = 13, help = "The onnx opset version to export with")
+    return parser.parse_args()
+
+def main():
+    args = read_args()
+    save_dir = args.save_dir if args.save_dir is not None else os.path.join(args.model_path, "onnx")
+    os.makedirs(save_dir, exist_ok = True)
+
+    print("Loading model from", args.model_path)
+    model = AutoModelForSeq2SeqLM.from_pretrained(args.model_path)
+    model.eval()
+    model.config.use_cache = True
+
+    with torch.no_grad():
+        print("Exporting encoder")
+        export_encoder(model, os.path.join(save_dir, ENCODER_FILE), args.opset)
+        print("Exporting decoder")
+        export_decoder(model, os.path.join(save_dir, DECODER_FILE), args.opset, with_past = False)
+        print("Exporting decoder with past key values")
+        export_decoder(model, os.path.join(save_dir, DECODER_WITH_PAST_FILE), args.opset, with_past = True)
+    print("Wrote the onnx graphs to", save_dir)
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,14 @@ from transformers.optimization import (
 from scheduler import get_inverse_square_root_schedule_with_warmup
 from datasets import load_dataset, load_metric
 from torch.nn.utils.rnn import pad_sequence
-from utils import BartTripletHead, shift_tokens_left, extract_triplets_typed, extract_triplets
+from utils import BartTripletHead, shift_tokens_left, extract_triplets_typed
+from triplet_parser import TripletParser
+
+typed_dataset_mappings = {
+    'conll04_typed.py': {'<peop>': 'Peop', '<org>': 'Org', '<other>': 'Other', '<loc>': 'Loc'},
+    'nyt_typed.py': {'<loc>': 'LOCATION', '<org>': 'ORGANIZATION', '<per>': 'PERSON'},
+    'docred_typed.py': {'<loc>': 'LOC', '<misc>': 'MISC', '<per>': 'PER', '<num>': 'NUM', '<time>': 'TIME', '<org>': 'ORG'},
+}
 
 arg_to_scheduler = {
     "linear": get_linear_schedule_with_warmup,
@@ -104,6 +111,7 @@ class BasePLModule(pl.LightningModule):
         super().__init__(*args, **kwargs)
         self.save_hyperparameters(conf)
         self.tokenizer = tokenizer
+        self.triplet_parser = TripletParser(tokenizer)
         self.model = model
         self.config = config
         if self.model.config.decoder_start_token_id is None:
@@ -200,15 +208,15 @@ class BasePLModule(pl.LightningModule):
             **gen_kwargs,
         )
 
-        decoded_preds = self.tokenizer.batch_decode(generated_tokens, skip_special_tokens=False)
-        decoded_labels = self.tokenizer.batch_decode(torch.where(labels != -100, labels, self.config.pad_token_id), skip_special_tokens=False)
-        if self.hparams.dataset_name.split('/')[-1] == 'conll04_typed.py':
-            return [extract_triplets_typed(rel) for rel in decoded_preds], [extract_triplets_typed(rel) for rel in decoded_labels]
-        elif self.hparams.dataset_name.split('/')[-1] == 'nyt_typed.py':
-            return [extract_triplets_typed(rel, {'<loc>': 'LOCATION', '<org>': 'ORGANIZATION', '<per>': 'PERSON'}) for rel in decoded_preds], [extract_triplets_typed(rel, {'<loc>': 'LOCATION', '<org>': 'ORGANIZATION', '<per>': 'PERSON'}) for rel in decoded_labels]
-        elif self.hparams.dataset_name.split('/')[-1] == 'docred_typed.py':
-            return [extract_triplets_typed(rel, {'<loc>': 'LOC', '<misc>': 'MISC', '<per>': 'PER', '<num>': 'NUM', '<time>': 'TIME', '<org>': 'ORG'}) for rel in decoded_preds], [extract_triplets_typed(rel, {'<loc>': 'LOC', '<misc>': 'MISC', '<per>': 'PER', '<num>': 'NUM', '<time>': 'TIME', '<org>': 'ORG'}) for rel in decoded_labels]
-        return [extract_triplets(rel) for rel in decoded_preds], [extract_triplets(rel) for rel in decoded_labels]
+        # The typed datasets still parse the decoded text to read their entity type tokens
+        labels = torch.where(labels != -100, labels, self.config.pad_token_id)
+        dataset_file = self.hparams.dataset_name.split('/')[-1]
+        if dataset_file in typed_dataset_mappings:
+            mapping_types = typed_dataset_mappings[dataset_file]
+            decoded_preds = self.tokenizer.batch_decode(generated_tokens, skip_special_tokens=False)
+            decoded_labels = self.tokenizer.batch_decode(labels, skip_special_tokens=False)
+            return [extract_triplets_typed(rel, mapping_types) for rel in decoded_preds], [extract_triplets_typed(rel, mapping_types) for rel in decoded_labels]
+        return self.triplet_parser.extract_triplets_batch(generated_tokens), self.triplet_parser.extract_triplets_batch(labels)
 
     def generate_samples(self,
         # model,
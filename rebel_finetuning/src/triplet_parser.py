@@ -0,0 +1,68 @@
+class TripletParser:
+
+    def __init__(self, tokenizer, triplet_token = "<triplet>", subject_token = "<subj>", object_token = "<obj>"):
+        self.tokenizer = tokenizer
+        self.triplet_id, self.subject_id, self.object_id = tokenizer.convert_tokens_to_ids([triplet_token, subject_token, object_token])
+
+        # The start, end and padding tokens are dropped before parsing
+        skip_ids = [tokenizer.bos_token_id, tokenizer.eos_token_id, tokenizer.pad_token_id]
+        self.skip_ids = set([token_id for token_id in skip_ids if token_id is not None])
+
+    def decode_span(self, span_ids):
+        # Collapse the whitespace the same way splitting the decoded text on spaces did
+        if len(span_ids) == 0:
+            return ""
+        return " ".join(self.tokenizer.decode(span_ids, skip_special_tokens = False).split())
+
+    def extract_triplets(self, token_ids):
+        # Walk the ids of one generated sequence, only decoding the subject, object and relation slices
+        if hasattr(token_ids, "tolist"):
+            token_ids = token_ids.tolist()
+
+        triplets = []
+        subject_ids, object_ids, relation_ids = [], [], []
+        current = 'x'
+        for token_id in token_ids:
+            if token_id in self.skip_ids:
+                continue
+
+            if token_id == self.triplet_id:
+                current = 't'
+                relation = self.decode_span(relation_ids)
+                if relation != '':
+                    triplets.append({'head': self.decode_span(subject_ids), 'type': relation, 'tail': self.decode_span(object_ids)})
+                    relation_ids = []
+                subject_ids = []
+            elif token_id == self.subject_id:
+                current = 's'
+                relation = self.decode_span(relation_ids)
+                if relation != '':
+                    triplets.append({'head': self.decode_span(subject_ids), 'type': relation, 'tail': self.decode_span(object_ids)})
+                object_ids = []
+            elif token_id == self.object_id:
+                current = 'o'
+                relation_ids = []
+            elif current == 't':
+                subject_ids.append(token_id)
+            elif current == 's':
+                object_ids.append(token_id)
+            elif current == 'o':
+                relation_ids.append(token_id)
+
+        subject, relation, object_ = self.decode_span(subject_ids), self.decode_span(relation_ids), self.decode_span(object_ids)
+        if subject != '' and relation != '' and object_ != '':
+            triplets.append({'head': subject, 'type': relation, 'tail': object_})
+        return triplets
+
+    def extract_triplets_batch(self, generated_tokens):
+        return [self.extract_triplets(token_ids) for token_ids in generated_tokens]
+
+def deduplicate_triplets(triplets):
+    # Beams often agree, so only keep the first copy of each (head, type, tail)
+    seen_triplets, unique_triplets = set(), []
+    for triplet in triplets:
+        triplet_key = (triplet['head'], triplet['type'], triplet['tail'])
+        if triplet_key not in seen_triplets:
+            seen_triplets.add(triplet_key)
+            unique_triplets.append(triplet)
+    return unique_triplets
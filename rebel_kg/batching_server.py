@@ -0,0 +1,275 @@
+import asyncio
+import argparse
+import concurrent.futures
+import time
+from aiohttp import web
+
+from formation_kg_generator import *
+
+DEFAULT_ARTICLE_LIMIT = 5
+DEFAULT_SNIPPEETS_LIMIT = 1
+DEFAULT_MODEL = "seq2rel"
+arguments = {
+    "formation" : "The formation we want to get the knowledge graph for",
+    "model_types" : f"A space seperated list of the models we want to use to generate kg. Valid options: seq2rel, rebel. Default: {DEFAULT_MODEL}",
+    "article_limit" : f"The number of articles we want to get snippets from. Default: {DEFAULT_ARTICLE_LIMIT}",
+    "snippets_limit" : f"The maximum number of snippets we should get per article: Default: {DEFAULT_SNIPPEETS_LIMIT}",
+    "generation_profile" : f"The REBEL generation profile, one of {GENERATION_PROFILES} where k is the number of beams. Default: the profile the server was started with"
+}
+
+model_paths = {
+    "seq2rel" : "/app/seq_to_rel/output/model.tar.gz",
+    "rebel" : "/app/rebel_finetuning/model/archive_tuned"
+}
+
+class MicroBatcher:
+
+    def __init__(self, model, max_batch_size = 32, max_wait_ms = 20):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        # A single inference thread per model so the event loop stays free to accept requests while a batch runs.
+        # Lines that arrive meanwhile wait in the queue, the next batch is only collected once this one is done
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+        self.queue = None
+        self.batch_task = None
+        self.num_batches, self.num_sentences = 0, 0
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.batch_task = asyncio.get_event_loop().create_task(self.run_batches())
+
+    async def stop(self):
+        self.batch_task.cancel()
+        try:
+            await self.batch_task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait = True)
+
+    async def extract(self, lines, profile = None):
+        # Queue every line with its own future and wait for all of them to be resolved
+        loop = asyncio.get_event_loop()
+        line_futures = []
+        for line in lines:
+            line_future = loop.create_future()
+            await self.queue.put((line, profile, line_future))
+            line_futures.append(line_future)
+
+        return await asyncio.gather(*line_futures)
+
+    async def collect_batch(self):
+        # Wait for the first line and then keep adding lines until the batch is full or the deadline passes
+        loop = asyncio.get_event_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining_time = deadline - loop.time()
+            if remaining_time <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout = remaining_time))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def run_batches(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = await self.collect_batch()
+
+            # Requests can ask for different generation profiles so each profile is run separately
+            profile_batches = {}
+            for line, profile, line_future in batch:
+                profile_batches.setdefault(profile, []).append((line, line_future))
+
+            for profile, profile_batch in profile_batches.items():
+                await self.run_batch(loop, profile, profile_batch)
+
+    async def run_batch(self, loop, profile, batch):
+        batch_lines = [line for line, _ in batch]
+        try:
+            batch_relations = await loop.run_in_executor(self.executor, self.model.get_relations_for_lines, batch_lines, self.max_batch_size, profile)
+        except Exception as e:
+            for _, line_future in batch:
+                if not line_future.done():
+                    line_future.set_exception(e)
+            return
+
+        # Fan the results back out to the requests waiting on them
+        self.num_batches += 1
+        self.num_sentences += len(batch_lines)
+        for (_, line_future), relations in zip(batch, batch_relations):
+            if not line_future.done():
+                line_future.set_result(relations)
+
+def get_models_to_use(request_app, models_argument):
+    if models_argument is None:
+        models_argument = DEFAULT_MODEL
+    models_to_use = [model.strip() for model in models_argument.split(" ") if len(model.strip()) > 0]
+
+    for model in models_to_use:
+        if model not in request_app["batchers"]:
+            return None, f"Invalid model type of {model}"
+
+    return models_to_use, ""
+
+def get_generation_profile(profile):
+    # Check the profile up front so a bad request doesn't fail the batch it gets grouped into
+    if profile is None:
+        return None, ""
+
+    try:
+        get_generation_kwargs(profile)
+    except Exception as e:
+        return None, str(e)
+    return profile, ""
+
+async def get_kg_for_lines_batched(request_app, models_to_use, lines, article_ids, profile = None):
+    # Submit the lines to every model at once so they are batched together with other requests
+    combined_kg = KG()
+    all_model_relations = await asyncio.gather(*[request_app["batchers"][model_name].extract(lines, profile) for model_name in models_to_use])
+    for relations_per_line in all_model_relations:
+        for line, article_id, relations in zip(lines, article_ids, relations_per_line):
+            add_relations_to_kg(combined_kg, relations, line, article_id)
+
+    return combined_kg
+
+async def kg_getter(request):
+    # Read the args
+    param_values = {}
+    args_exist = False
+    for arg in arguments:
+        value = request.query.get(arg)
+        param_values[arg] = value
+        if value is not None:
+            args_exist = True
+
+    # Return the arguments
+    if not args_exist:
+        return web.json_response({"parameters" : arguments})
+
+    # Check if formation is present
+    formation_name = param_values["formation"]
+    if formation_name is None:
+        return web.json_response({
+            "result" : "failure",
+            "reason" : "No formation is specified"
+        })
+
+    models_to_use, error_msg = get_models_to_use(request.app, param_values["model_types"])
+    if models_to_use is None:
+        return web.json_response({
+            "result" : "failure",
+            "reason" : error_msg
+        })
+
+    profile, error_msg = get_generation_profile(param_values["generation_profile"])
+    if len(error_msg) > 0:
+        return web.json_response({
+            "result" : "failure",
+            "reason" : error_msg
+        })
+
+    # Read in the limits
+    article_limit, snippets_limit = DEFAULT_ARTICLE_LIMIT, DEFAULT_SNIPPEETS_LIMIT
+    if param_values["article_limit"] is not None:
+        article_limit = int(param_values["article_limit"])
+
+    if param_values["snippets_limit"] is not None:
+        snippets_limit = int(param_values["snippets_limit"])
+
+    # Load the snippets without blocking the event loop
+    snippets = await asyncio.get_event_loop().run_in_executor(None, get_snippets_for_formation, formation_name, article_limit, snippets_limit)
+    if len(snippets) == 0:
+        return web.json_response({
+            "result" : "failure",
+            "reason" : "Failed to get snippets for formation " + str(formation_name)
+        })
+
+    article_ids = [article_id for article_id, _ in snippets]
+    lines = [curr_line.strip() for _, curr_line in snippets]
+    formation_kg = await get_kg_for_lines_batched(request.app, models_to_use, lines, article_ids, profile)
+    return web.json_response({
+        "result" : "sucess",
+        "knowledge_graph" : formation_kg.get_json_representation()
+    })
+
+async def extract_handler(request):
+    # Extract the relations for sentences provided directly in the request body
+    request_data = await request.json()
+    if "sentences" not in request_data:
+        return web.json_response({"error" : "Key 'sentences' not found in request body"}, status = 400)
+
+    models_to_use, error_msg = get_models_to_use(request.app, request_data.get("model_types", None))
+    if models_to_use is None:
+        return web.json_response({"error" : error_msg}, status = 400)
+
+    profile, error_msg = get_generation_profile(request_data.get("generation_profile", None))
+    if len(error_msg) > 0:
+        return web.json_response({"error" : error_msg}, status = 400)
+
+    sentences = [sentence.strip() for sentence in request_data["sentences"]]
+    all_model_relations = await asyncio.gather(*[request.app["batchers"][model_name].extract(sentences, profile) for model_name in models_to_use])
+    return web.json_response({
+        "result" : "sucess",
+        "relations" : {model_name : relations for model_name, relations in zip(models_to_use, all_model_relations)}
+    })
+
+async def stats_handler(request):
+    stats = {}
+    for model_name, batcher in request.app["batchers"].items():
+        stats[model_name] = {
+            "num_batches" : batcher.num_batches,
+            "num_sentences" : batcher.num_sentences,
+            "queued_sentences" : batcher.queue.qsize()
+        }
+    return web.json_response(stats)
+
+def create_app(models, max_batch_size, max_wait_ms):
+    app = web.Application()
+    app["batchers"] = {model_name : MicroBatcher(model, max_batch_size, max_wait_ms) for model_name, model in models.items()}
+
+    async def start_batchers(app):
+        for batcher in app["batchers"].values():
+            batcher.start()
+
+    async def stop_batchers(app):
+        for batcher in app["batchers"].values():
+            await batcher.stop()
+
+    app.on_startup.append(start_batchers)
+    app.on_cleanup.append(stop_batchers)
+    app.router.add_get("/kg", kg_getter)
+    app.router.add_post("/extract", extract_handler)
+    app.router.add_get("/stats", stats_handler)
+    return app
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model_types', nargs='+', default = ["seq2rel", "rebel"], help = "The models we want to serve")
+    parser.add_argument('--max_batch_size', type = int, default = 32, help = "The maximum number of sentences passed through a model at once")
+    parser.add_argument('--max_wait_ms', type = float, default = 20, help = "The maximum time to wait for more sentences before running a batch")
+    parser.add_argument('--extraction_cache', type = str, default = None, help = "The sqlite file used to cache extracted relations across runs")
+    parser.add_argument('--generation_profile', type = str, default = DEFAULT_PROFILE, help = "The REBEL generation profile used when a request doesn't pick one, one of " + str(GENERATION_PROFILES))
+    parser.add_argument('--port', type = int, default = 9000, help = "The port to run the server on")
+    return parser.parse_args()
+
+def main():
+    args = read_args()
+    cache = None
+    if args.extraction_cache is not None:
+        cache = ExtractionCache(args.extraction_cache)
+
+    models = {}
+    for model_name in args.model_types:
+        models[model_name] = get_model(model_name, model_paths[model_name], cache = cache, generation_profile = args.generation_profile)
+
+    app = create_app(models, args.max_batch_size, args.max_wait_ms)
+    web.run_app(app, host = '0.0.0.0', port = args.port)
+
+if __name__ == "__main__":
+    main()
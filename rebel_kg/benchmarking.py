@@ -1,38 +1,58 @@
 import torch
 import argparse
+import gc
+import time
+import psutil
 import pandas as pd
 from sklearn.metrics import recall_score, precision_score, f1_score
 
 from model_wrapper import *
 
-def get_model(model_type, model_path):
-    print("Loading model", model_type, "from weights", model_path)
+def get_model(model_type, model_path, precision = "fp32"):
+    print("Loading model", model_type, "from weights", model_path, "with precision", precision)
     if model_type == "rebel":
-        return RebelWrapper(model_path)
+        return RebelWrapper(model_path, precision = precision)
     elif model_type == "seq2rel":
-        return Seq2RelWrapper(model_path)
+        return Seq2RelWrapper(model_path, precision = precision)
     else:
         raise Exception("Invalid model type of " + model_type)
 
+def get_rss_mb():
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
 def read_args():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('--model_type', type = str, required = True, help = "The type of model we want to use")
     parser.add_argument('--model_path', type = str, required = True, help = "The path to the finetuned model weights we want to use")
     parser.add_argument('--dataset_path', type = str, required = True, help = "The path to the dataset we want to evaluate the model on")
     parser.add_argument('--num_examples', type = int, default = 25, help = "The number of examples to run the benchmark on")
+    parser.add_argument('--precisions', nargs = '+', default = ["fp32", "int8"], choices = PRECISIONS, help = "The precisions to compare, the first one is the baseline")
+    parser.add_argument('--seed', type = int, default = 42, help = "The seed used to sample the examples so every precision sees the same ones")
     return parser.parse_args()
 
 possible_relations = [ "strat_name_to_lith",  "lith_to_lith_group",  "lith_to_lith_type",  "att_grains",  "att_lithology", "att_color", 
 "att_sed_structure", "att_bedform",  "att_structure"]
 
-def run_benchmarking(args):
-    # Load the model and dataset
-    model = get_model(args.model_type, args.model_path)
-    print("Loading dataset from path", args.dataset_path)
-    benchmark_df = pd.read_csv(args.dataset_path, sep = '\t', header = None, names = ["sentence", "relationship"]).sample(frac=1).head(args.num_examples)
-    print("Loaded a total of", len(benchmark_df.index), "examples")
+def get_predicted_value(predictions):
+    prediction_count = {}
+    for curr_prediction in predictions:
+        prediction_type = curr_prediction["type"]
+        # Ensure we only process relationships we care about
+        if prediction_type in possible_relations:
+            if prediction_type not in prediction_count:
+                prediction_count[prediction_type] = 0
+            prediction_count[prediction_type] += 1
+    
+    # Compute the prediction
+    predicted_value = 0
+    if len(prediction_count) > 0:
+        sorted_pairs = sorted(prediction_count.items(), key=lambda pair: pair[1])
+        predicted_relationship = sorted_pairs[0][0]
+        predicted_value = possible_relations.index(predicted_relationship) + 1
+    return predicted_value
 
-    true_labels, predicted_labels = [], []
+def evaluate_model(model, benchmark_df, profile = None):
+    true_labels, predicted_labels, inference_time = [], [], 0.0
     for idx, row in benchmark_df.iterrows():
         # Determine the expected relationship
         relationship_parts = row["relationship"].strip().split(" ")
@@ -42,33 +62,56 @@ def run_benchmarking(args):
 
         # Get the prediction
         sentence = row["sentence"].strip()
-        predictions = model.get_relations_in_line(sentence)
+        start_time = time.time()
+        predictions = model.get_relations_in_line(sentence, profile = profile)
+        inference_time += time.time() - start_time
         print("Sentence", sentence, "has prediction of", predictions)
-        prediction_count = {}
-        for curr_prediction in predictions:
-            prediction_type = curr_prediction["type"]
-            # Ensure we only process relationships we care about
-            if prediction_type in possible_relations:
-                if prediction_type not in prediction_count:
-                    prediction_count[prediction_type] = 0
-                prediction_count[prediction_type] += 1
-        
-        # Compute the prediction
-        predicted_value = 0
-        if len(prediction_count) > 0:
-            sorted_pairs = sorted(prediction_count.items(), key=lambda pair: pair[1])
-            predicted_relationship = sorted_pairs[0][0]
-            predicted_value = possible_relations.index(predicted_relationship) + 1
+        predicted_value = get_predicted_value(predictions)
         print("Got prediction of", predicted_value)
         
         # Record these values
         true_labels.append(expected_value)
         predicted_labels.append(predicted_value)
     
-    print("Precision of", 100.0 * precision_score(true_labels, predicted_labels, average='macro'))
-    print("Recall of", 100.0 * recall_score(true_labels, predicted_labels, average='macro'))
-    print("F1 score of", 100.0 * f1_score(true_labels, predicted_labels, average='macro'))
+    return {
+        "precision" : 100.0 * precision_score(true_labels, predicted_labels, average='macro'),
+        "recall" : 100.0 * recall_score(true_labels, predicted_labels, average='macro'),
+        "f1" : 100.0 * f1_score(true_labels, predicted_labels, average='macro'),
+        "examples_per_sec" : len(true_labels)/max(inference_time, 1e-9),
+    }
+
+def run_benchmarking(args):
+    # Sample the dataset once so that every precision is evaluated on the same examples
+    print("Loading dataset from path", args.dataset_path)
+    benchmark_df = pd.read_csv(args.dataset_path, sep = '\t', header = None, names = ["sentence", "relationship"]).sample(frac=1, random_state = args.seed).head(args.num_examples)
+    print("Loaded a total of", len(benchmark_df.index), "examples")
+
+    all_results = []
+    for precision in args.precisions:
+        # Measure how much memory loading the model takes on top of the current process
+        gc.collect()
+        start_rss = get_rss_mb()
+        model = get_model(args.model_type, args.model_path, precision)
+        model_memory = get_rss_mb() - start_rss
+        results = evaluate_model(model, benchmark_df)
+        results["precision_type"] = precision
+        results["weights_mb"] = get_model_size_mb(model.model._predictor._model if args.model_type == "seq2rel" else model.model)
+        results["load_memory_mb"] = model_memory
+        all_results.append(results)
+        del model
+
+        print("Precision of", results["precision"])
+        print("Recall of", results["recall"])
+        print("F1 score of", results["f1"])
+    
+    # Report every precision relative to the baseline
+    baseline = all_results[0]
+    for results in all_results:
+        print(results["precision_type"], "has F1 of", round(results["f1"], 2), "(delta", round(results["f1"] - baseline["f1"], 2), ") precision of", round(results["precision"], 2), 
+            "(delta", round(results["precision"] - baseline["precision"], 2), ") recall of", round(results["recall"], 2), "(delta", round(results["recall"] - baseline["recall"], 2), ")")
+        print(results["precision_type"], "ran", round(results["examples_per_sec"], 2), "examples/sec (", round(results["examples_per_sec"]/baseline["examples_per_sec"], 2), 
+            "x baseline ) with", round(results["weights_mb"], 1), "MB of weights and", round(results["load_memory_mb"], 1), "MB of memory used by loading the model")
 
 if __name__ == "__main__":
     args = read_args()
-    run_benchmarking(args)
\ No newline at end of file
+    run_benchmarking(args)
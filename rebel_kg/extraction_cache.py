@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from sqlite_connections import *
+
+class ExtractionCache:
+
+    def __init__(self, cache_path, max_entries = 1000000, timeout = 60.0, touch_batch_size = 1000, evict_interval = 1000):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.touch_batch_size = touch_batch_size
+        self.evict_interval = evict_interval
+        self.lock = threading.Lock()
+        self.pending_touches = {}
+        self.inserts_since_evict = 0
+        self.hits, self.misses = 0, 0
+
+        cache_dir = os.path.dirname(os.path.abspath(cache_path))
+        os.makedirs(cache_dir, exist_ok = True)
+        self.connections = SqliteConnections(cache_path, [
+            """
+            CREATE TABLE IF NOT EXISTS extractions (
+                cache_key TEXT PRIMARY KEY,
+                relations TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS extractions_last_used ON extractions (last_used)"
+        ], timeout = timeout)
+        self.get_connection()
+
+    def __getstate__(self):
+        # Locks can't be sent to other processes so each process creates its own
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get_connection(self):
+        return self.connections.get()
+
+    def normalize_sentence(self, sentence):
+        return " ".join(sentence.split())
+
+    def get_key(self, model_path, gen_kwargs, sentence):
+        key_data = json.dumps([model_path, gen_kwargs, self.normalize_sentence(sentence)], sort_keys = True)
+        return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        connection = self.get_connection()
+        unique_keys = list(set(keys))
+        results = {}
+
+        # Stay below sqlite's limit on the number of bound parameters
+        for chunk_start in range(0, len(unique_keys), 500):
+            chunk_keys = unique_keys[chunk_start : chunk_start + 500]
+            placeholders = ",".join(["?"] * len(chunk_keys))
+            query_result = connection.execute(f"SELECT cache_key, relations FROM extractions WHERE cache_key IN ({placeholders})", chunk_keys)
+            for cache_key, relations in query_result:
+                results[cache_key] = relations
+
+        # Mark the hits as recently used so they survive eviction. The touches are buffered so a lookup
+        # that only hits the cache doesn't take the write lock every time.
+        if len(results) > 0:
+            current_time = time.time()
+            with self.lock:
+                for cache_key in results:
+                    self.pending_touches[cache_key] = current_time
+                should_flush = len(self.pending_touches) >= self.touch_batch_size
+            if should_flush:
+                self.flush_touches()
+
+        return {cache_key : json.loads(relations) for cache_key, relations in results.items()}
+
+    def put_many(self, key_to_relations):
+        if len(key_to_relations) == 0:
+            return
+
+        current_time = time.time()
+        rows = [(cache_key, json.dumps(relations), current_time) for cache_key, relations in key_to_relations.items()]
+        self.write_with_retry("INSERT OR REPLACE INTO extractions (cache_key, relations, last_used) VALUES (?, ?, ?)", rows)
+
+        # Counting the rows scans the table so we only check the size every evict_interval inserts
+        with self.lock:
+            self.inserts_since_evict += len(rows)
+            should_evict = self.inserts_since_evict >= self.evict_interval
+            if should_evict:
+                self.inserts_since_evict = 0
+        if should_evict:
+            self.evict()
+
+    def flush_touches(self):
+        with self.lock:
+            touches = self.pending_touches
+            self.pending_touches = {}
+        if len(touches) == 0:
+            return
+
+        self.write_with_retry("UPDATE extractions SET last_used = ? WHERE cache_key = ?",
+            [(last_used, cache_key) for cache_key, last_used in touches.items()])
+
+    def write_with_retry(self, statement, rows, max_tries = 5):
+        connection = self.get_connection()
+        num_tries = 0
+        while True:
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany(statement, rows)
+                connection.execute("COMMIT")
+                return
+            except sqlite3.OperationalError:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                num_tries += 1
+                if num_tries >= max_tries:
+                    raise
+
+    def evict(self):
+        # Drop the least recently used entries once we are over the size limit, after recording the buffered hits
+        self.flush_touches()
+        connection = self.get_connection()
+        num_entries = connection.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+        num_to_remove = num_entries - self.max_entries
+        if num_to_remove <= 0:
+            return
+
+        self.write_with_retry("""
+            DELETE FROM extractions WHERE cache_key IN (
+                SELECT cache_key FROM extractions ORDER BY last_used LIMIT ?
+            )
+        """, [(num_to_remove, )])
+
+    def get_relations_for_lines(self, model_path, gen_kwargs, lines, run_model):
+        # Look up every line and only run the model on the ones we haven't seen before
+        line_keys = [self.get_key(model_path, gen_kwargs, line) for line in lines]
+        cached_relations = self.get_many(line_keys)
+
+        missing_lines, missing_keys = [], []
+        for line, line_key in zip(lines, line_keys):
+            if line_key not in cached_relations:
+                # Mark the key as pending so duplicate lines only run once
+                cached_relations[line_key] = None
+                missing_lines.append(line)
+                missing_keys.append(line_key)
+        self.hits += len(lines) - len(missing_lines)
+        self.misses += len(missing_lines)
+
+        if len(missing_lines) > 0:
+            new_relations = dict(zip(missing_keys, run_model(missing_lines)))
+            self.put_many(new_relations)
+            cached_relations.update(new_relations)
+
+        # Give every line its own copy since callers add metadata to the relations
+        return [json.loads(json.dumps(cached_relations[line_key])) for line_key in line_keys]
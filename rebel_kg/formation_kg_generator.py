@@ -15,13 +15,16 @@ import traceback
 
 from knowledge_graph import *
 from model_wrapper import *
+from extraction_cache import *
+from paragraph_retriever import *
 
-def get_model(model_type, model_path):
+def get_model(model_type, model_path, cache = None, precision = "fp32", backend = "torch", num_threads = 0, generation_profile = DEFAULT_PROFILE):
+    # Only REBEL has an onnx backend and generation profiles, seq2rel always runs in torch with its own decoding
     model_type = model_type.strip()
     if model_type == "rebel":
-        return RebelWrapper(model_path)
+        return RebelWrapper(model_path, cache = cache, precision = precision, backend = backend, num_threads = num_threads, generation_profile = generation_profile)
     elif model_type == "seq2rel":
-        return Seq2RelWrapper(model_path)
+        return Seq2RelWrapper(model_path, cache = cache, precision = precision)
     else:
         raise Exception("Invalid model type of " + model_type)
 
@@ -83,14 +86,65 @@ def get_larger_text_for_formation(formation_name, topic = POSSIBLE_TOPICS[0], nu
         print("Encountered error getting paragraphs for formation: ", traceback.format_exc(), "for response", result_content, "with request", request_data)
         return []
 
-def get_models(model_types, model_paths):
+def get_hybrid_source(topic, num_paragraphs):
+    return "hybrid_" + topic + "_" + str(num_paragraphs)
+
+def get_hybrid_fetcher(topic, num_paragraphs):
+    async def fetch_function(session, formation_name):
+        return await fetch_hybrid_paragraphs(session, formation_name, topic, num_paragraphs)
+    return fetch_function
+
+async def fetch_hybrid_paragraphs(session, formation_name, topic, num_paragraphs = 20):
+    request_data = {
+        "topic" : topic,
+        "question" : formation_name,
+        "top_k" : num_paragraphs
+    }
+
+    # Raise on errors so they are retried instead of being stored as an empty result
+    async with session.post(HYBRID_ENDPOINT, headers = HYBRID_HEADERS, json = request_data) as response:
+        result = await response.json(content_type = None)
+    if "detail" in result:
+        raise Exception("Got result of " + str(result) + " for request " + str(request_data))
+
+    all_paragraphs = []
+    for source in result:
+        if "text" not in source or "paper_id" not in source:
+            continue
+
+        text = source["text"].replace("\n", " ")
+        all_paragraphs.append({
+            "paper_id" : source["paper_id"], 
+            "paragraph" : text
+        })
+
+    return all_paragraphs
+
+def prefetch_larger_text(formation_names, store_path, topics = POSSIBLE_TOPICS, num_paragraphs = 20, requests_per_second = 2.0, max_concurrency = 8):
+    # Fetch the paragraphs of every formation for each topic concurrently, respecting the rate limit
+    retriever = ParagraphRetriever(store_path, requests_per_second = requests_per_second, max_concurrency = max_concurrency)
+    all_paragraphs = {formation_name : [] for formation_name in formation_names}
+    for topic in topics:
+        topic_paragraphs = retriever.get_paragraphs(get_hybrid_source(topic, num_paragraphs), formation_names, get_hybrid_fetcher(topic, num_paragraphs))
+        for formation_name, paragraphs in topic_paragraphs.items():
+            all_paragraphs[formation_name].extend(paragraphs)
+
+    return all_paragraphs
+
+def get_models(model_types, model_paths, cache_path = None, precision = "fp32", backend = "torch", num_threads = 0, generation_profile = DEFAULT_PROFILE):
+    # All of the models share a single cache since the key includes the model path
+    cache = None
+    if cache_path is not None:
+        cache = ExtractionCache(cache_path)
+
     models = []
     num_models = len(model_types)
     for idx in range(num_models):
-        models.append(get_model(model_types[idx], model_paths[idx]))
+        models.append(get_model(model_types[idx], model_paths[idx], cache = cache, precision = precision, backend = backend, 
+            num_threads = num_threads, generation_profile = generation_profile))
     return models
 
-def get_kg_for_paragraphs(models, formation_paragraphs):
+def get_kg_for_paragraphs(models, formation_paragraphs, batch_size = 16):
     combined_kg = KG()
     if "matching_paragraphs" not in formation_paragraphs:
         return combined_kg
@@ -102,6 +156,7 @@ def get_kg_for_paragraphs(models, formation_paragraphs):
     
     try:
         # Iterate through each paragraph
+        all_sentences, all_paper_ids = [], []
         for paragraphs_data in matching_paragraphs:
             paper_id, paper_text = paragraphs_data["paper_id"], paragraphs_data["paragraph"]
 
@@ -110,11 +165,13 @@ def get_kg_for_paragraphs(models, formation_paragraphs):
                 curr_sentence = sentence.strip()
                 if len(curr_sentence) == 0:
                     continue
+                all_sentences.append(curr_sentence)
+                all_paper_ids.append(paper_id)
                 
-                # Pass the sentence through each model
-                for model in models:
-                    curr_kg = get_kg_for_line(model, curr_sentence, paper_id)
-                    combined_kg.merge_with_kb(curr_kg)
+        # Pass the sentences through each model in batches
+        for model in models:
+            curr_kg = get_kg_for_lines(model, all_sentences, all_paper_ids, batch_size = batch_size)
+            combined_kg.merge_with_kb(curr_kg)
 
         # Return the result
         return {
@@ -127,7 +184,7 @@ def get_kg_for_paragraphs(models, formation_paragraphs):
         }
         
 
-def get_kg_for_formation(models, formation_name, article_limit = 10, fragment_limit = 5):
+def get_kg_for_formation(models, formation_name, article_limit = 10, fragment_limit = 5, batch_size = 16):
     metrics = {}
 
     try:
@@ -146,14 +203,18 @@ def get_kg_for_formation(models, formation_name, article_limit = 10, fragment_li
         num_lines, total_words = 0, 0
         combined_kg = KG()
         start_time = time.time()
+        all_lines, all_article_ids = [], []
         for article_id, curr_line in snippets:
             curr_line = curr_line.strip()
-            for model in models:
-                curr_kg = get_kg_for_line(model, curr_line, article_id)
-                combined_kg.merge_with_kb(curr_kg)
+            all_lines.append(curr_line)
+            all_article_ids.append(article_id)
             num_lines += 1
             total_words += len(curr_line.split(" "))
 
+        for model in models:
+            curr_kg = get_kg_for_lines(model, all_lines, all_article_ids, batch_size = batch_size)
+            combined_kg.merge_with_kb(curr_kg)
+
         # Record the metrics
         metrics["avg_time_to_process_sentence"] = str(round((time.time() - start_time)/num_lines, 3)) + " seconds"
         metrics["num_lines"] = num_lines
@@ -179,15 +240,19 @@ def read_args():
     parser.add_argument('--save_path', type = str, default = None, help = "The file path we want to store the results to")
     parser.add_argument('--model_types', nargs='+', default = ["rebel"], help = "The type of models we want to use")
     parser.add_argument('--model_paths', nargs = '+', default = ["Babelscape/rebel-large"], help = "The path to the model weights we want to use")
+    parser.add_argument('--batch_size', type = int, default = 16, help = "The number of spans we want to pass through the model at once")
+    parser.add_argument('--extraction_cache', type = str, default = None, help = "The sqlite file used to cache extracted relations across runs")
+    parser.add_argument('--precision', type = str, default = "fp32", choices = PRECISIONS, help = "The precision the model weights are run in")
+    parser.add_argument('--generation_profile', type = str, default = DEFAULT_PROFILE, help = "The REBEL generation profile, one of " + str(GENERATION_PROFILES) + " where k is the number of beams")
     return parser.parse_args()
 
 def main():
     # Load the model
     args = read_args()
-    models = get_models(args.model_types, args.model_paths)
+    models = get_models(args.model_types, args.model_paths, args.extraction_cache, precision = args.precision, generation_profile = args.generation_profile)
 
     # Get the prediction
-    result = get_kg_for_formation(models, args.formation, args.article_limit, args.fragment_limit)
+    result = get_kg_for_formation(models, args.formation, args.article_limit, args.fragment_limit, args.batch_size)
 
     # Save the result
     if args.save_path is not None:
@@ -14,7 +14,8 @@ arguments = {
     "formation" : "The formation we want to get the knowledge graph for",
     "model_types" : f"A comma seperated list of the models we want to use to generate kg. Valid options: seq2rel, rebel. Default: {DEFAULT_MODEL}",
     "article_limit" : f"The number of articles we want to get snippets from. Default: {DEFAULT_ARTICLE_LIMIT}",
-    "snippets_limit" : f"The maximum number of snippets we should get per article: Default: {DEFAULT_SNIPPEETS_LIMIT}"
+    "snippets_limit" : f"The maximum number of snippets we should get per article: Default: {DEFAULT_SNIPPEETS_LIMIT}",
+    "generation_profile" : f"The REBEL generation profile, one of {GENERATION_PROFILES} where k is the number of beams. Default: {DEFAULT_PROFILE}"
 }
 
 model_paths = {
@@ -23,23 +24,36 @@ model_paths = {
 }
 
 cache_dir = "formation_cache"
+SHARE_MODEL_WEIGHTS = True
+extraction_cache_path = os.path.join(cache_dir, "extraction_cache.sqlite")
 
 # Create the processing pool
 model_wrappers = dict()
-def pool_init(workers_loaded):
+def load_model_wrappers():
+    loaded_wrappers = {}
+    extraction_cache = ExtractionCache(extraction_cache_path)
     for model_name in model_paths: 
         curr_model_path = model_paths[model_name]
         if model_name == "seq2rel":
-            model_wrappers[model_name] = Seq2RelWrapper(curr_model_path)
+            loaded_wrappers[model_name] = Seq2RelWrapper(curr_model_path, cache = extraction_cache)
         elif model_name == "rebel":
-            model_wrappers[model_name] = RebelWrapper(curr_model_path)
+            loaded_wrappers[model_name] = RebelWrapper(curr_model_path, cache = extraction_cache)
         else:
             raise Exception(f"Invalid model name of {model_name}")
     
+    return loaded_wrappers
+
+def pool_init(workers_loaded, shared_wrappers = None):
+    # Reuse the weights loaded by the parent if they are shared, otherwise load our own copy
+    if shared_wrappers is not None:
+        model_wrappers.update(shared_wrappers)
+    else:
+        model_wrappers.update(load_model_wrappers())
+    
     with workers_loaded.get_lock():
         workers_loaded.value += 1
 
-def pool_worker(snippets, models_to_use):
+def pool_worker(snippets, models_to_use, profile):
     # Create the worker kg
     worker_kg = KG()
     if len(snippets) == 0:
@@ -51,16 +65,20 @@ def pool_worker(snippets, models_to_use):
         curr_worker_models.append(model_wrappers[model_name])
     
     # Get the kg for the provided snippets 
-    for article_id, curr_line in snippets:
-        curr_line = curr_line.strip()
-        for model in curr_worker_models:
-            line_kg = get_kg_for_line(model, curr_line, article_id)
-            worker_kg.merge_with_kb(line_kg)
+    all_article_ids = [article_id for article_id, _ in snippets]
+    all_lines = [curr_line.strip() for _, curr_line in snippets]
+    for model in curr_worker_models:
+        model_kg = get_kg_for_lines(model, all_lines, all_article_ids, profile = profile)
+        worker_kg.merge_with_kb(model_kg)
 
     return worker_kg
 
+shared_wrappers = None
+if SHARE_MODEL_WEIGHTS:
+    shared_wrappers = {model_name : wrapper.share_memory() for model_name, wrapper in load_model_wrappers().items()}
+
 workers_loaded = multiprocessing.Value('i', 0)
-kg_worker_pool = multiprocessing.Pool(processes = MAX_PROCESSES, initializer=pool_init, initargs=(workers_loaded, ))
+kg_worker_pool = multiprocessing.Pool(processes = MAX_PROCESSES, initializer=pool_init, initargs=(workers_loaded, shared_wrappers, ))
 
 # Create the flask app
 app = Flask(__name__)
@@ -102,6 +120,18 @@ def kg_getter():
                 "reason" : f"Invalid model type of {model}"
             })
     
+    # Check the generation profile
+    profile = param_values["generation_profile"]
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    try:
+        get_generation_kwargs(profile)
+    except Exception as e:
+        return jsonify({
+            "result" : "failure",
+            "reason" : str(e)
+        })
+
     # Read in the timings
     article_limit, snippets_limit = DEFAULT_ARTICLE_LIMIT, DEFAULT_SNIPPEETS_LIMIT
     if param_values["article_limit"] is not None:
@@ -111,7 +141,7 @@ def kg_getter():
         snippets_limit = int(param_values["snippets_limit"])
     
     # Check the cache
-    save_name = formation_name.replace(" ", "_") + "_" + ",".join(models_to_use) + "_" + str(article_limit) + "_" + str(snippets_limit) + ".json"
+    save_name = formation_name.replace(" ", "_") + "_" + ",".join(models_to_use) + "_" + str(article_limit) + "_" + str(snippets_limit) + "_" + profile + ".json"
     save_path = os.path.join(cache_dir, save_name)
     if os.path.exists(save_path):
         with open(save_path, 'r') as reader:
@@ -130,7 +160,7 @@ def kg_getter():
     expected_results = []
     snippets_per_worker = np.array_split(np.array(snippets), MAX_PROCESSES)
     for curr_snippets in snippets_per_worker:
-        result = kg_worker_pool.apply_async(pool_worker, (list(curr_snippets), models_to_use, ))
+        result = kg_worker_pool.apply_async(pool_worker, (list(curr_snippets), models_to_use, profile, ))
         expected_results.append(result)
     
     # Get the kg from the workers and combine them
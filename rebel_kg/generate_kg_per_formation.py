@@ -6,6 +6,8 @@ import json
 import multiprocessing
 import weaviate
 import time
+import queue
+import threading
 
 client = weaviate.Client(
     "http://cosmos0001.chtc.wisc.edu:8080",
@@ -30,26 +32,25 @@ def get_paras_from_weaviate(entity_name, num_results = 30):
     
     return matching_paragraphs
 
-CACHE_DIR = "formation_paragraphs_cache"
-def get_paragraphs_for_entity(entity_name):
-    entity_file_name = entity_name.replace(" ", "_") + ".json"
-    cache_file_path = os.path.join(CACHE_DIR, entity_file_name)
-
-    # If the file exists in cache load it from there
-    if os.path.exists(cache_file_path):
-        with open(cache_file_path, 'r') as reader:
-            cached_paragraphs = json.load(reader)
-        return cached_paragraphs["matching_paragraphs"]
+NUM_PARAGRAPHS = 30
+def get_paragraphs_for_entity(entity_name, store):
+    # Use the paragraphs stored by the prefetch if we have them
+    source = get_weaviate_source(NUM_PARAGRAPHS)
+    stored_paragraphs = store.get(source, entity_name)
+    if stored_paragraphs is not None:
+        return stored_paragraphs
     
-    # Get the paragraphs for this entity and write to cache
-    all_paragraphs = get_paras_from_weaviate(entity_name) 
-    with open(cache_file_path, 'w+', encoding='utf-8') as writer:
-        json.dump({"matching_paragraphs" : all_paragraphs}, writer, ensure_ascii=False, indent=4)
+    # Get the paragraphs for this entity and store them
+    all_paragraphs = get_paras_from_weaviate(entity_name, NUM_PARAGRAPHS) 
+    store.put(source, entity_name, all_paragraphs)
     return all_paragraphs
 
-def process_some_formations(model_types, model_paths, save_dir, overwrite_existing, entities_to_process):
-    models_to_use = None
+def prefetch_paragraphs(entity_names, store_path, requests_per_second, max_concurrency):
+    retriever = ParagraphRetriever(store_path, requests_per_second = requests_per_second, max_concurrency = max_concurrency)
+    all_paragraphs = retriever.get_paragraphs(get_weaviate_source(NUM_PARAGRAPHS), entity_names, get_weaviate_fetcher(NUM_PARAGRAPHS))
+    print("Have paragraphs for", len(all_paragraphs), "out of", len(entity_names), "entities")
 
+def get_entities_to_process(save_dir, overwrite_existing, entities_to_process):
     for entity_name in entities_to_process:
         # Get the current entity
         entity_name = entity_name.strip()
@@ -60,29 +61,190 @@ def process_some_formations(model_types, model_paths, save_dir, overwrite_existi
         save_path = os.path.join(save_dir, entity_name.replace(" ", "_") + ".json")
         if os.path.exists(save_path) and not overwrite_existing:
             continue
-        
+
+        yield entity_name, save_path
+
+def get_entity_lines(all_paragraphs):
+    all_paragraph_txts, all_paper_ids = [], []
+    for paragraph_info in all_paragraphs:
+        paper_id, paragraph_txt = paragraph_info["paper_id"], paragraph_info["paragraph"]
+        all_paragraph_txts.append(paragraph_txt.replace("\n", " ").strip())
+        all_paper_ids.append(paper_id)
+    return all_paragraph_txts, all_paper_ids
+
+def save_entity_kg(entity_name, save_path, entity_kg):
+    print("Saving", len(entity_kg.relations), "relations for entity", entity_name)
+    json_to_save = {
+        "knowledge_graph" : entity_kg.get_json_representation()
+    }
+    with open(save_path, 'w+', encoding='utf-8') as writer:
+        json.dump(json_to_save, writer, ensure_ascii=False, indent=4)
+
+def process_some_formations(model_types, model_paths, save_dir, overwrite_existing, entities_to_process, batch_size = 16, cache_path = None, shared_models = None, 
+    paragraph_store_path = "formation_paragraphs.sqlite", model_kwargs = {}):
+    models_to_use = shared_models
+    paragraph_store = ParagraphStore(paragraph_store_path)
+
+    for entity_name, save_path in get_entities_to_process(save_dir, overwrite_existing, entities_to_process):
         if models_to_use is None:
-            models_to_use = get_models(model_types, model_paths)
+            models_to_use = get_models(model_types, model_paths, cache_path, **model_kwargs)
 
         # Get the paragraphs
-        all_paragraphs = get_paragraphs_for_entity(entity_name)
+        all_paragraphs = get_paragraphs_for_entity(entity_name, paragraph_store)
         print("Loaded", len(all_paragraphs), "paragraphs for entity", entity_name)
         entity_kg = KG()
-        for paragraph_info in all_paragraphs:
-            # Pass each paragraph through the model
-            paper_id, paragraph_txt = paragraph_info["paper_id"], paragraph_info["paragraph"]
-            paragraph_txt = paragraph_txt.replace("\n", " ").strip()
-            for model in models_to_use:
-                para_kg = get_kg_for_line(model, paragraph_txt, paper_id)
-                entity_kg.merge_with_kb(para_kg)
+        all_paragraph_txts, all_paper_ids = get_entity_lines(all_paragraphs)
+
+        # Pass all of the paragraphs through each model in batches
+        for model in models_to_use:
+            para_kg = get_kg_for_lines(model, all_paragraph_txts, all_paper_ids, batch_size = batch_size)
+            entity_kg.merge_with_kb(para_kg)
 
         # Save the results to disk
-        print("Saving", len(entity_kg.relations), "relations for entity", entity_name)
-        json_to_save = {
-            "knowledge_graph" : entity_kg.get_json_representation()
-        }
-        with open(save_path, 'w+', encoding='utf-8') as writer:
-            json.dump(json_to_save, writer, ensure_ascii=False, indent=4)
+        save_entity_kg(entity_name, save_path, entity_kg)
+
+class StageMetrics:
+
+    def __init__(self, stage_name):
+        self.stage_name = stage_name
+        self.num_items = 0
+        self.busy_time = 0.0
+        self.input_wait_time = 0.0
+        self.output_wait_time = 0.0
+
+    def get_summary(self):
+        return (self.stage_name + ": " + str(self.num_items) + " items, " + str(round(self.busy_time, 3)) + "s busy, " + 
+            str(round(self.input_wait_time, 3)) + "s waiting for input, " + str(round(self.output_wait_time, 3)) + "s blocked on output")
+
+PIPELINE_DONE = None
+def put_item(stage_queue, item, stop_event, metrics):
+    # Block while the next stage is full, this is what provides the backpressure
+    start_time = time.time()
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout = 0.5)
+            break
+        except queue.Full:
+            continue
+    metrics.output_wait_time += time.time() - start_time
+
+def get_item(stage_queue, stop_event, metrics):
+    start_time = time.time()
+    item = PIPELINE_DONE
+    while not stop_event.is_set():
+        try:
+            item = stage_queue.get(timeout = 0.5)
+            break
+        except queue.Empty:
+            continue
+    metrics.input_wait_time += time.time() - start_time
+    return item
+
+def run_stage(stage_function, stop_event, *stage_args):
+    # Stop the whole pipeline if any stage fails so the other stages don't wait forever
+    try:
+        stage_function(stop_event, *stage_args)
+    except Exception:
+        print("Pipeline stage failed due to error", traceback.format_exc())
+        stop_event.set()
+
+def prefetch_stage(stop_event, entities, paragraph_store, output_queue, metrics):
+    for entity_name, save_path in entities:
+        start_time = time.time()
+        all_paragraphs = get_paragraphs_for_entity(entity_name, paragraph_store)
+        all_paragraph_txts, all_paper_ids = get_entity_lines(all_paragraphs)
+        metrics.busy_time += time.time() - start_time
+        metrics.num_items += 1
+
+        print("Loaded", len(all_paragraphs), "paragraphs for entity", entity_name)
+        put_item(output_queue, (entity_name, save_path, all_paragraph_txts, all_paper_ids), stop_event, metrics)
+        if stop_event.is_set():
+            return
+    
+    put_item(output_queue, PIPELINE_DONE, stop_event, metrics)
+
+def inference_stage(stop_event, models_to_use, model_types, model_paths, cache_path, model_kwargs, batch_size, formations_per_batch, input_queue, output_queue, metrics):
+    # Load the models on this thread since the extraction cache connection can only be used by the thread that made it
+    if models_to_use is None:
+        models_to_use = get_models(model_types, model_paths, cache_path, **model_kwargs)
+
+    is_done = False
+    while not is_done and not stop_event.is_set():
+        # Wait for one formation and then take any others that are already fetched
+        batch_formations = []
+        item = get_item(input_queue, stop_event, metrics)
+        while item is not PIPELINE_DONE:
+            batch_formations.append(item)
+            if len(batch_formations) >= formations_per_batch:
+                break
+
+            try:
+                item = input_queue.get_nowait()
+            except queue.Empty:
+                break
+        is_done = item is PIPELINE_DONE
+        if len(batch_formations) == 0:
+            continue
+
+        # Pass the lines of all of the formations through each model together
+        start_time = time.time()
+        all_lines = [line for _, _, lines, _ in batch_formations for line in lines]
+        entity_kgs = [KG() for _ in batch_formations]
+        for model in models_to_use:
+            relations_per_line = model.get_relations_for_lines(all_lines, batch_size = batch_size)
+
+            # Split the relations back up by formation
+            line_offset = 0
+            for entity_kg, (_, _, lines, paper_ids) in zip(entity_kgs, batch_formations):
+                model_kg = KG()
+                for line, paper_id, all_relations in zip(lines, paper_ids, relations_per_line[line_offset : line_offset + len(lines)]):
+                    add_relations_to_kg(model_kg, all_relations, line, paper_id)
+                entity_kg.merge_with_kb(model_kg)
+                line_offset += len(lines)
+        metrics.busy_time += time.time() - start_time
+        metrics.num_items += len(batch_formations)
+
+        for entity_kg, (entity_name, save_path, _, _) in zip(entity_kgs, batch_formations):
+            put_item(output_queue, (entity_name, save_path, entity_kg), stop_event, metrics)
+    
+    put_item(output_queue, PIPELINE_DONE, stop_event, metrics)
+
+def writer_stage(stop_event, input_queue, metrics):
+    while True:
+        item = get_item(input_queue, stop_event, metrics)
+        if item is PIPELINE_DONE:
+            return
+
+        start_time = time.time()
+        entity_name, save_path, entity_kg = item
+        save_entity_kg(entity_name, save_path, entity_kg)
+        metrics.busy_time += time.time() - start_time
+        metrics.num_items += 1
+
+def process_formations_pipelined(model_types, model_paths, save_dir, overwrite_existing, entities_to_process, batch_size = 16, cache_path = None, shared_models = None, 
+    paragraph_store_path = "formation_paragraphs.sqlite", queue_size = 8, formations_per_batch = 4, model_kwargs = {}):
+    # Fetch, inference and write run on their own threads connected by bounded queues
+    entities = list(get_entities_to_process(save_dir, overwrite_existing, entities_to_process))
+    fetched_queue, results_queue = queue.Queue(maxsize = queue_size), queue.Queue(maxsize = queue_size)
+    stop_event = threading.Event()
+    all_metrics = [StageMetrics("prefetch"), StageMetrics("inference"), StageMetrics("writer")]
+    paragraph_store = ParagraphStore(paragraph_store_path)
+
+    start_time = time.time()
+    stage_threads = [
+        threading.Thread(target = run_stage, args = (prefetch_stage, stop_event, entities, paragraph_store, fetched_queue, all_metrics[0])),
+        threading.Thread(target = run_stage, args = (inference_stage, stop_event, shared_models, model_types, model_paths, cache_path, model_kwargs, batch_size, 
+            formations_per_batch, fetched_queue, results_queue, all_metrics[1])),
+        threading.Thread(target = run_stage, args = (writer_stage, stop_event, results_queue, all_metrics[2]))
+    ]
+    [stage_thread.start() for stage_thread in stage_threads]
+    [stage_thread.join() for stage_thread in stage_threads]
+
+    # The stage with the most busy time is the bottleneck
+    print("Processed", all_metrics[-1].num_items, "out of", len(entities), "entities in", round(time.time() - start_time, 3), "seconds")
+    for metrics in all_metrics:
+        print(metrics.get_summary())
+    print("Bottleneck stage is", max(all_metrics, key = lambda metrics : metrics.busy_time).stage_name)
 
 def load_json_file(json_file):
     with open(json_file, 'r') as reader:
@@ -100,120 +262,165 @@ def get_id_maps():
         "strat_name_map" : strat_name_map
     }
 
-def extract_for_strat_to_lith(relationship, strat_map, lith_map):
-    src, dst = relationship["head"], relationship["tail"]
-    src_lower, dst_lower = src.lower(), dst.lower()
-    
-    # See if src in strat or lith map
-    perform_swap = False
-    if src_lower in strat_map:
-        relationship["strat_name_id"] = strat_map[src_lower]
-    elif src_lower in lith_map:
-        relationship["lith_id"] = lith_map[src_lower]
-        perform_swap = True
-    
-    # See if dst in strat or lith map
-    if dst_lower in strat_map and "strat_name_id" not in relationship:
-        relationship["strat_name_id"] = strat_map[dst_lower]
-        perform_swap = True
-    elif dst_lower in lith_map and "lith_id" not in relationship:
-        relationship["lith_id"] = lith_map[dst_lower]
-    
-    if perform_swap:
-        relationship["head"] = dst
-        relationship["tail"] = src
-    
-    return "strat_name_id" in relationship or "lith_id" in relationship
-
-def extract_for_lith(relationship, lith_map):
-    src, dst = relationship["head"], relationship["tail"]
-    src_lower, dst_lower = src.lower(), dst.lower()
-    extracted_relationship = False
-
-    if src_lower in lith_map:
-        relationship["lith_id"] = lith_map[src_lower]
-        extracted_relationship = True
-    elif dst_lower in lith_map: 
-        relationship["lith_id"] = lith_map[dst_lower]
-        extracted_relationship = True
-    
-    return extracted_relationship
-
-def extract_for_lith_att(relationship, lith_map, lith_att_map):
-    # Get the map for this attribute
-    att_type = relationship["type"].replace("att_", "").replace("_", " ").lower()
-    att_map = lith_att_map[att_type]
-
-    src, dst = relationship["head"], relationship["tail"]
-    src_lower, dst_lower = src.lower(), dst.lower()
-    extracted_relationship = False
-    perform_swap = False
-
-    # See if the src is a lith or a lith attribute
-    if src_lower in lith_map:
-        relationship["lith_id"] = lith_map[src_lower]
-    elif src_lower in att_map:
-        relationship["lith_att_id"] = att_map[src_lower]
-        perform_swap = True
-    
-    # See if the dst is a lith or lith attribute
-    if dst_lower in lith_map and "lith_id" not in relationship:
-        relationship["lith_id"] = lith_map[dst_lower]
-        perform_swap = True
-    elif dst_lower in att_map and "lith_att_id" not in relationship:
-        relationship["lith_att_id"] = att_map[dst_lower]
-    
-    if perform_swap:
-        relationship["head"] = dst
-        relationship["tail"] = src
-    
-    return "lith_id" in relationship or "lith_att_id" in relationship
+def get_id_series(ids_maps):
+    # Index the id maps so that all of the names can be looked up at once
+    strat_series = pd.Series(ids_maps["strat_name_map"], dtype = object)
+    lith_series = pd.Series(ids_maps["lith_id_map"], dtype = object)
+    att_series = pd.Series([], index = pd.MultiIndex.from_arrays([[], []]), dtype = object)
+    if len(ids_maps["lith_att_map"]) > 0:
+        att_series = pd.concat({att_type : pd.Series(att_map, dtype = object) for att_type, att_map in ids_maps["lith_att_map"].items()})
+    return strat_series, lith_series, att_series
 
-def process_json_file(run_id, json_file_path, relationship_rows, sources_map, relationship_extracted, ids_maps):
-    with open(json_file_path, 'r') as reader:
-        data = json.load(reader)
-    
-    # Get the search strat id
+def lookup_ids(id_series, keys):
+    return np.asarray(keys.isin(id_series.index)), id_series.reindex(keys).to_numpy(dtype = object)
+
+def assign_pair_ids(head_first, tail_first, head_second, tail_second):
+    # The head is checked before the tail and the first map before the second. The relationship
+    # is swapped whenever that puts the entity from the first map in the tail.
+    (head_in_first, head_first_ids), (tail_in_first, tail_first_ids) = head_first, tail_first
+    (head_in_second, head_second_ids), (tail_in_second, tail_second_ids) = head_second, tail_second
+    first_from_head = head_in_first
+    second_from_head = ~head_in_first & head_in_second
+    first_from_tail = tail_in_first & ~first_from_head
+    second_from_tail = ~first_from_tail & tail_in_second & ~second_from_head
+
+    first_column = (np.where(first_from_head, head_first_ids, tail_first_ids), first_from_head | first_from_tail, first_from_head)
+    second_column = (np.where(second_from_head, head_second_ids, tail_second_ids), second_from_head | second_from_tail, second_from_head)
+    return first_column, second_column, second_from_head | first_from_tail
+
+def combine_id_columns(num_rows, *typed_columns):
+    # Each id column is a tuple of the ids, if the id is set and if it came from the head
+    ids, is_set, from_head = np.full(num_rows, None, dtype = object), np.zeros(num_rows, dtype = bool), np.zeros(num_rows, dtype = bool)
+    for type_mask, (column_ids, column_set, column_from_head) in typed_columns:
+        ids = np.where(type_mask, column_ids, ids)
+        is_set = np.where(type_mask, column_set, is_set)
+        from_head = np.where(type_mask, column_from_head, from_head)
+    return ids, is_set, from_head
+
+def get_search_strat_name(json_file_path):
     search_strat_name = os.path.basename(json_file_path).replace("_", " ")
-    search_strat_name = search_strat_name[ : search_strat_name.index(".")].strip()
-    knowledge_graph = data["knowledge_graph"]
-
-    for relationship in knowledge_graph:
-        # See if this relationship should be processed
-        relationship_type = relationship["type"]
-        extracted_relationship = False
-        if relationship_type.startswith("strat_name"):
-            extracted_relationship = extract_for_strat_to_lith(relationship, ids_maps["strat_name_map"], ids_maps["lith_id_map"])
-        elif relationship_type.startswith("lith"):
-            extracted_relationship = extract_for_lith(relationship, ids_maps["lith_id_map"])
-        elif relationship_type.startswith("att"):
-            extracted_relationship = extract_for_lith_att(relationship, ids_maps["lith_id_map"], ids_maps["lith_att_map"])
-        
-        if not extracted_relationship:
+    return search_strat_name[ : search_strat_name.index(".")].strip()
+
+def load_kg_relationships(kg_files):
+    # Load the relationships of every knowledge graph, only the columns used to look up the ids go into a dataframe
+    all_relationships, all_search_names = [], []
+    for json_file_path in kg_files:
+        knowledge_graph = load_json_file(json_file_path)["knowledge_graph"]
+        all_relationships.extend(knowledge_graph)
+        all_search_names.extend([get_search_strat_name(json_file_path)] * len(knowledge_graph))
+    
+    lookup_df = pd.DataFrame({column : [relationship[column] for relationship in all_relationships] for column in ["head", "type", "tail"]})
+    return all_relationships, lookup_df, np.array(all_search_names, dtype = object)
+
+def get_first_rows(relationships):
+    # Find the first row that has each key, rows without a key are missing it rather than holding a null
+    first_rows = {}
+    for row_idx, relationship in enumerate(relationships):
+        for key in relationship:
+            if key not in first_rows:
+                first_rows[key] = row_idx
+    return first_rows
+
+def resolve_relationship_ids(relationships_df, ids_maps):
+    strat_series, lith_series, att_series = get_id_series(ids_maps)
+    relationship_types = relationships_df["type"].astype(str)
+    head_lower, tail_lower = relationships_df["head"].astype(str).str.lower(), relationships_df["tail"].astype(str).str.lower()
+
+    # Look up every head and tail in every map
+    head_strat, tail_strat = lookup_ids(strat_series, head_lower), lookup_ids(strat_series, tail_lower)
+    head_lith, tail_lith = lookup_ids(lith_series, head_lower), lookup_ids(lith_series, tail_lower)
+    att_types = relationship_types.str.replace("att_", "", regex = False).str.replace("_", " ", regex = False).str.lower()
+    head_att = lookup_ids(att_series, pd.MultiIndex.from_arrays([att_types, head_lower]))
+    tail_att = lookup_ids(att_series, pd.MultiIndex.from_arrays([att_types, tail_lower]))
+
+    # Strat relationships map to a strat and a lith, lith relationships to a lith and attribute relationships to a lith and an attribute
+    is_strat = relationship_types.str.startswith("strat_name").to_numpy()
+    is_lith = relationship_types.str.startswith("lith").to_numpy()
+    is_att = relationship_types.str.startswith("att").to_numpy()
+    strat_column, strat_lith_column, strat_swap = assign_pair_ids(head_strat, tail_strat, head_lith, tail_lith)
+    att_lith_column, att_column, att_swap = assign_pair_ids(head_lith, tail_lith, head_att, tail_att)
+    lith_column = (np.where(head_lith[0], head_lith[1], tail_lith[1]), head_lith[0] | tail_lith[0], head_lith[0])
+
+    num_rows = len(relationships_df)
+    id_columns = {
+        "strat_name_id" : combine_id_columns(num_rows, (is_strat, strat_column)),
+        "lith_id" : combine_id_columns(num_rows, (is_strat, strat_lith_column), (is_lith, lith_column), (is_att, att_lith_column)),
+        "lith_att_id" : combine_id_columns(num_rows, (is_att, att_column))
+    }
+    perform_swap = (is_strat & strat_swap) | (is_att & att_swap)
+    return id_columns, perform_swap
+
+def get_relationships_dfs(run_id, kg_files, ids_maps):
+    all_relationships, lookup_df, search_names = load_kg_relationships(kg_files)
+    if len(all_relationships) == 0:
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+    # Only keep the relationships where at least one of the entities has a macrostrat id
+    id_columns, perform_swap = resolve_relationship_ids(lookup_df, ids_maps)
+    extracted = np.logical_or.reduce([is_set for _, is_set, _ in id_columns.values()])
+    if not extracted.any():
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+    # Build the frame from the kept rows only, so keys and dtypes of the dropped rows don't leak into it
+    extracted_relationships = [all_relationships[row_idx] for row_idx in np.flatnonzero(extracted)]
+    relationship_ids = np.arange(1, len(extracted_relationships) + 1)
+    relationship_df = pd.DataFrame(extracted_relationships).drop(columns = ["sources"])
+    swap_rows = perform_swap[extracted]
+    heads, tails = relationship_df["head"].to_numpy(dtype = object), relationship_df["tail"].to_numpy(dtype = object)
+    relationship_df["head"], relationship_df["tail"] = np.where(swap_rows, tails, heads), np.where(swap_rows, heads, tails)
+
+    # Order the columns by the row they first appear in, which is the order they would have in row by row construction
+    first_rows = get_first_rows(extracted_relationships)
+    column_order = [((first_rows[column], 0, idx), column) for idx, column in enumerate(relationship_df.columns)]
+    for column, (column_ids, is_set, from_head) in id_columns.items():
+        column_set = is_set[extracted]
+        if not column_set.any():
             continue
 
-        # Record the relationship
-        relationship_id = len(relationship_rows) + 1
-        relationship["relationship_id"] = relationship_id
-        relationship["run_id"] = run_id
-        sources = relationship.pop("sources")
-        relationship_rows.append(copy.deepcopy(relationship))
+        relationship_df[column] = np.where(column_set, column_ids[extracted], np.nan)
+        first_row = int(np.argmax(column_set))
+        column_order.append(((first_row, 1, 0 if from_head[extracted][first_row] else 1), column))
     
-        # Record the soruces
-        for source in sources:
-            article_id = source["article_id"]
-            for paragraph_txt in source["txt_used"]:
-                # Record this source if it doesn't exist
-                src_key = (article_id, paragraph_txt, search_strat_name)
-                if src_key not in sources_map:
-                    sources_map[src_key] = len(sources_map) + 1
-                
-                # Record the relationship source row
-                relationship_extracted.append({
-                    "run_id" : run_id,
-                    "relationship_id" : relationship_id,
-                    "source_id" : sources_map[src_key]
-                })
+    relationship_df["relationship_id"] = relationship_ids
+    relationship_df["run_id"] = run_id
+    column_order.extend([((0, 2, 0), "relationship_id"), ((0, 2, 1), "run_id")])
+    relationship_df = relationship_df[[column for _, column in sorted(column_order)]].infer_objects()
+
+    # Expand out every paragraph used by each relationship
+    sources_df = pd.DataFrame({
+        "relationship_id" : relationship_ids,
+        "source" : [relationship["sources"] for relationship in extracted_relationships],
+        "search_strat_name" : search_names[extracted]
+    })
+    sources_df = sources_df.explode("source").dropna(subset = ["source"])
+    sources_df["article_id"] = sources_df["source"].str.get("article_id")
+    sources_df["paragraph_txt"] = sources_df["source"].str.get("txt_used")
+    sources_df = sources_df.explode("paragraph_txt").dropna(subset = ["paragraph_txt"])
+    if len(sources_df) == 0:
+        return relationship_df, pd.DataFrame(), pd.DataFrame()
+
+    # Number the sources in the order they are first used
+    sources_df["source_id"] = sources_df.groupby(["article_id", "paragraph_txt", "search_strat_name"], sort = False, dropna = False).ngroup() + 1
+    extracted_df = pd.DataFrame({
+        "run_id" : run_id,
+        "relationship_id" : sources_df["relationship_id"].to_numpy(),
+        "source_id" : sources_df["source_id"].to_numpy()
+    })
+
+    # Get the id of the strat we searched for
+    strat_series = get_id_series(ids_maps)[0]
+    unique_sources = sources_df.drop_duplicates(subset = ["source_id"])
+    search_in_map, search_ids = lookup_ids(strat_series, unique_sources["search_strat_name"].str.lower())
+    source_rows_df = pd.DataFrame({
+        "run_id" : run_id,
+        "src_id" : unique_sources["source_id"].to_numpy(),
+        "search_strat_name" : unique_sources["search_strat_name"].to_numpy(),
+        "search_strat_id" : np.where(search_in_map, search_ids, -1),
+        "article_id" : unique_sources["article_id"].to_numpy(),
+        "paragraph_txt" : unique_sources["paragraph_txt"].to_numpy(),
+    }).infer_objects()
+
+    return relationship_df, source_rows_df, extracted_df
 
 ID_LENGTH = 15
 def main(command_args):
@@ -233,65 +440,64 @@ def main(command_args):
         entities_per_process = np.array_split(entities_arr, command_args.num_process)
         os.makedirs(command_args.save_dir, exist_ok = True)
 
+        # Fetch the paragraphs for all of the entities we need to process up front
+        entities_to_fetch = []
+        for entity_name in entities_arr:
+            save_path = os.path.join(command_args.save_dir, entity_name.replace(" ", "_") + ".json")
+            if len(entity_name) > 0 and (command_args.overwrite_existing or not os.path.exists(save_path)):
+                entities_to_fetch.append(str(entity_name))
+        prefetch_paragraphs(entities_to_fetch, command_args.paragraph_store, command_args.requests_per_second, command_args.max_concurrency)
+
+        # Load the models once and share their weights with the spawned processes
+        shared_models = None
+        model_kwargs = {"precision" : command_args.precision, "backend" : command_args.backend, "num_threads" : command_args.num_threads, 
+            "generation_profile" : command_args.generation_profile}
+        if command_args.share_weights:
+            if command_args.backend == "onnx":
+                raise Exception("onnxruntime sessions can't be sent to other processes, run the onnx backend without --share_weights")
+            shared_models = [model.share_memory() for model in get_models(command_args.model_types, command_args.model_paths, command_args.extraction_cache, 
+                **model_kwargs)]
+
         # Launch the processes
         launched_processes = []
+        process_target, process_kwargs = process_some_formations, {"model_kwargs" : model_kwargs}
+        if command_args.pipelined:
+            process_target = process_formations_pipelined
+            process_kwargs.update({"queue_size" : command_args.queue_size, "formations_per_batch" : command_args.formations_per_batch})
+
         for curr_process_entities in entities_per_process:
-            curr_proc = multiprocessing.Process(target = process_some_formations, args = (command_args.model_types, command_args.model_paths, 
-                command_args.save_dir, command_args.overwrite_existing, curr_process_entities))
+            curr_proc = multiprocessing.Process(target = process_target, args = (command_args.model_types, command_args.model_paths, 
+                command_args.save_dir, command_args.overwrite_existing, curr_process_entities, command_args.batch_size, command_args.extraction_cache, shared_models, 
+                command_args.paragraph_store), kwargs = process_kwargs)
             curr_proc.start()
             launched_processes.append(curr_proc)
         
         # Wait for them to finish
         [proc.join() for proc in launched_processes]
 
-    # Convert the knowledge graph into dataframes
+    # Convert the knowledge graphs into dataframes
     id_maps = get_id_maps()
-    relationship_rows, sources_map, relationships_extracted = [], {}, []
+    kg_files = []
     for kg_file in os.listdir(command_args.save_dir):
         if "json" not in kg_file or kg_file[0] == '.':
             continue
-        
-        file_path = os.path.join(command_args.save_dir, kg_file)
-        process_json_file(run_id, file_path, relationship_rows, sources_map, relationships_extracted, id_maps)
+        kg_files.append(os.path.join(command_args.save_dir, kg_file))
+    relationship_df, sources_df, extracted_df = get_relationships_dfs(run_id, kg_files, id_maps)
     
     # Write the relationships dfs
     relationships_save_path = os.path.join(command_args.save_dir, "relationships.csv")
-    relationship_df = pd.DataFrame(relationship_rows)
     relationship_df = relationship_df.drop_duplicates()
     print("Writing relationships to", relationships_save_path)
     relationship_df.to_csv(relationships_save_path, index = False)
 
     # Write the sources dataframe
-    sources_rows = []
-    start_name_map = id_maps["strat_name_map"]
-    for src_key in sources_map:
-        article_id, paragraph_txt, search_strat_name = src_key
-        
-        # Get the start we searched for
-        search_name_lower = search_strat_name.lower()
-        src_id = sources_map[src_key]
-        search_strat_id = -1
-        if search_name_lower in start_name_map:
-            search_strat_id = start_name_map[search_name_lower]
-
-        sources_rows.append({
-            "run_id" : run_id,
-            "src_id" : src_id,
-            "search_strat_name" : search_strat_name,
-            "search_strat_id" : search_strat_id,
-            "article_id" : article_id,
-            "paragraph_txt" : paragraph_txt,
-        })
-
     sources_save_path = os.path.join(command_args.save_dir, "sources.csv")
-    sources_df = pd.DataFrame(sources_rows)
     sources_df = sources_df.drop_duplicates()
     print("Writing sources to", sources_save_path)
     sources_df.to_csv(sources_save_path, index = False)
 
     # Write the relationships extracted
     extracted_save_path = os.path.join(command_args.save_dir, "relationships_extracted.csv")
-    extracted_df = pd.DataFrame(relationships_extracted)
     extracted_df = extracted_df.drop_duplicates()
     print("Writing relationship and sources linking table to", extracted_save_path)
     extracted_df.to_csv(extracted_save_path, index = False)
@@ -315,6 +521,19 @@ def read_args():
     parser.add_argument('--model_types', nargs='+', default = ["rebel"], help = "The type of models we want to use")
     parser.add_argument('--overwrite_existing', action='store_true', help = "Should the knowledge graph be regenerated if it already exists")
     parser.add_argument('--model_paths', nargs = '+', default = ["Babelscape/rebel-large"], help = "The path to the model weights we want to use")
+    parser.add_argument('--batch_size', type = int, default = 16, help = "The number of spans we want to pass through the model at once")
+    parser.add_argument('--share_weights', action = 'store_true', help = "Load the models once and share their weights with all of the worker processes")
+    parser.add_argument('--extraction_cache', type = str, default = None, help = "The sqlite file used to cache extracted relations across runs")
+    parser.add_argument('--precision', type = str, default = "fp32", choices = PRECISIONS, help = "The precision the model weights are run in")
+    parser.add_argument('--backend', type = str, default = "torch", choices = BACKENDS, help = "The backend used to run the REBEL encoder and decoder")
+    parser.add_argument('--num_threads', type = int, default = 0, help = "The number of threads each onnx session uses, 0 uses all of the cores")
+    parser.add_argument('--generation_profile', type = str, default = DEFAULT_PROFILE, help = "The REBEL generation profile, one of " + str(GENERATION_PROFILES) + " where k is the number of beams")
+    parser.add_argument('--paragraph_store', type = str, default = "formation_paragraphs.sqlite", help = "The sqlite file used to store the paragraphs fetched for each entity")
+    parser.add_argument('--requests_per_second', type = float, default = 2.0, help = "The maximum rate of requests sent to weaviate")
+    parser.add_argument('--max_concurrency', type = int, default = 8, help = "The maximum number of requests to weaviate in flight at once")
+    parser.add_argument('--pipelined', action = 'store_true', help = "Overlap fetching, inference and writing in each process using bounded queues")
+    parser.add_argument('--queue_size', type = int, default = 8, help = "The maximum number of formations waiting between two pipeline stages")
+    parser.add_argument('--formations_per_batch', type = int, default = 4, help = "The maximum number of formations passed through the models together")
     return parser.parse_args()
 
 if __name__ == "__main__":
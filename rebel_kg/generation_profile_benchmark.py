@@ -0,0 +1,59 @@
+import argparse
+import time
+import pandas as pd
+
+from benchmarking import evaluate_model
+from model_wrapper import *
+
+def time_batched_lines(model, lines, batch_size, profile):
+    start_time = time.time()
+    relations_per_line = model.get_relations_for_lines(lines, batch_size = batch_size, profile = profile)
+    total_time = time.time() - start_time
+    num_relations = sum([len(relations) for relations in relations_per_line])
+    return len(lines)/max(total_time, 1e-9), num_relations/max(len(lines), 1)
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model_path', type = str, required = True, help = "The directory with the finetuned REBEL model")
+    parser.add_argument('--dataset_path', type = str, required = True, help = "The tsv of the archive test split with a sentence and relationship per line")
+    parser.add_argument('--num_examples', type = int, default = 100, help = "The number of examples to run every profile on")
+    parser.add_argument('--profiles', nargs = '+', default = ["beam-3", "beam-3-single", "adaptive-3", "greedy"], 
+        help = "The generation profiles to compare, the first one is the baseline. Valid options: " + str(GENERATION_PROFILES))
+    parser.add_argument('--batch_size', type = int, default = 16, help = "The number of spans generated at once when measuring the batched throughput")
+    parser.add_argument('--precision', type = str, default = "fp32", choices = PRECISIONS, help = "The precision the model weights are run in")
+    parser.add_argument('--seed', type = int, default = 42, help = "The seed used to sample the examples")
+    return parser.parse_args()
+
+def main():
+    args = read_args()
+    for profile in args.profiles:
+        get_generation_kwargs(profile)
+
+    # Every profile runs on the same examples with the same loaded model
+    benchmark_df = pd.read_csv(args.dataset_path, sep = '\t', header = None, names = ["sentence", "relationship"]).sample(frac=1, random_state = args.seed).head(args.num_examples)
+    lines = [sentence.strip() for sentence in benchmark_df["sentence"]]
+    print("Loaded a total of", len(lines), "examples from", args.dataset_path)
+    model = RebelWrapper(args.model_path, precision = args.precision)
+
+    # Warm up the model so the first profile isn't charged for it
+    model.get_relations_in_line(lines[0])
+
+    all_results = []
+    for profile in args.profiles:
+        print("Evaluating generation profile", profile, "with kwargs", get_generation_kwargs(profile))
+        results = evaluate_model(model, benchmark_df, profile = profile)
+        results["profile"] = profile
+        results["batched_lines_per_sec"], results["relations_per_line"] = time_batched_lines(model, lines, args.batch_size, profile)
+        all_results.append(results)
+
+    # Report the precision/throughput trade-off of every profile relative to the baseline
+    baseline = all_results[0]
+    for results in all_results:
+        print(results["profile"], "has F1 of", round(results["f1"], 2), "(delta", round(results["f1"] - baseline["f1"], 2), ") precision of", round(results["precision"], 2), 
+            "(delta", round(results["precision"] - baseline["precision"], 2), ") recall of", round(results["recall"], 2), "(delta", round(results["recall"] - baseline["recall"], 2), ")")
+        print(results["profile"], "ran", round(results["examples_per_sec"], 2), "examples/sec one line at a time (", round(results["examples_per_sec"]/baseline["examples_per_sec"], 2), 
+            "x baseline ) and", round(results["batched_lines_per_sec"], 2), "lines/sec batched (", round(results["batched_lines_per_sec"]/baseline["batched_lines_per_sec"], 2), 
+            "x baseline ) with", round(results["relations_per_line"], 2), "unique relations per line")
+
+if __name__ == "__main__":
+    main()
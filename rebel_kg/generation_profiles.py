@@ -0,0 +1,52 @@
+GENERATION_PROFILES = ["greedy", "beam-k", "beam-k-single", "adaptive-k"]
+DEFAULT_PROFILE = "beam-3"
+MAX_GENERATION_LENGTH = 256
+
+# The adaptive profile allows this many output tokens for every input token on top of a fixed allowance
+ADAPTIVE_LENGTH_SCALE = 2
+ADAPTIVE_LENGTH_OFFSET = 16
+
+def parse_profile(profile):
+    # Profiles are greedy or one of beam-k, beam-k-single and adaptive-k where k is the number of beams
+    parts = str(profile).strip().split("-")
+    if parts == ["greedy"]:
+        return "greedy", 1
+
+    profile_type = parts[0]
+    if profile_type == "beam" and len(parts) == 3 and parts[2] == "single":
+        profile_type = "beam-single"
+    elif profile_type not in ["beam", "adaptive"] or len(parts) != 2:
+        raise Exception("Invalid generation profile of " + str(profile) + ", expected one of " + str(GENERATION_PROFILES))
+
+    if not parts[1].isdigit() or int(parts[1]) < 1:
+        raise Exception("Invalid number of beams in generation profile " + str(profile))
+    return profile_type, int(parts[1])
+
+def get_generation_kwargs(profile):
+    profile_type, num_beams = parse_profile(profile)
+
+    gen_kwargs = {
+        "max_length": MAX_GENERATION_LENGTH,
+        "num_beams": num_beams,
+        "num_return_sequences": num_beams if profile_type == "beam" else 1
+    }
+
+    # Beam search stops once every beam has emitted EOS instead of running until max_length. Greedy decoding
+    # ignores these so they are left out of its kwargs and its cache key
+    if num_beams > 1:
+        gen_kwargs["length_penalty"] = 0
+        gen_kwargs["early_stopping"] = True
+
+    # The adaptive max_length depends on the batch so only a marker is stored, which keeps it usable as a cache key
+    if profile_type == "adaptive":
+        gen_kwargs["adaptive_length"] = True
+    return gen_kwargs
+
+def get_batch_generation_kwargs(gen_kwargs, input_length):
+    if not gen_kwargs.get("adaptive_length", False):
+        return gen_kwargs
+
+    # Size max_length from the longest input in the batch
+    batch_kwargs = {key : value for key, value in gen_kwargs.items() if key != "adaptive_length"}
+    batch_kwargs["max_length"] = min(gen_kwargs["max_length"], ADAPTIVE_LENGTH_SCALE * input_length + ADAPTIVE_LENGTH_OFFSET)
+    return batch_kwargs
@@ -0,0 +1,113 @@
+import argparse
+import random
+import time
+
+from knowledge_graph import KG
+
+class LegacyKG():
+    # The original list based KG, kept around so we can compare the merge cost against it
+    def __init__(self):
+        self.entities = set()
+        self.relations = []
+
+    def are_relations_equal(self, r1, r2):
+        return all(r1[attr] == r2[attr] for attr in ["head", "type", "tail"])
+
+    def exists_relation(self, r1):
+        return any(self.are_relations_equal(r1, r2) for r2 in self.relations)
+
+    def merge_with_kb(self, kb2):
+        for r in kb2.relations:
+            self.add_relation(r)
+
+    def add_entity(self, e):
+        self.entities.add(e)
+
+    def merge_relations(self, r2):
+        r1 = [r for r in self.relations if self.are_relations_equal(r2, r)][0]
+        existing_srcs = r1["source"]
+
+        all_new_sources = r2["source"]
+        for article_id in all_new_sources:
+            article_sentences = all_new_sources[article_id]
+            if article_id not in existing_srcs:
+                existing_srcs[article_id] = article_sentences
+            else:
+                existing_srcs[article_id].extend(article_sentences)
+
+    def add_relation(self, r):
+        entities = [r["head"], r["tail"]]
+        for e in entities:
+            self.add_entity(e)
+
+        if not self.exists_relation(r):
+            self.relations.append(r)
+        else:
+            self.merge_relations(r)
+
+RELATION_TYPES = ["att_lithology", "att_sed_structure", "strat_name_to_lith", "lith_to_lith_group", "lith_to_lith_type",
+    "att_grains", "att_color", "att_bedform", "att_structure"]
+def generate_relation_stream(num_relations, num_entities, num_articles, seed):
+    # Generate a stream of relations where many of the (head, type, tail) triplets repeat
+    rng = random.Random(seed)
+    all_relations = []
+    for idx in range(num_relations):
+        article_id = "article_" + str(rng.randrange(num_articles))
+        all_relations.append({
+            "head" : "entity_" + str(rng.randrange(num_entities)),
+            "type" : rng.choice(RELATION_TYPES),
+            "tail" : "entity_" + str(rng.randrange(num_entities)),
+            "source" : {
+                article_id : ["sentence " + str(idx) + " of " + article_id]
+            }
+        })
+    return all_relations
+
+def get_worker_kgs(kg_class, relation_stream, num_workers):
+    # Split the stream across workers like kg_runner does and build one kg per worker
+    worker_kgs = [kg_class() for _ in range(num_workers)]
+    for idx, relation in enumerate(relation_stream):
+        worker_kgs[idx % num_workers].add_relation(relation)
+    return worker_kgs
+
+def time_merge(kg_class, args):
+    relation_stream = generate_relation_stream(args.num_relations, args.num_entities, args.num_articles, args.seed)
+
+    # Time building the per worker kgs
+    start_time = time.time()
+    worker_kgs = get_worker_kgs(kg_class, relation_stream, args.num_workers)
+    build_time = time.time() - start_time
+
+    # Time merging the worker kgs into a single kg
+    start_time = time.time()
+    merged_kg = kg_class()
+    for worker_kg in worker_kgs:
+        merged_kg.merge_with_kb(worker_kg)
+    merge_time = time.time() - start_time
+
+    return build_time, merge_time, len(merged_kg.relations)
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--num_relations', type = int, default = 20000, help = "The number of relations in the synthetic stream")
+    parser.add_argument('--num_entities', type = int, default = 2000, help = "The number of unique entities in the synthetic stream")
+    parser.add_argument('--num_articles', type = int, default = 500, help = "The number of unique articles in the synthetic stream")
+    parser.add_argument('--num_workers', type = int, default = 4, help = "The number of worker kgs to merge together")
+    parser.add_argument('--seed', type = int, default = 42, help = "The seed used to generate the synthetic stream")
+    parser.add_argument('--skip_legacy', action = 'store_true', help = "Only time the indexed kg, useful for very large streams")
+    return parser.parse_args()
+
+def main():
+    args = read_args()
+    print("Benchmarking", args.num_relations, "relations over", args.num_entities, "entities with", args.num_workers, "workers")
+
+    kg_classes = [("indexed", KG)]
+    if not args.skip_legacy:
+        kg_classes.append(("legacy", LegacyKG))
+
+    for kg_name, kg_class in kg_classes:
+        build_time, merge_time, num_unique = time_merge(kg_class, args)
+        print(kg_name, "kg: build took", round(build_time, 3), "seconds, merge took", round(merge_time, 3), "seconds, got", num_unique, "unique relations")
+
+if __name__ == "__main__":
+    main()
@@ -10,9 +10,13 @@ import multiprocessing
 import argparse
 import numpy as np
 import pandas as pd
+import json
+import heapq
+import csv
+import itertools
+import hashlib
 
-def run_for_file(model, file_path):
-    combined_kg = KG()
+def run_for_file(model, file_path, batch_size = 16):
     with open(file_path, 'r') as reader:
         all_lines = reader.readlines()
     
@@ -20,17 +24,15 @@ def run_for_file(model, file_path):
     article_id = os.path.basename(file_path)
     article_id = article_id[ : article_id.rindex(".")]
 
-    # Get the kg for all lines and use it to generate combined kg
+    # Get the kg for all lines in batches
+    lines_to_process = []
     for line in all_lines:
         curr_line = line.strip()
         if len(curr_line) == 0:
             continue
+        lines_to_process.append(curr_line)
 
-        # Add kg for this line
-        line_kg = get_kg_for_line(model, curr_line, article_id)
-        combined_kg.merge_with_kb(line_kg)
-            
-    return combined_kg
+    return get_kg_for_lines(model, lines_to_process, [article_id] * len(lines_to_process), batch_size = batch_size)
 
 def get_model(model_type, model_path):
     if model_type == "rebel":
@@ -41,12 +43,13 @@ def get_model(model_type, model_path):
         raise Exception("Invalid model type of " + model_type)
 
 # This is run by each process concurrently
-def run_for_multiple_files(all_files, share_queue, model_type, model_path):
-    model = get_model(model_type, model_path)
+def run_for_multiple_files(all_files, share_queue, model_type, model_path, batch_size = 16, model = None):
+    if model is None:
+        model = get_model(model_type, model_path)
 
     merged_kg = KG()
     for curr_file in all_files:
-        file_kg = run_for_file(model, curr_file)
+        file_kg = run_for_file(model, curr_file, batch_size)
         merged_kg.merge_with_kb(file_kg)
     
     if share_queue is None:
@@ -54,7 +57,11 @@ def run_for_multiple_files(all_files, share_queue, model_type, model_path):
 
     share_queue.put(merged_kg)
 
-def run_for_directory(dir_path, num_process, num_files, model_type, model_path):
+def load_shared_model(model_type, model_path):
+    # Load the weights once in the parent so the workers don't each need their own copy
+    return get_model(model_type, model_path).share_memory()
+
+def run_for_directory(dir_path, num_process, num_files, model_type, model_path, batch_size = 16, share_weights = False):
     # Get the files we want to process
     all_dir_files = []
     for file_name in os.listdir(dir_path):
@@ -75,12 +82,13 @@ def run_for_directory(dir_path, num_process, num_files, model_type, model_path):
     files_per_process = np.array_split(files_split, num_process)
 
     # Start a new process for each file
+    shared_model = load_shared_model(model_type, model_path) if share_weights else None
     running_processes = []
     share_queue = multiprocessing.Queue()
     for idx, process_files in enumerate(files_per_process):
         process_files = list(process_files)
         print("Process", idx, "is processing", len(process_files), "files")
-        curr_process = multiprocessing.Process(target = run_for_multiple_files, args = (process_files, share_queue, model_type, model_path, ))
+        curr_process = multiprocessing.Process(target = run_for_multiple_files, args = (process_files, share_queue, model_type, model_path, batch_size, shared_model, ))
         curr_process.start()
         running_processes.append(curr_process)
     
@@ -98,6 +106,204 @@ def run_for_directory(dir_path, num_process, num_files, model_type, model_path):
 
     return all_kg 
 
+def get_relation_key(relation):
+    return [relation["head"], relation["type"], relation["tail"]]
+
+def write_kg_shard(kg, shard_path):
+    # Write the relations sorted by key so shards can be merged without loading them
+    sorted_relations = sorted(kg.relations, key = get_relation_key)
+    tmp_path = shard_path + ".tmp"
+    with open(tmp_path, 'w', encoding = 'utf-8') as writer:
+        for relation in sorted_relations:
+            writer.write(json.dumps(relation, ensure_ascii = False) + "\n")
+    
+    # Only expose the shard once it has been completely written
+    os.replace(tmp_path, shard_path)
+
+def read_manifest(manifest_path):
+    completed_files = {}
+    if not os.path.exists(manifest_path):
+        return completed_files
+
+    with open(manifest_path, 'r') as reader:
+        for line in reader:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+
+            # Ignore a partially written last line from a crashed run
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            
+            if os.path.exists(entry["shard"]):
+                completed_files[entry["file"]] = entry["shard"]
+
+    return completed_files
+
+def record_in_manifest(manifest_path, manifest_lock, file_path, shard_path):
+    with manifest_lock:
+        with open(manifest_path, 'a') as writer:
+            writer.write(json.dumps({"file" : file_path, "shard" : shard_path}) + "\n")
+            writer.flush()
+            os.fsync(writer.fileno())
+
+def get_shard_path(shard_dir, file_path):
+    # Files with the same name in different directories or with different extensions need their own shard
+    path_hash = hashlib.sha256(os.path.abspath(file_path).encode("utf-8")).hexdigest()[ : 16]
+    file_name = os.path.basename(file_path)
+    return os.path.join(shard_dir, os.path.splitext(file_name)[0] + "_" + path_hash + ".jsonl")
+
+# This is run by each process concurrently in streaming mode
+def run_streaming_worker(work_queue, manifest_lock, shard_dir, manifest_path, model_type, model_path, batch_size, model = None):
+    if model is None:
+        model = get_model(model_type, model_path)
+
+    while True:
+        curr_file = work_queue.get()
+        if curr_file is None:
+            break
+
+        # Write the kg for this file to its own shard and record that it is done
+        file_kg = run_for_file(model, curr_file, batch_size)
+        shard_path = get_shard_path(shard_dir, curr_file)
+        write_kg_shard(file_kg, shard_path)
+        record_in_manifest(manifest_path, manifest_lock, curr_file, shard_path)
+
+def read_shard(shard_path):
+    with open(shard_path, 'r', encoding = 'utf-8') as reader:
+        for line in reader:
+            relation = json.loads(line)
+            yield get_relation_key(relation), relation
+
+def merge_sorted_shards(shard_paths, merged_path):
+    # Perform a k-way merge of the sorted shards, combining the sources of equal relations
+    shard_iterators = [read_shard(shard_path) for shard_path in shard_paths]
+    merged_stream = heapq.merge(*shard_iterators, key = lambda pair : pair[0])
+
+    tmp_path = merged_path + ".tmp"
+    with open(tmp_path, 'w', encoding = 'utf-8') as writer:
+        for _, key_relations in itertools.groupby(merged_stream, key = lambda pair : pair[0]):
+            merged_relation = None
+            for _, relation in key_relations:
+                if merged_relation is None:
+                    merged_relation = relation
+                    continue
+                
+                for article_id, article_sentences in relation["source"].items():
+                    if article_id not in merged_relation["source"]:
+                        merged_relation["source"][article_id] = article_sentences
+                    else:
+                        merged_relation["source"][article_id].extend(article_sentences)
+            
+            writer.write(json.dumps(merged_relation, ensure_ascii = False) + "\n")
+    os.replace(tmp_path, merged_path)
+
+def merge_all_shards(shard_paths, merged_path, max_open_shards = 256):
+    # Merge in multiple passes so we never have more than max_open_shards files open
+    merge_dir = os.path.join(os.path.dirname(merged_path), "merge_tmp")
+    os.makedirs(merge_dir, exist_ok = True)
+
+    curr_paths, merge_pass = list(shard_paths), 0
+    while len(curr_paths) > max_open_shards:
+        next_paths = []
+        for group_idx in range(0, len(curr_paths), max_open_shards):
+            group_path = os.path.join(merge_dir, "pass_" + str(merge_pass) + "_" + str(group_idx) + ".jsonl")
+            merge_sorted_shards(curr_paths[group_idx : group_idx + max_open_shards], group_path)
+            next_paths.append(group_path)
+        
+        # Remove the intermediate files from the previous pass
+        if merge_pass > 0:
+            for path in curr_paths:
+                os.remove(path)
+        curr_paths = next_paths
+        merge_pass += 1
+    
+    merge_sorted_shards(curr_paths, merged_path)
+    if merge_pass > 0:
+        for path in curr_paths:
+            os.remove(path)
+
+def save_merged_kg(merged_path, save_path):
+    # Stream the merged relations into the csv without loading them into memory, the network for
+    # the html still has to hold every entity and edge just like the non streaming path
+    csv_save_path = save_path[ : save_path.rindex(".")] + ".csv"
+    net, added_entities = create_network(), set()
+    num_rows = 0
+    with open(csv_save_path, 'w', newline = '', encoding = 'utf-8') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(["src", "type", "dst", "article_id", "sentence"])
+        for _, relation in read_shard(merged_path):
+            head, tail, r_type = relation["head"], relation["tail"], relation["type"]
+            if r_type in relation_name_mappings:
+                r_type = relation_name_mappings[r_type]
+
+            for entity in [head, tail]:
+                if entity not in added_entities:
+                    net.add_node(entity, shape="circle", color=ENTITY_COLOR)
+                    added_entities.add(entity)
+            net.add_edge(head, tail, title = ",".join(relation["source"].keys()), label = r_type)
+            
+            for article_id, article_sentences in relation["source"].items():
+                for sentence in article_sentences:
+                    csv_writer.writerow([head, r_type, tail, article_id, sentence])
+                    num_rows += 1
+    
+    print("Wrote", num_rows, "relationships to", csv_save_path)
+    save_network(net, save_path)
+
+def run_for_directory_streaming(dir_path, num_process, num_files, model_type, model_path, work_dir, batch_size = 16, share_weights = False):
+    # Get the files we want to process in a stable order so restarts pick the same files
+    all_dir_files = []
+    for file_name in sorted(os.listdir(dir_path)):
+        if "txt" not in file_name or file_name[0] == '.':
+            continue
+        
+        all_dir_files.append(os.path.join(dir_path, file_name))
+    
+    if num_files > 0:
+        all_dir_files = all_dir_files[ : num_files]
+
+    # Skip the files that a previous run already completed
+    shard_dir = os.path.join(work_dir, "shards")
+    os.makedirs(shard_dir, exist_ok = True)
+    manifest_path = os.path.join(work_dir, "manifest.jsonl")
+    completed_files = read_manifest(manifest_path)
+    remaining_files = [file_path for file_path in all_dir_files if file_path not in completed_files]
+    print("Processing", len(remaining_files), "files with", len(all_dir_files) - len(remaining_files), "already completed")
+
+    # Have the workers pull files from a shared queue
+    if len(remaining_files) > 0:
+        num_process = max(1, min(num_process, len(remaining_files)))
+        work_queue = multiprocessing.Queue()
+        for file_path in remaining_files:
+            work_queue.put(file_path)
+        for _ in range(num_process):
+            work_queue.put(None)
+
+        manifest_lock = multiprocessing.Lock()
+        shared_model = load_shared_model(model_type, model_path) if share_weights else None
+        running_processes = []
+        for idx in range(num_process):
+            curr_process = multiprocessing.Process(target = run_streaming_worker, args = (work_queue, manifest_lock, shard_dir, manifest_path, 
+                model_type, model_path, batch_size, shared_model, ))
+            curr_process.start()
+            running_processes.append(curr_process)
+        
+        for curr_process in running_processes:
+            curr_process.join()
+
+    # Merge the shards for all of the files we were asked to process
+    completed_files = read_manifest(manifest_path)
+    shard_paths = [completed_files[file_path] for file_path in all_dir_files if file_path in completed_files]
+    if len(shard_paths) < len(all_dir_files):
+        print("Only", len(shard_paths), "of", len(all_dir_files), "files completed, rerun to resume the remaining files")
+
+    merged_path = os.path.join(work_dir, "merged_kg.jsonl")
+    merge_all_shards(shard_paths, merged_path)
+    return merged_path
+
 def read_args():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('--directory', type= str, default = "", help = "The directory containing the text corpus we want to process")
@@ -107,6 +313,9 @@ def read_args():
     parser.add_argument('--save', type = str, required = True, help = "The html file we want to save the network in")
     parser.add_argument('--model_type', type = str, default = "rebel", help = "The type of model we want to use")
     parser.add_argument('--model_path', type = str, default = "Babelscape/rebel-large", help = "The path to the model weights we want to use")
+    parser.add_argument('--batch_size', type = int, default = 16, help = "The number of spans we want to pass through the model at once")
+    parser.add_argument('--share_weights', action = 'store_true', help = "Load the model once and share its weights with all of the worker processes")
+    parser.add_argument('--stream_dir', type = str, default = "", help = "Process the directory in streaming mode, writing per file shards and a resumable manifest to this directory")
     return parser.parse_args()
 
 relation_name_mappings = {
@@ -120,13 +329,28 @@ relation_name_mappings = {
     "att_bedform" : "has bedform of",
     "att_structure" : "has structure of",
 }
+ENTITY_COLOR = "#00FF00"
+def create_network():
+    return Network(directed=True, width="auto", height="700px", bgcolor="#eeeeee")
+
+def save_network(net, save_path):
+    net.repulsion(
+        node_distance=200,
+        central_gravity=0.2,
+        spring_length=200,
+        spring_strength=0.05,
+        damping=0.09
+    )
+    net.set_edge_smooth('dynamic')
+    net.show(save_path, notebook=False) 
+    net.barnes_hut()
+
 def save_kg(kg, save_path):
-    net = Network(directed=True, width="auto", height="700px", bgcolor="#eeeeee")
+    net = create_network()
 
     # Create the entities
-    color_entity = "#00FF00"
     for e in kg.entities:
-        net.add_node(e, shape="circle", color=color_entity)
+        net.add_node(e, shape="circle", color=ENTITY_COLOR)
     
     # Add in the edges
     df_rows = []
@@ -148,16 +372,7 @@ def save_kg(kg, save_path):
     
     print("Creating graph with", len(kg.entities), "entities and", len(df_rows), "relationships")
     # Save the file
-    net.repulsion(
-        node_distance=200,
-        central_gravity=0.2,
-        spring_length=200,
-        spring_strength=0.05,
-        damping=0.09
-    )
-    net.set_edge_smooth('dynamic')
-    net.show(save_path, notebook=False) 
-    net.barnes_hut()
+    save_network(net, save_path)
 
     # Save the kg as a csv
     csv_save_path = save_path[ : save_path.rindex(".")] + ".csv"
@@ -171,10 +386,16 @@ def main():
     elif len(args.directory) == 0 and len(args.file) == 0:
         raise argparse.ArgumentTypeError('Either a file or directory must be specified')
 
+    if len(args.directory) > 0 and len(args.stream_dir) > 0:
+        merged_path = run_for_directory_streaming(args.directory, args.processes, args.num_files, args.model_type, args.model_path, args.stream_dir, args.batch_size, 
+            args.share_weights)
+        save_merged_kg(merged_path, args.save)
+        return
+
     if len(args.directory) > 0:
-        result_kg = run_for_directory(args.directory, args.processes, args.files, args.model_type, args.model_path)
+        result_kg = run_for_directory(args.directory, args.processes, args.num_files, args.model_type, args.model_path, args.batch_size, args.share_weights)
     else:
-        result_kg = run_for_multiple_files([args.file], None, args.model_type, args.model_path)
+        result_kg = run_for_multiple_files([args.file], None, args.model_type, args.model_path, args.batch_size)
 
     save_kg(result_kg, args.save)
 
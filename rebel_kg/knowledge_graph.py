@@ -6,13 +6,25 @@ class KG():
     def __init__(self):
         self.entities = set()
         self.relations = []
+
+        # Index from (head, type, tail) to the relation stored in self.relations
+        self.relation_index = {}
+
+        # Index from article_id to the (head, type, tail) keys it provided
+        self.article_index = {}
+
+    def get_relation_key(self, r):
+        return (r["head"], r["type"], r["tail"])
         
     def are_relations_equal(self, r1, r2):
-        return all(r1[attr] == r2[attr] for attr in ["head", "type", "tail"])
+        return self.get_relation_key(r1) == self.get_relation_key(r2)
 
     def exists_relation(self, r1):
-        return any(self.are_relations_equal(r1, r2) for r2 in self.relations)
+        return self.get_relation_key(r1) in self.relation_index
     
+    def get_relation(self, r1):
+        return self.relation_index.get(self.get_relation_key(r1), None)
+
     def merge_with_kb(self, kb2):
         for r in kb2.relations:
             self.add_relation(r)
@@ -20,8 +32,25 @@ class KG():
     def add_entity(self, e):
         self.entities.add(e)
     
+    def record_sources(self, r):
+        relation_key = self.get_relation_key(r)
+        for article_id in r["source"]:
+            if article_id not in self.article_index:
+                self.article_index[article_id] = set()
+            self.article_index[article_id].add(relation_key)
+
+    def get_relations_for_article(self, article_id):
+        relation_keys = self.article_index.get(article_id, set())
+        return [self.relation_index[key] for key in relation_keys]
+
+    def get_sentences_for_article(self, article_id):
+        all_sentences = []
+        for r in self.get_relations_for_article(article_id):
+            all_sentences.extend(r["source"][article_id])
+        return all_sentences
+
     def merge_relations(self, r2):
-        r1 = [r for r in self.relations if self.are_relations_equal(r2, r)][0]
+        r1 = self.get_relation(r2)
         existing_srcs = r1["source"]
         
         all_new_sources = r2["source"]
@@ -31,6 +60,7 @@ class KG():
                 existing_srcs[article_id] = article_sentences
             else:
                 existing_srcs[article_id].extend(article_sentences)
+        self.record_sources(r2)
 
     def add_relation(self, r):
         # manage new entities
@@ -41,6 +71,8 @@ class KG():
         # manage new relation
         if not self.exists_relation(r):
             self.relations.append(r)
+            self.relation_index[self.get_relation_key(r)] = r
+            self.record_sources(r)
         else:
             self.merge_relations(r)
     
@@ -72,10 +104,7 @@ relation_name_mapper = {
     "att_bedform" : ("has bedform of", "lithology", "lith attribute bedform"),
     "att_structure" : ("has structure of", "lithology", "lith attribute structure"),
 }
-def get_kg_for_line(model, line, article_id, span_length=128):
-    kg = KG()
-    all_relations = model.get_relations_in_line(line)
-
+def add_relations_to_kg(kg, all_relations, line, article_id):
     for relation in all_relations:
         # Add in metadata if it is a relationship we care about
         relationship_type = relation["type"]
@@ -89,6 +118,18 @@ def get_kg_for_line(model, line, article_id, span_length=128):
         relation["source"] = {
             article_id: [line],
         }
-        kg.add_relation(relation)        
+        kg.add_relation(relation)
+
+def get_kg_for_line(model, line, article_id, span_length=128):
+    kg = KG()
+    all_relations = model.get_relations_in_line(line)
+    add_relations_to_kg(kg, all_relations, line, article_id)
+    return kg
 
+def get_kg_for_lines(model, lines, article_ids, batch_size = 16, profile = None):
+    # Run all of the lines through the model in batches and combine them into a single kg
+    kg = KG()
+    relations_per_line = model.get_relations_for_lines(lines, batch_size = batch_size, profile = profile)
+    for line, article_id, all_relations in zip(lines, article_ids, relations_per_line):
+        add_relations_to_kg(kg, all_relations, line, article_id)
     return kg
\ No newline at end of file
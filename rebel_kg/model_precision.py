@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+import torch
+
+PRECISIONS = ["fp32", "int8", "bf16"]
+QUANTIZED_CACHE_DIR = "quantized_models"
+
+def validate_precision(precision):
+    if precision not in PRECISIONS:
+        raise Exception("Invalid precision of " + str(precision) + ", expected one of " + str(PRECISIONS))
+
+def get_precision_key(model_path, precision):
+    # Lower precision models can give different outputs so they get their own key
+    if precision == "fp32":
+        return model_path
+    return model_path + "@" + precision
+
+def get_precision_device(precision):
+    # Dynamically quantized layers only have CPU kernels
+    if torch.cuda.is_available() and precision != "int8":
+        return "cuda:0"
+    return "cpu"
+
+def get_checkpoint_signature(model_path):
+    # A retrained or re-exported checkpoint changes the size or mtime of its files
+    if os.path.isdir(model_path):
+        file_paths = sorted(os.path.join(model_path, file_name) for file_name in os.listdir(model_path))
+    else:
+        file_paths = [model_path]
+
+    signature = []
+    for file_path in file_paths:
+        if os.path.isfile(file_path):
+            file_stats = os.stat(file_path)
+            signature.append([os.path.basename(file_path), file_stats.st_size, file_stats.st_mtime_ns])
+    return signature
+
+def get_quantized_cache_path(model_path, cache_dir = QUANTIZED_CACHE_DIR):
+    # The packed int8 weights depend on the checkpoint files and the torch version
+    if os.path.exists(model_path):
+        model_path = os.path.abspath(model_path)
+    model_source = json.dumps([model_path, get_checkpoint_signature(model_path)])
+    model_key = hashlib.sha256(model_source.encode("utf-8")).hexdigest()[ : 16]
+    return os.path.join(cache_dir, model_key + "_int8_torch_" + torch.__version__ + ".pt")
+
+def quantize_linear_layers(model):
+    # Store the Linear weights in int8 and quantize the activations on the fly
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype = torch.qint8, inplace = True)
+
+def load_quantized_model(build_model, load_model, model_path, cache_dir = QUANTIZED_CACHE_DIR):
+    # Once the quantized weights are cached we only need the architecture, not the fp32 checkpoint
+    cache_path = get_quantized_cache_path(model_path, cache_dir)
+    if os.path.exists(cache_path):
+        print("Loading quantized weights from", cache_path)
+        model = quantize_linear_layers(build_model())
+        model.load_state_dict(torch.load(cache_path, map_location = "cpu"))
+        return model
+
+    # Write to a temporary file first so other workers never read a partial file
+    model = quantize_linear_layers(load_model())
+    os.makedirs(cache_dir, exist_ok = True)
+    temp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+    torch.save(model.state_dict(), temp_path)
+    os.replace(temp_path, cache_path)
+    print("Saved quantized weights to", cache_path)
+    return model
+
+def set_model_precision(model, precision):
+    if precision == "int8":
+        return quantize_linear_layers(model)
+    elif precision == "bf16":
+        return model.to(torch.bfloat16)
+    return model
+
+def get_model_size_mb(model):
+    # The packed int8 weights are not parameters so count the state dict instead
+    num_bytes = 0
+    for value in model.state_dict().values():
+        values = value if isinstance(value, tuple) else (value, )
+        for tensor in values:
+            if isinstance(tensor, torch.Tensor):
+                num_bytes += tensor.numel() * tensor.element_size()
+    return num_bytes / (1024 * 1024)
@@ -1,80 +1,77 @@
+import os
+import sys
 import math
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+from transformers import AutoConfig, AutoModelForSeq2SeqLM, AutoTokenizer
 import torch
 from seq2rel import Seq2Rel
 from seq2rel.common import util
 
+from model_precision import *
+from onnx_backend import *
+
+# The triplet parser is shared with the finetuning code
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rebel_finetuning", "src"))
+from triplet_parser import *
+from generation_profiles import *
+
 class ModelWrapper:
 
     def __init__(self, model_path):
         raise NotImplementedError("ModelWrapper is an abstract class")
     
-    def get_relations_in_line(self, line):
+    def get_relations_in_line(self, line, profile = None):
+        raise NotImplementedError("ModelWrapper is an abstract class")
+
+    def get_relations_for_lines(self, lines, batch_size = 16, profile = None):
+        raise NotImplementedError("ModelWrapper is an abstract class")
+
+    def share_memory(self):
         raise NotImplementedError("ModelWrapper is an abstract class")
 
 class RebelWrapper:
 
-    def __init__(self, model_path):
+    def __init__(self, model_path, cache = None, precision = "fp32", quantized_cache_dir = QUANTIZED_CACHE_DIR, backend = "torch", onnx_dir = None, num_threads = 0,
+        generation_profile = DEFAULT_PROFILE):
+        validate_precision(precision)
+        validate_backend(backend)
+        if backend == "onnx" and precision != "fp32":
+            raise Exception("The onnx backend runs the exported fp32 graphs, got precision of " + precision)
+
         self.model_path = model_path
+        self.precision = precision
+        self.backend = backend
+        self.cache_key = get_precision_key(model_path, precision)
+        if backend != "torch":
+            self.cache_key += "@" + backend
+        self.cache = cache
         self.span_length = 128
+        self.generation_profile = generation_profile
+        self.gen_kwargs = get_generation_kwargs(generation_profile)
 
         print("Loading finetuned REBEL model from", self.model_path)
-        self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        self.device = get_precision_device(precision) if backend == "torch" else "cpu"
         self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(model_path).to(self.device)
-        print("Loaded REBEL model with device", self.device)
-    
-    def extract_relations_from_model_output(self, text):
-        relations = []
-        relation, subject, relation, object_ = '', '', '', ''
-        text = text.strip()
-        current = 'x'
-        text_replaced = text.replace("<s>", "").replace("<pad>", "").replace("</s>", "")
-
-        for token in text_replaced.split():
-            if token == "<triplet>":
-                current = 't'
-                if relation != '':
-                    relations.append({
-                        'head': subject.strip(),
-                        'type': relation.strip(),
-                        'tail': object_.strip()
-                    })
-                    relation = ''
-                subject = ''
-            elif token == "<subj>":
-                current = 's'
-                if relation != '':
-                    relations.append({
-                        'head': subject.strip(),
-                        'type': relation.strip(),
-                        'tail': object_.strip()
-                    })
-                object_ = ''
-            elif token == "<obj>":
-                current = 'o'
-                relation = ''
-            else:
-                if current == 't':
-                    subject += ' ' + token
-                elif current == 's':
-                    object_ += ' ' + token
-                elif current == 'o':
-                    relation += ' ' + token
-
-        if subject != '' and relation != '' and object_ != '':
-            relations.append({
-                'head': subject.strip(),
-                'type': relation.strip(),
-                "model_used" : "rebel",
-                'tail': object_.strip()
-            })
+        self.triplet_parser = TripletParser(self.tokenizer)
+        if precision == "int8":
+            self.model = load_quantized_model(lambda : AutoModelForSeq2SeqLM.from_config(AutoConfig.from_pretrained(model_path)), 
+                lambda : AutoModelForSeq2SeqLM.from_pretrained(model_path), model_path, quantized_cache_dir)
+        else:
+            self.model = set_model_precision(AutoModelForSeq2SeqLM.from_pretrained(model_path), precision)
+        self.model = self.model.to(self.device)
+        if backend == "onnx":
+            onnx_dir = onnx_dir if onnx_dir is not None else get_onnx_dir(model_path)
+            self.model = use_onnx_backend(self.model, onnx_dir, num_threads)
+        print("Loaded REBEL model with device", self.device, "precision", precision, "and backend", backend)
 
-        return relations
+    def share_memory(self):
+        # Move the weights into shared memory so forked or spawned workers reuse this copy
+        self.model.eval()
+        self.model.share_memory()
+        return self
     
-    def get_relations_in_line(self, line):
+    def get_span_inputs(self, line):
         # tokenize whole text
-        inputs = self.tokenizer([line], return_tensors="pt").to(self.device)
+        inputs = self.tokenizer([line], return_tensors="pt")
 
         # compute span boundaries
         num_tokens = len(inputs["input_ids"][0])
@@ -93,70 +90,177 @@ class RebelWrapper:
                     for boundary in spans_boundaries]
         tensor_masks = [inputs["attention_mask"][0][boundary[0]:boundary[1]]
                         for boundary in spans_boundaries]
-        inputs = {
-            "input_ids": torch.stack(tensor_ids),
-            "attention_mask": torch.stack(tensor_masks)
-        }
+        return tensor_ids, tensor_masks
+
+    def get_profile_kwargs(self, profile):
+        # Calls without a profile use the one the wrapper was created with
+        if profile is None:
+            return self.gen_kwargs
+        return get_generation_kwargs(profile)
 
+    def generate_relations(self, inputs, gen_kwargs):
         # generate relations
-        num_return_sequences = 3
-        gen_kwargs = {
-            "max_length": 256,
-            "length_penalty": 0,
-            "num_beams": 3,
-            "num_return_sequences": num_return_sequences
-        }
         generated_tokens = self.model.generate(
             **inputs,
-            **gen_kwargs,
+            **get_batch_generation_kwargs(gen_kwargs, inputs["input_ids"].shape[1]),
         )
 
-        # decode relations
-        decoded_preds = self.tokenizer.batch_decode(generated_tokens, skip_special_tokens=False)
+        # parse relations from the generated ids
+        all_relations = self.triplet_parser.extract_triplets_batch(generated_tokens)
+        for relations in all_relations:
+            for relation in relations:
+                relation["model_used"] = "rebel"
+        return all_relations
+
+    def get_relations_in_line(self, line, profile = None):
+        if self.cache is not None:
+            return self.get_relations_for_lines([line], profile = profile)[0]
+
+        tensor_ids, tensor_masks = self.get_span_inputs(line)
+        inputs = {
+            "input_ids": torch.stack(tensor_ids).to(self.device),
+            "attention_mask": torch.stack(tensor_masks).to(self.device)
+        }
+
         all_relations = []
-        for sentence_pred in decoded_preds:
-            relations = self.extract_relations_from_model_output(sentence_pred)
+        for relations in self.generate_relations(inputs, self.get_profile_kwargs(profile)):
             all_relations.extend(relations)
         
-        return all_relations
+        # The returned beams of a span often contain the same relation
+        return deduplicate_triplets(all_relations)
+
+    def pad_spans(self, tensor_ids, tensor_masks):
+        max_length = max(len(span_ids) for span_ids in tensor_ids)
+        padded_ids = torch.full((len(tensor_ids), max_length), self.tokenizer.pad_token_id, dtype = tensor_ids[0].dtype)
+        padded_masks = torch.zeros((len(tensor_masks), max_length), dtype = tensor_masks[0].dtype)
+        for idx in range(len(tensor_ids)):
+            span_length = len(tensor_ids[idx])
+            padded_ids[idx, : span_length] = tensor_ids[idx]
+            padded_masks[idx, : span_length] = tensor_masks[idx]
+
+        return {
+            "input_ids": padded_ids.to(self.device),
+            "attention_mask": padded_masks.to(self.device)
+        }
+
+    def get_relations_for_lines(self, lines, batch_size = 16, profile = None):
+        gen_kwargs = self.get_profile_kwargs(profile)
+        if self.cache is not None:
+            return self.cache.get_relations_for_lines(self.cache_key, gen_kwargs, lines,
+                lambda missing_lines : self.run_model_for_lines(missing_lines, batch_size, gen_kwargs))
+
+        return self.run_model_for_lines(lines, batch_size, gen_kwargs)
+
+    def run_model_for_lines(self, lines, batch_size, gen_kwargs):
+        # Break every line into spans and remember which line each span came from
+        all_spans = []
+        for line_idx, line in enumerate(lines):
+            tensor_ids, tensor_masks = self.get_span_inputs(line)
+            for span_ids, span_mask in zip(tensor_ids, tensor_masks):
+                all_spans.append((line_idx, span_ids, span_mask))
+
+        # Sort the spans by length so each batch needs as little padding as possible
+        all_spans.sort(key = lambda span : len(span[1]))
+        all_relations = [[] for _ in range(len(lines))]
+        num_return_sequences = gen_kwargs["num_return_sequences"]
+        for batch_start in range(0, len(all_spans), batch_size):
+            batch_spans = all_spans[batch_start : batch_start + batch_size]
+            inputs = self.pad_spans([span[1] for span in batch_spans], [span[2] for span in batch_spans])
+
+            # Generate returns num_return_sequences consecutive outputs for each span
+            batch_relations = self.generate_relations(inputs, gen_kwargs)
+            for output_idx, relations in enumerate(batch_relations):
+                line_idx = batch_spans[output_idx // num_return_sequences][0]
+                all_relations[line_idx].extend(relations)
+
+        # The returned beams of a span often contain the same relation
+        return [deduplicate_triplets(relations) for relations in all_relations]
 
 class Seq2RelWrapper:
 
-    def __init__(self, model_path):
+    def __init__(self, model_path, cache = None, precision = "fp32"):
+        validate_precision(precision)
         self.model_path = model_path
+        self.precision = precision
+        self.cache_key = get_precision_key(model_path, precision)
+        self.cache = cache
         print("Loading finetuned Seq2rel model from", self.model_path)
         cuda_device = -1
-        if torch.cuda.is_available():
+        if get_precision_device(precision) != "cpu":
             cuda_device = 1
         self.model = Seq2Rel(model_path, cuda_device = cuda_device)
-        print("Loaded finetuned Seq2rel model using cuda_device", cuda_device)
+
+        # The AllenNLP archive has to be loaded in fp32 so the precision is applied to the loaded model
+        set_model_precision(self.model._predictor._model, precision)
+        print("Loaded finetuned Seq2rel model using cuda_device", cuda_device, "and precision", precision)
+
+    def share_memory(self):
+        # Move the weights of the underlying AllenNLP model into shared memory
+        predictor_model = self.model._predictor._model
+        predictor_model.eval()
+        predictor_model.share_memory()
+        return self
     
-    def get_relations_in_line(self, line):
-        output = self.model(line)
-        all_results = util.extract_relations(output)
+    def get_relations_in_line(self, line, profile = None):
+        if self.cache is not None:
+            return self.get_relations_for_lines([line])[0]
+
+        return self.run_model_for_line(line)
 
+    def get_relations_from_result(self, curr_result):
         all_relations = []
-        for curr_result in all_results:
-            for relationship_type in curr_result:
-                # Read in the relationship
-                relationship_data = curr_result[relationship_type][0]
-                src_name, src_type = relationship_data[0]
-                dst_name, dst_type = relationship_data[1]
-                if len(src_name) == 0 or len(dst_name) == 0:
-                    continue
-
-                # Extract the node name
-                head_node = src_name[0].strip()
-                dst_node = dst_name[0].strip()
-                if "unknown" in head_node or "unknown" in dst_node:
-                    continue
-
-                # Record the relationship
-                all_relations.append({
-                    "head" : head_node,
-                    "type" : relationship_type.strip(),
-                    "model_used" : "seq2rel",
-                    "tail" : dst_node 
-                })
+        for relationship_type in curr_result:
+            # Read in the relationship
+            relationship_data = curr_result[relationship_type][0]
+            src_name, src_type = relationship_data[0]
+            dst_name, dst_type = relationship_data[1]
+            if len(src_name) == 0 or len(dst_name) == 0:
+                continue
+
+            # Extract the node name
+            head_node = src_name[0].strip()
+            dst_node = dst_name[0].strip()
+            if "unknown" in head_node or "unknown" in dst_node:
+                continue
+
+            # Record the relationship
+            all_relations.append({
+                "head" : head_node,
+                "type" : relationship_type.strip(),
+                "model_used" : "seq2rel",
+                "tail" : dst_node 
+            })
         
-        return all_relations
\ No newline at end of file
+        return all_relations
+
+    def parse_model_outputs(self, outputs):
+        # Parse all of the decoded strings for a batch in a single call
+        return [self.get_relations_from_result(curr_result) for curr_result in util.extract_relations(outputs)]
+
+    def run_model_for_line(self, line):
+        all_relations = []
+        for relations in self.parse_model_outputs(self.model(line)):
+            all_relations.extend(relations)
+        return all_relations
+
+    def run_model_for_lines(self, lines, batch_size):
+        # Sort the lines by length so each batch the predictor sees needs as little padding as possible
+        sorted_idxs = sorted(range(len(lines)), key = lambda line_idx : len(lines[line_idx].split()))
+        all_relations = [None] * len(lines)
+        for batch_start in range(0, len(sorted_idxs), batch_size):
+            batch_idxs = sorted_idxs[batch_start : batch_start + batch_size]
+            outputs = self.model([lines[line_idx] for line_idx in batch_idxs], batch_size = len(batch_idxs))
+
+            # Seq2rel returns one decoded string for each input
+            for line_idx, relations in zip(batch_idxs, self.parse_model_outputs(outputs)):
+                all_relations[line_idx] = relations
+
+        return all_relations
+
+    def get_relations_for_lines(self, lines, batch_size = 16, profile = None):
+        # The generation profiles only apply to REBEL, seq2rel decodes with the settings in its archive
+        if self.cache is not None:
+            return self.cache.get_relations_for_lines(self.cache_key, {}, lines,
+                lambda missing_lines : self.run_model_for_lines(missing_lines, batch_size))
+
+        return self.run_model_for_lines(lines, batch_size)
@@ -1,12 +1,15 @@
 import os
 from neo4j import GraphDatabase
 import argparse
+import concurrent.futures
 import pandas as pd
 
 def read_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('--login_file', type= str, required = True, help = "The path to the file containing the login info")
     parser.add_argument('--graph_file', type= str, required = True, help = "The path to the csv file containing the graph metadata")
+    parser.add_argument('--chunk_size', type= int, default = 1000, help = "The number of nodes or relationships written in each transaction")
+    parser.add_argument('--num_workers', type= int, default = 1, help = "The number of sessions writing chunks in parallel")
     return parser.parse_args()
 
 def read_neo4j_config(info_file):
@@ -22,39 +25,88 @@ def read_neo4j_config(info_file):
 
     return config
 
-def neo_create_node(tx, node_name):
+def create_node_constraint(driver):
+    # Lets every MERGE on a node name use an index lookup instead of a label scan
+    with driver.session() as session:
+        session.run("CREATE CONSTRAINT node_name_unique IF NOT EXISTS FOR (n:Node) REQUIRE n.name IS UNIQUE").consume()
+
+def escape_relationship_type(rel_type):
+    # Relationship types can't be parameters so quote them, doubling any backticks in the name
+    return "`" + str(rel_type).replace("`", "``") + "`"
+
+def neo_create_nodes(tx, node_names):
     query = (
-        f"MERGE (n:Node {{name: '{node_name}'}})"
+        "UNWIND $names AS name "
+        "MERGE (n:Node {name: name})"
     )
-    tx.run(query)
+    tx.run(query, names = node_names).consume()
 
-def create_nodes_and_relationships(tx, src, rel_type, dst, article_id, sentence):
-    escaped_sentence = sentence.replace("'", "''")
+def create_nodes_and_relationships(tx, rel_type, rows):
     query = (
-        f"MERGE (src:Node {{name: '{src}'}}) "
-        f"MERGE (dst:Node {{name: '{dst}'}}) "
-        f"MERGE (src)-[r:`{rel_type}`]->(dst) "
-        f"SET r.article_id = '{article_id}', r.sentence = '{escaped_sentence}' "
+        "UNWIND $rows AS row "
+        "MERGE (src:Node {name: row.src}) "
+        "MERGE (dst:Node {name: row.dst}) "
+        f"MERGE (src)-[r:{escape_relationship_type(rel_type)}]->(dst) "
+        "SET r.article_id = row.article_id, r.sentence = row.sentence "
     )
-    tx.run(query)
+    tx.run(query, rows = rows).consume()
+
+def get_chunks(rows, chunk_size):
+    for chunk_start in range(0, len(rows), chunk_size):
+        yield rows[chunk_start : chunk_start + chunk_size]
 
-def create_all_nodes(graph_df, driver):
+def write_chunk(driver, write_function, *write_args):
+    # Sessions aren't thread safe so every chunk gets its own
+    with driver.session() as session:
+        session.execute_write(write_function, *write_args)
+
+def write_all_chunks(driver, all_writes, num_workers):
+    if num_workers <= 1:
+        for write_args in all_writes:
+            write_chunk(driver, *write_args)
+        return
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers = num_workers) as executor:
+        all_futures = [executor.submit(write_chunk, driver, *write_args) for write_args in all_writes]
+        for future in concurrent.futures.as_completed(all_futures):
+            future.result()
+
+def get_graph_rows(graph_df):
+    # Format every value as a string like they were when inserted into the query text
+    return graph_df[["src", "type", "dst", "article_id", "sentence"]].astype(str).to_dict("records")
+
+def create_all_nodes(graph_df, driver, chunk_size = 1000, num_workers = 1):
     # Get all of the nodes
-    src_nodes = set(graph_df["src"].values)
-    dst_nodes = set(graph_df["dst"].values)
-    all_nodes = src_nodes.union(dst_nodes)
+    graph_rows = get_graph_rows(graph_df)
+    all_nodes = list(dict.fromkeys([row["src"] for row in graph_rows] + [row["dst"] for row in graph_rows]))
     print("Ensuring we have all", len(all_nodes), "nodes")
 
     # Add all of the nodes
-    with driver.session() as session:
-        for curr_node in all_nodes:
-            session.execute_write(neo_create_node, curr_node)
+    all_writes = [(neo_create_nodes, nodes_chunk) for nodes_chunk in get_chunks(all_nodes, chunk_size)]
+    write_all_chunks(driver, all_writes, num_workers)
 
-def create_all_relationships(graph_df, driver):
-    with driver.session() as session:
-        print("Creating the", len(graph_df.index), "relationships")
-        for index, row in graph_df.iterrows():
-            session.execute_write(create_nodes_and_relationships, row["src"], row["type"], row["dst"], row["article_id"], row["sentence"])
+def create_all_relationships(graph_df, driver, chunk_size = 1000, num_workers = 1):
+    # Later rows overwrite the properties of earlier ones, so only keep the last row for each relationship.
+    # This also means parallel chunks never write to the same relationship
+    unique_relationships = {}
+    for row in get_graph_rows(graph_df):
+        relationship_key = (row["src"], row["type"], row["dst"])
+        unique_relationships.pop(relationship_key, None)
+        unique_relationships[relationship_key] = row
+
+    # The relationship type is part of the query so group the rows by it
+    rows_by_type = {}
+    for row in unique_relationships.values():
+        if row["type"] not in rows_by_type:
+            rows_by_type[row["type"]] = []
+        rows_by_type[row["type"]].append({key : row[key] for key in ["src", "dst", "article_id", "sentence"]})
+
+    print("Creating the", len(unique_relationships), "relationships from", len(graph_df.index), "rows")
+    all_writes = []
+    for rel_type, type_rows in rows_by_type.items():
+        for rows_chunk in get_chunks(type_rows, chunk_size):
+            all_writes.append((create_nodes_and_relationships, rel_type, rows_chunk))
+    write_all_chunks(driver, all_writes, num_workers)
 
 def main():
     args = read_args()
@@ -62,8 +114,9 @@ def main():
     graph_df = pd.read_csv(args.graph_file)
     
     with GraphDatabase.driver(config.get('NEO4J_URI'), auth=(config.get('NEO4J_USERNAME'), config.get('NEO4J_PASSWORD'))) as driver:
-        create_all_nodes(graph_df, driver)
-        create_all_relationships(graph_df, driver)
+        create_node_constraint(driver)
+        create_all_nodes(graph_df, driver, chunk_size = args.chunk_size, num_workers = args.num_workers)
+        create_all_relationships(graph_df, driver, chunk_size = args.chunk_size, num_workers = args.num_workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+import os
+import numpy as np
+import torch
+import onnxruntime
+from transformers.modeling_outputs import BaseModelOutput, BaseModelOutputWithPastAndCrossAttentions
+
+BACKENDS = ["torch", "onnx"]
+
+# These names have to match the ones written by rebel_finetuning/src/export_onnx.py
+ENCODER_FILE = "encoder_model.onnx"
+DECODER_FILE = "decoder_model.onnx"
+DECODER_WITH_PAST_FILE = "decoder_with_past_model.onnx"
+PAST_KEY_NAMES = ["decoder.key", "decoder.value", "encoder.key", "encoder.value"]
+
+def validate_backend(backend):
+    if backend not in BACKENDS:
+        raise Exception("Invalid backend of " + str(backend) + ", expected one of " + str(BACKENDS))
+
+def get_onnx_dir(model_path):
+    return os.path.join(model_path, "onnx")
+
+def create_session(model_file, num_threads = 0):
+    # A thread count of 0 lets onnxruntime use all of the cores
+    session_options = onnxruntime.SessionOptions()
+    session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session_options.intra_op_num_threads = num_threads
+    session_options.inter_op_num_threads = 1
+    return onnxruntime.InferenceSession(model_file, sess_options = session_options, providers = ["CPUExecutionProvider"])
+
+def get_input_names(session):
+    return set([session_input.name for session_input in session.get_inputs()])
+
+def to_numpy(tensor):
+    return tensor.detach().cpu().numpy()
+
+class OnnxEncoder(torch.nn.Module):
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        self.input_names = get_input_names(session)
+
+    def forward(self, input_ids = None, attention_mask = None, return_dict = True, **kwargs):
+        inputs = {"input_ids" : to_numpy(input_ids), "attention_mask" : to_numpy(attention_mask)}
+        last_hidden_state = self.session.run(None, {name : value for name, value in inputs.items() if name in self.input_names})[0]
+        outputs = BaseModelOutput(last_hidden_state = torch.from_numpy(last_hidden_state))
+        return outputs if return_dict else outputs.to_tuple()
+
+class OnnxDecoder(torch.nn.Module):
+
+    def __init__(self, session, with_past_session, num_layers):
+        super().__init__()
+        self.session = session
+        self.with_past_session = with_past_session
+        self.num_layers = num_layers
+        self.input_names = get_input_names(session)
+        self.with_past_input_names = get_input_names(with_past_session)
+
+    def forward(self, input_ids = None, encoder_hidden_states = None, encoder_attention_mask = None, past_key_values = None, return_dict = True, **kwargs):
+        inputs = {
+            "input_ids" : to_numpy(input_ids),
+            "encoder_hidden_states" : to_numpy(encoder_hidden_states),
+            "encoder_attention_mask" : to_numpy(encoder_attention_mask)
+        }
+
+        # The first step has no cache yet, every later step feeds in the cache from the previous one
+        session, input_names = self.session, self.input_names
+        if past_key_values is not None:
+            session, input_names = self.with_past_session, self.with_past_input_names
+            for layer_idx, layer_past in enumerate(past_key_values):
+                for key_name, past_tensor in zip(PAST_KEY_NAMES, layer_past):
+                    inputs["past_key_values." + str(layer_idx) + "." + key_name] = to_numpy(past_tensor)
+
+        # Outputs are the hidden state followed by the four cache tensors of each layer
+        outputs = session.run(None, {name : value for name, value in inputs.items() if name in input_names})
+        presents = [torch.from_numpy(output) for output in outputs[1 : ]]
+        outputs = BaseModelOutputWithPastAndCrossAttentions(
+            last_hidden_state = torch.from_numpy(outputs[0]),
+            past_key_values = tuple(tuple(presents[4 * layer_idx : 4 * (layer_idx + 1)]) for layer_idx in range(self.num_layers))
+        )
+        return outputs if return_dict else outputs.to_tuple()
+
+def use_onnx_backend(model, onnx_dir, num_threads = 0):
+    # Swap the encoder and decoder for onnxruntime sessions. The embeddings, lm head and
+    # generate's beam search stay in torch so the outputs are decoded the same way.
+    for file_name in [ENCODER_FILE, DECODER_FILE, DECODER_WITH_PAST_FILE]:
+        if not os.path.exists(os.path.join(onnx_dir, file_name)):
+            raise Exception("Missing " + file_name + " in " + onnx_dir + ", export the model with rebel_finetuning/src/export_onnx.py")
+
+    model.eval()
+    model.model.encoder = OnnxEncoder(create_session(os.path.join(onnx_dir, ENCODER_FILE), num_threads))
+    model.model.decoder = OnnxDecoder(create_session(os.path.join(onnx_dir, DECODER_FILE), num_threads),
+        create_session(os.path.join(onnx_dir, DECODER_WITH_PAST_FILE), num_threads), model.config.decoder_layers)
+    return model
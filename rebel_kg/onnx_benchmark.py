@@ -0,0 +1,54 @@
+import argparse
+import time
+
+from model_wrapper import *
+from seq2rel_batch_benchmark import load_lines
+
+def time_model(model, lines, batch_size):
+    start_time = time.time()
+    all_relations = model.get_relations_for_lines(lines, batch_size = batch_size)
+    return all_relations, time.time() - start_time
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model_path', type = str, required = True, help = "The directory with the finetuned REBEL model")
+    parser.add_argument('--onnx_dir', type = str, default = None, help = "The directory with the exported onnx graphs, defaults to the onnx folder in the model directory")
+    parser.add_argument('--lines_file', type = str, default = "example.txt", help = "The file with one sentence per line to run the model on")
+    parser.add_argument('--num_lines', type = int, default = 64, help = "The number of lines to run through each backend")
+    parser.add_argument('--batch_size', type = int, default = 8, help = "The number of spans generated at once")
+    parser.add_argument('--num_threads', type = int, default = 0, help = "The number of threads used by both backends, 0 uses all of the cores")
+    return parser.parse_args()
+
+def main():
+    args = read_args()
+    lines = load_lines(args.lines_file, args.num_lines)
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
+    # Run both backends on the CPU so the comparison is fair
+    torch_model = RebelWrapper(args.model_path)
+    torch_model.device = "cpu"
+    torch_model.model = torch_model.model.to("cpu")
+    onnx_model = RebelWrapper(args.model_path, backend = "onnx", onnx_dir = args.onnx_dir, num_threads = args.num_threads)
+
+    # Warm up both backends before timing them
+    torch_model.get_relations_in_line(lines[0])
+    onnx_model.get_relations_in_line(lines[0])
+
+    torch_relations, torch_time = time_model(torch_model, lines, args.batch_size)
+    print("Torch backend for", len(lines), "lines took", round(torch_time, 3), "seconds")
+    onnx_relations, onnx_time = time_model(onnx_model, lines, args.batch_size)
+    print("Onnx backend for", len(lines), "lines took", round(onnx_time, 3), "seconds")
+
+    # Small numerical differences can flip a beam, so report every line that doesn't match
+    num_mismatches = 0
+    for line, torch_result, onnx_result in zip(lines, torch_relations, onnx_relations):
+        if torch_result != onnx_result:
+            num_mismatches += 1
+            print("Mismatch for line", line, "torch backend got", torch_result, "onnx backend got", onnx_result)
+
+    print("Got", num_mismatches, "mismatched lines out of", len(lines))
+    print("Speedup of", round(torch_time / onnx_time, 2))
+
+if __name__ == "__main__":
+    main()
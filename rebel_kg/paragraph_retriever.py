@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import time
+import traceback
+import aiohttp
+
+from sqlite_connections import *
+
+WEAVIATE_URL = "http://cosmos0001.chtc.wisc.edu:8080"
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = None
+
+    async def acquire(self):
+        # The lock has to be created inside of the running event loop
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+
+        # Waiters take turns so the tokens are handed out in order
+        async with self.lock:
+            while True:
+                curr_time = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (curr_time - self.last_refill) * self.rate)
+                self.last_refill = curr_time
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ParagraphStore:
+
+    def __init__(self, store_path, timeout = 60.0):
+        self.store_path = store_path
+        self.timeout = timeout
+
+        store_dir = os.path.dirname(os.path.abspath(store_path))
+        os.makedirs(store_dir, exist_ok = True)
+        self.connections = SqliteConnections(store_path, [
+            """
+            CREATE TABLE IF NOT EXISTS paragraphs (
+                source TEXT NOT NULL,
+                query TEXT NOT NULL,
+                paragraphs TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (source, query)
+            )
+            """
+        ], timeout = timeout)
+        self.get_connection()
+
+    def get_connection(self):
+        return self.connections.get()
+
+    def get(self, source, query):
+        query_result = self.get_connection().execute("SELECT paragraphs FROM paragraphs WHERE source = ? AND query = ?", (source, query)).fetchone()
+        if query_result is None:
+            return None
+        return json.loads(query_result[0])
+
+    def get_many(self, source, queries):
+        connection = self.get_connection()
+        unique_queries = list(set(queries))
+        results = {}
+
+        # Stay below sqlite's limit on the number of bound parameters
+        for chunk_start in range(0, len(unique_queries), 500):
+            chunk_queries = unique_queries[chunk_start : chunk_start + 500]
+            placeholders = ",".join(["?"] * len(chunk_queries))
+            query_result = connection.execute(f"SELECT query, paragraphs FROM paragraphs WHERE source = ? AND query IN ({placeholders})", [source] + chunk_queries)
+            for query, paragraphs in query_result:
+                results[query] = json.loads(paragraphs)
+
+        return results
+
+    def put(self, source, query, paragraphs):
+        self.get_connection().execute("INSERT OR REPLACE INTO paragraphs (source, query, paragraphs, fetched_at) VALUES (?, ?, ?, ?)",
+            (source, query, json.dumps(paragraphs, ensure_ascii = False), time.time()))
+
+class ParagraphRetriever:
+
+    def __init__(self, store_path, requests_per_second = 2.0, max_concurrency = 8, max_tries = 3, timeout = 60.0):
+        self.store = ParagraphStore(store_path)
+        self.requests_per_second = requests_per_second
+        self.max_concurrency = max_concurrency
+        self.max_tries = max_tries
+        self.timeout = timeout
+
+    async def fetch_with_retry(self, session, rate_limiter, semaphore, source, query, fetch_function):
+        async with semaphore:
+            for try_idx in range(self.max_tries):
+                await rate_limiter.acquire()
+                try:
+                    paragraphs = await fetch_function(session, query)
+                except Exception:
+                    print("Failed to fetch", query, "from", source, "due to error", traceback.format_exc())
+                    if try_idx < self.max_tries - 1:
+                        await asyncio.sleep(2 ** try_idx)
+                    continue
+
+                # Store every result as it arrives so an interrupted prefetch keeps its progress
+                self.store.put(source, query, paragraphs)
+                return paragraphs
+
+        return None
+
+    async def fetch_all(self, source, queries, fetch_function):
+        # Only go to the remote source for the queries we haven't stored before
+        results = self.store.get_many(source, queries)
+        missing_queries = list(dict.fromkeys([query for query in queries if query not in results]))
+        if len(missing_queries) == 0:
+            return results
+
+        print("Fetching", len(missing_queries), "queries from", source, "with", len(results), "already stored")
+        rate_limiter = TokenBucket(self.requests_per_second, max(1.0, self.requests_per_second))
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with aiohttp.ClientSession(timeout = aiohttp.ClientTimeout(total = self.timeout)) as session:
+            all_paragraphs = await asyncio.gather(*[
+                self.fetch_with_retry(session, rate_limiter, semaphore, source, query, fetch_function) for query in missing_queries
+            ])
+
+        for query, paragraphs in zip(missing_queries, all_paragraphs):
+            if paragraphs is not None:
+                results[query] = paragraphs
+
+        return results
+
+    def get_paragraphs(self, source, queries, fetch_function):
+        # Queries that failed every try are left out of the result
+        return asyncio.run(self.fetch_all(source, queries, fetch_function))
+
+def get_weaviate_source(num_results):
+    return "weaviate_passage_" + str(num_results)
+
+def get_weaviate_fetcher(num_results):
+    async def fetch_function(session, entity_name):
+        return await fetch_weaviate_passages(session, entity_name, num_results)
+    return fetch_function
+
+async def fetch_weaviate_passages(session, entity_name, num_results = 30):
+    # The same ContainsAll query the weaviate client builds, sent directly to the graphql endpoint
+    search_words = json.dumps(entity_name.strip().split(" "))
+    graphql_query = (
+        "{ Get { Passage("
+        f'where: {{operator: And, operands: [{{path: ["text_content"], operator: ContainsAll, valueString: {search_words}}}]}}, '
+        f"limit: {num_results}"
+        ") { text_content paper_id } } }"
+    )
+    headers = {"Authorization" : "Bearer " + str(os.getenv("HYBRID_API_KEY"))}
+    async with session.post(WEAVIATE_URL + "/v1/graphql", json = {"query" : graphql_query}, headers = headers) as response:
+        response.raise_for_status()
+        result = await response.json()
+
+    if "errors" in result:
+        raise Exception("Got errors " + str(result["errors"]) + " for query " + graphql_query)
+
+    matching_paragraphs = []
+    if "data" in result and "Get" in result["data"] and "Passage" in result["data"]["Get"] and result["data"]["Get"]["Passage"] is not None:
+        paragraphs = result["data"]["Get"]["Passage"]
+        for paragraph_content in paragraphs:
+            paper_id, paragraph_text = paragraph_content["paper_id"], paragraph_content["text_content"]
+            if entity_name.lower() in paragraph_text.lower():
+                matching_paragraphs.append({ "paper_id" : paper_id, "paragraph" : paragraph_text})
+
+    return matching_paragraphs
@@ -3,12 +3,14 @@ import os
 
 from formation_kg_generator import *
 
+EXTRACTION_CACHE_PATH = "extraction_cache.sqlite"
 def run_for_sample_file(save_dir, paragraphs_dir):
     # Load the formaitons to process
     with open("formation_to_process.txt", "r") as reader:
         formation_names = reader.readlines()
     
-    models_to_use = get_models(["seq2rel", "rebel"], ["/ssd/dsarda/unsupervised-kg/seq_to_rel/output/model.tar.gz", "/ssd/dsarda/unsupervised-kg/rebel_finetuning/model/archive_tuned"]) 
+    models_to_use = get_models(["seq2rel", "rebel"], ["/ssd/dsarda/unsupervised-kg/seq_to_rel/output/model.tar.gz", "/ssd/dsarda/unsupervised-kg/rebel_finetuning/model/archive_tuned"], 
+        EXTRACTION_CACHE_PATH) 
     os.makedirs(save_dir, exist_ok = True)
 
     for name in formation_names:
@@ -42,20 +44,26 @@ def run_for_sample_file(save_dir, paragraphs_dir):
         with open(save_path, 'w+', encoding='utf-8') as writer:
             json.dump(result_json["knowledge_graph"], writer, ensure_ascii=False, indent=4)
 
+PARAGRAPH_STORE_PATH = "formation_paragraphs.sqlite"
 def get_matching_paragraphs(save_dir):
     with open("formation_to_process.txt", "r") as reader:
         formation_names = reader.readlines()
     
     os.makedirs(save_dir, exist_ok = True)
-    overall_count, num_matchings, total_paragraphs = 0, 0, 0
+    formations_to_fetch = []
     for name in formation_names:
         formation_name = name.strip()
         save_path = os.path.join(save_dir, formation_name.replace(" ", "_") + ".json")
-        if os.path.exists(save_path):
-            continue
-        
+        if not os.path.exists(save_path):
+            formations_to_fetch.append(formation_name)
+
+    # Fetch the paragraphs for all of the formations at once
+    formation_paragraphs = prefetch_larger_text(formations_to_fetch, PARAGRAPH_STORE_PATH)
+    overall_count, num_matchings, total_paragraphs = 0, 0, 0
+    for formation_name in formations_to_fetch:
+        save_path = os.path.join(save_dir, formation_name.replace(" ", "_") + ".json")
         overall_count += 1
-        all_paragraphs = get_larger_text_for_formation(formation_name, topic = POSSIBLE_TOPICS[0]) + get_larger_text_for_formation(formation_name, topic = POSSIBLE_TOPICS[1])
+        all_paragraphs = formation_paragraphs[formation_name]
         if len(all_paragraphs) == 0:
             print("Failed to get result for", formation_name)
             continue
@@ -67,8 +75,6 @@ def get_matching_paragraphs(save_dir):
         print("Saving result to", save_path)
         with open(save_path, 'w+', encoding='utf-8') as writer:
             json.dump(data_to_save, writer, ensure_ascii=False, indent=4)
-        
-        time.sleep(1)
 
     print("Total matching", (100.0 * num_matchings)/overall_count)
     print("Average paragraph", total_paragraphs/num_matchings)
@@ -0,0 +1,51 @@
+import argparse
+import time
+
+from model_wrapper import *
+
+def load_lines(lines_file, num_lines):
+    with open(lines_file, 'r') as reader:
+        all_lines = [line.strip() for line in reader.readlines() if len(line.strip()) > 0]
+
+    # Repeat the lines if the file doesn't have enough of them
+    lines = []
+    while len(all_lines) > 0 and len(lines) < num_lines:
+        lines.extend(all_lines[ : num_lines - len(lines)])
+    return lines
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model_path', type = str, required = True, help = "The path to the finetuned seq2rel archive")
+    parser.add_argument('--lines_file', type = str, default = "example.txt", help = "The file with one sentence per line to run the model on")
+    parser.add_argument('--num_lines', type = int, default = 256, help = "The number of lines to run through each path")
+    parser.add_argument('--batch_size', type = int, default = 32, help = "The number of lines sent to the predictor at once")
+    return parser.parse_args()
+
+def main():
+    args = read_args()
+    lines = load_lines(args.lines_file, args.num_lines)
+    model = Seq2RelWrapper(args.model_path)
+
+    # The single line path matches the original one call per line loop
+    start_time = time.time()
+    single_relations = [model.get_relations_in_line(line) for line in lines]
+    single_time = time.time() - start_time
+    print("Single line path for", len(lines), "lines took", round(single_time, 3), "seconds")
+
+    start_time = time.time()
+    batched_relations = model.get_relations_for_lines(lines, batch_size = args.batch_size)
+    batched_time = time.time() - start_time
+    print("Batched path for", len(lines), "lines took", round(batched_time, 3), "seconds")
+
+    # Compare the relations found for each line
+    num_mismatches = 0
+    for line, single_result, batched_result in zip(lines, single_relations, batched_relations):
+        if single_result != batched_result:
+            num_mismatches += 1
+            print("Mismatch for line", line, "single path got", single_result, "batched path got", batched_result)
+
+    print("Got", num_mismatches, "mismatched lines out of", len(lines))
+    print("Speedup of", round(single_time / batched_time, 2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import asyncio
+import random
+import time
+import aiohttp
+
+def get_percentile(sorted_values, percentile):
+    if len(sorted_values) == 0:
+        return 0.0
+
+    idx = min(len(sorted_values) - 1, int(round((percentile / 100.0) * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+def load_sentences(sentences_file):
+    with open(sentences_file, 'r') as reader:
+        all_lines = [line.strip() for line in reader.readlines()]
+
+    # Handle the tab seperated benchmark datasets by only keeping the sentence
+    return [line.split("\t")[0] for line in all_lines if len(line) > 0]
+
+async def send_request(session, url, sentences, model_types):
+    start_time = time.time()
+    async with session.post(url, json = {"sentences" : sentences, "model_types" : model_types}) as response:
+        await response.json()
+        if response.status != 200:
+            raise Exception("Got status code " + str(response.status))
+
+    return time.time() - start_time
+
+async def run_load(args, all_sentences):
+    rng = random.Random(args.seed)
+    request_sentences = [rng.sample(all_sentences, min(args.sentences_per_request, len(all_sentences))) for _ in range(args.num_requests)]
+
+    # Have concurrency clients send requests back to back until all of the requests are sent
+    latencies, num_failed = [], 0
+    next_request = 0
+    async with aiohttp.ClientSession(timeout = aiohttp.ClientTimeout(total = args.timeout)) as session:
+        async def client():
+            nonlocal next_request, num_failed
+            while next_request < len(request_sentences):
+                sentences = request_sentences[next_request]
+                next_request += 1
+                try:
+                    latencies.append(await send_request(session, args.url, sentences, args.model_types))
+                except Exception as e:
+                    print("Request failed due to error", e)
+                    num_failed += 1
+
+        start_time = time.time()
+        await asyncio.gather(*[client() for _ in range(args.concurrency)])
+        total_time = time.time() - start_time
+
+    return latencies, num_failed, total_time
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--url', type = str, default = "http://127.0.0.1:9000/extract", help = "The extract endpoint of the batching server")
+    parser.add_argument('--sentences_file', type = str, required = True, help = "A file with one sentence per line to send to the server")
+    parser.add_argument('--model_types', type = str, default = "rebel", help = "A space seperated list of the models to run the sentences through")
+    parser.add_argument('--num_requests', type = int, default = 200, help = "The total number of requests to send")
+    parser.add_argument('--concurrency', type = int, default = 16, help = "The number of requests in flight at once")
+    parser.add_argument('--sentences_per_request', type = int, default = 5, help = "The number of sentences in each request")
+    parser.add_argument('--timeout', type = float, default = 600, help = "The timeout for each request in seconds")
+    parser.add_argument('--seed', type = int, default = 42, help = "The seed used to sample the sentences")
+    return parser.parse_args()
+
+def main():
+    args = read_args()
+    all_sentences = load_sentences(args.sentences_file)
+    print("Sending", args.num_requests, "requests of", args.sentences_per_request, "sentences with concurrency", args.concurrency)
+
+    latencies, num_failed, total_time = asyncio.get_event_loop().run_until_complete(run_load(args, all_sentences))
+    latencies.sort()
+    num_sentences = len(latencies) * args.sentences_per_request
+    print("Completed", len(latencies), "requests with", num_failed, "failures in", round(total_time, 3), "seconds")
+    print("p50 latency of", round(get_percentile(latencies, 50), 3), "seconds")
+    print("p99 latency of", round(get_percentile(latencies, 99), 3), "seconds")
+    print("Throughput of", round(num_sentences / total_time, 3), "sentences/sec")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import os
+import sqlite3
+import threading
+
+class SqliteConnections:
+
+    def __init__(self, db_path, schema_statements, timeout = 60.0):
+        self.db_path = db_path
+        self.schema_statements = schema_statements
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def __getstate__(self):
+        # Connections can't be sent to other processes so each process opens its own
+        state = self.__dict__.copy()
+        del state["local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def get(self):
+        # sqlite connections can only be used by the thread that created them, and a forked
+        # process inherits the thread local of its parent so the pid is checked as well
+        if getattr(self.local, "connection", None) is not None and self.local.connection_pid == os.getpid():
+            return self.local.connection
+
+        # WAL lets readers in other workers proceed while one worker is writing
+        connection = sqlite3.connect(self.db_path, timeout = self.timeout, isolation_level = None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.schema_statements:
+            connection.execute(statement)
+        self.local.connection = connection
+        self.local.connection_pid = os.getpid()
+        return connection
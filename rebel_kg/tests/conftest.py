@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The rebel_kg scripts import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The triplet parser is shared with the finetuning code, model_wrapper adds the same path
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "rebel_finetuning", "src"))
@@ -0,0 +1,40 @@
+import asyncio
+
+from batching_server import MicroBatcher
+from extraction_cache import ExtractionCache
+
+class CachedStandInModel:
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.lines_run = []
+
+    def run_model_for_lines(self, lines):
+        self.lines_run.extend(lines)
+        return [[{"head" : line, "type" : "part of", "tail" : "formation"}] for line in lines]
+
+    def get_relations_for_lines(self, lines, batch_size = 16, profile = None):
+        return self.cache.get_relations_for_lines("stand_in", {}, lines, self.run_model_for_lines)
+
+async def extract_twice(batcher, lines):
+    batcher.start()
+    try:
+        first_results = await batcher.extract(lines)
+        second_results = await batcher.extract(lines)
+    finally:
+        await batcher.stop()
+    return first_results, second_results
+
+def test_micro_batcher_with_cache_created_on_another_thread(tmp_path):
+    # The cache is opened on this thread while the batcher runs the model on its executor thread
+    model = CachedStandInModel(ExtractionCache(str(tmp_path / "cache.sqlite")))
+    batcher = MicroBatcher(model, max_batch_size = 4, max_wait_ms = 5)
+    lines = ["The Morrison Formation", "The Green River Formation"]
+
+    first_results, second_results = asyncio.run(extract_twice(batcher, lines))
+
+    expected = [[{"head" : line, "type" : "part of", "tail" : "formation"}] for line in lines]
+    assert first_results == expected
+    assert second_results == expected
+    assert model.lines_run == lines
+    assert model.cache.hits == 2 and batcher.num_sentences == 4
@@ -0,0 +1,51 @@
+import threading
+
+from extraction_cache import ExtractionCache
+
+def get_relations(line):
+    return [{"head" : line, "type" : "part of", "tail" : "formation"}]
+
+def run_model(lines):
+    return [get_relations(line) for line in lines]
+
+def test_cache_can_be_used_from_other_threads(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite"))
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(cache.get_relations_for_lines("model", {}, ["a line"], run_model))
+        except Exception as e:
+            errors.append(e)
+
+    worker_thread = threading.Thread(target = worker)
+    worker_thread.start()
+    worker_thread.join()
+
+    assert errors == []
+    assert results == [[get_relations("a line")]]
+    assert cache.get_relations_for_lines("model", {}, ["a line"], run_model) == [get_relations("a line")]
+    assert cache.hits == 1 and cache.misses == 1
+
+def test_hits_are_touched_in_batches(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite"), touch_batch_size = 3)
+    lines = ["line " + str(idx) for idx in range(3)]
+    cache.get_relations_for_lines("model", {}, lines, run_model)
+    keys = [cache.get_key("model", {}, line) for line in lines]
+
+    # Two hits stay buffered and the third one writes all of them
+    cache.get_many(keys[ : 2])
+    assert set(cache.pending_touches) == set(keys[ : 2])
+    cache.get_many(keys[2 : ])
+    assert cache.pending_touches == {}
+
+def test_eviction_runs_every_interval_and_keeps_touched_entries(tmp_path):
+    cache = ExtractionCache(str(tmp_path / "cache.sqlite"), max_entries = 2, evict_interval = 3)
+    cache.get_relations_for_lines("model", {}, ["first", "second"], run_model)
+    assert cache.get_connection().execute("SELECT COUNT(*) FROM extractions").fetchone()[0] == 2
+
+    # The hit on the first line is only buffered, but it is written before evicting
+    cache.get_relations_for_lines("model", {}, ["first"], run_model)
+    cache.get_relations_for_lines("model", {}, ["third"], run_model)
+    cached_keys = set([row[0] for row in cache.get_connection().execute("SELECT cache_key FROM extractions")])
+    assert cached_keys == set([cache.get_key("model", {}, "first"), cache.get_key("model", {}, "third")])
@@ -0,0 +1,17 @@
+from generation_profiles import *
+
+def test_greedy_kwargs_leave_out_beam_options():
+    gen_kwargs = get_generation_kwargs("greedy")
+    assert gen_kwargs == {"max_length" : MAX_GENERATION_LENGTH, "num_beams" : 1, "num_return_sequences" : 1}
+
+    # A single beam decodes greedily so it shares the greedy kwargs
+    assert get_generation_kwargs("beam-1") == gen_kwargs
+
+def test_beam_kwargs_keep_beam_options():
+    gen_kwargs = get_generation_kwargs("beam-3")
+    assert gen_kwargs["num_beams"] == 3 and gen_kwargs["num_return_sequences"] == 3
+    assert gen_kwargs["length_penalty"] == 0 and gen_kwargs["early_stopping"]
+
+    batch_kwargs = get_batch_generation_kwargs(get_generation_kwargs("adaptive-3"), 10)
+    assert batch_kwargs["max_length"] == ADAPTIVE_LENGTH_SCALE * 10 + ADAPTIVE_LENGTH_OFFSET
+    assert batch_kwargs["early_stopping"] and "adaptive_length" not in batch_kwargs
@@ -0,0 +1,57 @@
+import json
+import os
+
+import kg_runner
+
+class RecordingNetwork:
+
+    def __init__(self):
+        self.nodes, self.edges, self.saved_path = [], [], None
+
+    def add_node(self, node, **kwargs):
+        self.nodes.append(node)
+
+    def add_edge(self, head, tail, **kwargs):
+        self.edges.append((head, tail, kwargs["label"]))
+
+    def repulsion(self, **kwargs):
+        pass
+
+    def set_edge_smooth(self, smooth_type):
+        pass
+
+    def barnes_hut(self):
+        pass
+
+    def show(self, save_path, notebook = False):
+        self.saved_path = save_path
+        with open(save_path, 'w') as writer:
+            writer.write("<html></html>")
+
+def test_shard_paths_are_unique_per_input_file(tmp_path):
+    input_paths = [os.path.join("first", "corpus.txt"), os.path.join("second", "corpus.txt"), os.path.join("first", "corpus.txt.bak")]
+    shard_paths = [kg_runner.get_shard_path(str(tmp_path), input_path) for input_path in input_paths]
+    assert len(set(shard_paths)) == len(input_paths)
+    assert shard_paths[0] == kg_runner.get_shard_path(str(tmp_path), os.path.join("first", "corpus.txt"))
+
+def test_save_merged_kg_writes_csv_and_html(tmp_path, monkeypatch):
+    net = RecordingNetwork()
+    monkeypatch.setattr(kg_runner, "create_network", lambda : net)
+
+    merged_path = str(tmp_path / "merged_kg.jsonl")
+    relations = [
+        {"head" : "Morrison", "type" : "att_lithology", "tail" : "sandstone", "source" : {"a1" : ["s1", "s2"]}},
+        {"head" : "Morrison", "type" : "att_color", "tail" : "red", "source" : {"a2" : ["s3"]}}
+    ]
+    with open(merged_path, 'w') as writer:
+        for relation in relations:
+            writer.write(json.dumps(relation) + "\n")
+
+    save_path = str(tmp_path / "kg.html")
+    kg_runner.save_merged_kg(merged_path, save_path)
+
+    assert net.saved_path == save_path and os.path.exists(save_path)
+    assert net.nodes == ["Morrison", "sandstone", "red"]
+    assert net.edges == [("Morrison", "sandstone", "has lithology of"), ("Morrison", "red", "has color of")]
+    with open(str(tmp_path / "kg.csv"), 'r') as reader:
+        assert len(reader.readlines()) == 4
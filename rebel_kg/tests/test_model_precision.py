@@ -0,0 +1,38 @@
+import os
+
+from model_precision import get_quantized_cache_path
+
+def write_checkpoint(model_dir, weights):
+    os.makedirs(model_dir, exist_ok = True)
+    with open(os.path.join(model_dir, "pytorch_model.bin"), 'wb') as writer:
+        writer.write(weights)
+    with open(os.path.join(model_dir, "config.json"), 'w') as writer:
+        writer.write("{}")
+
+def test_quantized_cache_path_follows_checkpoint_files(tmp_path):
+    model_dir = str(tmp_path / "model")
+    write_checkpoint(model_dir, b"weights")
+    cache_path = get_quantized_cache_path(model_dir, str(tmp_path / "cache"))
+    assert cache_path == get_quantized_cache_path(model_dir, str(tmp_path / "cache"))
+
+    # Retraining into the same directory changes the size or mtime of the weights
+    write_checkpoint(model_dir, b"retrained weights")
+    assert get_quantized_cache_path(model_dir, str(tmp_path / "cache")) != cache_path
+
+    weights_path = os.path.join(model_dir, "pytorch_model.bin")
+    weights_stats = os.stat(weights_path)
+    retrained_path = get_quantized_cache_path(model_dir, str(tmp_path / "cache"))
+    os.utime(weights_path, ns = (weights_stats.st_atime_ns, weights_stats.st_mtime_ns + 10 ** 9))
+    assert get_quantized_cache_path(model_dir, str(tmp_path / "cache")) != retrained_path
+
+def test_quantized_cache_path_for_checkpoint_file_and_hub_name(tmp_path):
+    checkpoint_path = str(tmp_path / "model.ckpt")
+    with open(checkpoint_path, 'wb') as writer:
+        writer.write(b"weights")
+    cache_path = get_quantized_cache_path(checkpoint_path, str(tmp_path))
+    with open(checkpoint_path, 'wb') as writer:
+        writer.write(b"re-exported weights")
+    assert get_quantized_cache_path(checkpoint_path, str(tmp_path)) != cache_path
+
+    # Models that aren't on disk are only keyed by their name
+    assert get_quantized_cache_path("Babelscape/rebel-large", str(tmp_path)) == get_quantized_cache_path("Babelscape/rebel-large", str(tmp_path))
@@ -0,0 +1,96 @@
+import pandas as pd
+
+import neo4j_uploader
+
+class RecordedResult:
+
+    def consume(self):
+        return None
+
+class RecordingSession:
+
+    def __init__(self, recorded_runs):
+        self.recorded_runs = recorded_runs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def run(self, query, **parameters):
+        self.recorded_runs.append((query, parameters))
+        return RecordedResult()
+
+    def execute_write(self, write_function, *write_args):
+        # The session stands in for the transaction since both only need run
+        return write_function(self, *write_args)
+
+class RecordingDriver:
+
+    def __init__(self):
+        self.recorded_runs = []
+
+    def session(self):
+        return RecordingSession(self.recorded_runs)
+
+def get_graph_df(rows):
+    return pd.DataFrame(rows, columns = ["src", "type", "dst", "article_id", "sentence"])
+
+def test_node_constraint():
+    driver = RecordingDriver()
+    neo4j_uploader.create_node_constraint(driver)
+    assert driver.recorded_runs == [("CREATE CONSTRAINT node_name_unique IF NOT EXISTS FOR (n:Node) REQUIRE n.name IS UNIQUE", {})]
+
+def test_nodes_are_unique_and_chunked():
+    driver = RecordingDriver()
+    graph_df = get_graph_df([
+        ["a", "part of", "b", 1, "s1"],
+        ["b", "part of", "c", 2, "s2"],
+        ["a", "has color", "d", 3, "s3"]
+    ])
+    neo4j_uploader.create_all_nodes(graph_df, driver, chunk_size = 3)
+
+    assert [parameters for _, parameters in driver.recorded_runs] == [{"names" : ["a", "b", "c"]}, {"names" : ["d"]}]
+    assert all([query == "UNWIND $names AS name MERGE (n:Node {name: name})" for query, _ in driver.recorded_runs])
+
+def test_relationships_keep_last_row_grouped_by_type_and_chunked():
+    driver = RecordingDriver()
+    graph_df = get_graph_df([
+        ["a", "part of", "b", 1, "first"],
+        ["b", "part of", "c", 2, "s2"],
+        ["a", "has `color`", "d", 3, "s3"],
+        ["c", "part of", "d", 4, "s4"],
+        ["a", "part of", "b", 5, "last"]
+    ])
+    neo4j_uploader.create_all_relationships(graph_df, driver, chunk_size = 2)
+
+    # The duplicate of (a, part of, b) moves to the position of its last row with that row's properties
+    part_of_query = (
+        "UNWIND $rows AS row "
+        "MERGE (src:Node {name: row.src}) "
+        "MERGE (dst:Node {name: row.dst}) "
+        "MERGE (src)-[r:`part of`]->(dst) "
+        "SET r.article_id = row.article_id, r.sentence = row.sentence "
+    )
+    assert driver.recorded_runs == [
+        (part_of_query, {"rows" : [
+            {"src" : "b", "dst" : "c", "article_id" : "2", "sentence" : "s2"},
+            {"src" : "c", "dst" : "d", "article_id" : "4", "sentence" : "s4"}
+        ]}),
+        (part_of_query, {"rows" : [
+            {"src" : "a", "dst" : "b", "article_id" : "5", "sentence" : "last"}
+        ]}),
+        (part_of_query.replace("`part of`", "`has ``color```"), {"rows" : [
+            {"src" : "a", "dst" : "d", "article_id" : "3", "sentence" : "s3"}
+        ]})
+    ]
+
+def test_parallel_workers_issue_the_same_chunks():
+    graph_df = get_graph_df([[str(idx), "part of", str(idx + 1), idx, "s"] for idx in range(7)])
+    serial_driver, parallel_driver = RecordingDriver(), RecordingDriver()
+    neo4j_uploader.create_all_relationships(graph_df, serial_driver, chunk_size = 3)
+    neo4j_uploader.create_all_relationships(graph_df, parallel_driver, chunk_size = 3, num_workers = 3)
+
+    assert [len(parameters["rows"]) for _, parameters in serial_driver.recorded_runs] == [3, 3, 1]
+    assert sorted([str(run) for run in parallel_driver.recorded_runs]) == sorted([str(run) for run in serial_driver.recorded_runs])
@@ -0,0 +1,22 @@
+import threading
+
+from paragraph_retriever import ParagraphStore
+
+def test_paragraph_store_can_be_used_from_other_threads(tmp_path):
+    store = ParagraphStore(str(tmp_path / "paragraphs.sqlite"))
+    paragraphs = [{"paper_id" : "p1", "paragraph" : "The Morrison Formation is red."}]
+    errors = []
+
+    def worker():
+        try:
+            store.put("weaviate_30", "Morrison", paragraphs)
+        except Exception as e:
+            errors.append(e)
+
+    worker_thread = threading.Thread(target = worker)
+    worker_thread.start()
+    worker_thread.join()
+
+    assert errors == []
+    assert store.get("weaviate_30", "Morrison") == paragraphs
+    assert store.get_many("weaviate_30", ["Morrison", "Dakota"]) == {"Morrison" : paragraphs}
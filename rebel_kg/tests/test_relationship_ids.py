@@ -0,0 +1,162 @@
+import copy
+import json
+from unittest import mock
+
+import pandas as pd
+import pytest
+
+@pytest.fixture(scope = "module")
+def formation_module():
+    # The module creates a weaviate client when it is imported
+    with mock.patch("weaviate.Client"):
+        import generate_kg_per_formation
+    return generate_kg_per_formation
+
+# The row by row implementation the columnar one replaced, kept as the reference output
+def reference_strat_to_lith(relationship, strat_map, lith_map):
+    src, dst = relationship["head"], relationship["tail"]
+    src_lower, dst_lower = src.lower(), dst.lower()
+    perform_swap = False
+    if src_lower in strat_map:
+        relationship["strat_name_id"] = strat_map[src_lower]
+    elif src_lower in lith_map:
+        relationship["lith_id"] = lith_map[src_lower]
+        perform_swap = True
+
+    if dst_lower in strat_map and "strat_name_id" not in relationship:
+        relationship["strat_name_id"] = strat_map[dst_lower]
+        perform_swap = True
+    elif dst_lower in lith_map and "lith_id" not in relationship:
+        relationship["lith_id"] = lith_map[dst_lower]
+
+    if perform_swap:
+        relationship["head"], relationship["tail"] = dst, src
+    return "strat_name_id" in relationship or "lith_id" in relationship
+
+def reference_lith(relationship, lith_map):
+    src_lower, dst_lower = relationship["head"].lower(), relationship["tail"].lower()
+    if src_lower in lith_map:
+        relationship["lith_id"] = lith_map[src_lower]
+        return True
+    elif dst_lower in lith_map:
+        relationship["lith_id"] = lith_map[dst_lower]
+        return True
+    return False
+
+def reference_lith_att(relationship, lith_map, lith_att_map):
+    att_map = lith_att_map[relationship["type"].replace("att_", "").replace("_", " ").lower()]
+    src, dst = relationship["head"], relationship["tail"]
+    src_lower, dst_lower = src.lower(), dst.lower()
+    perform_swap = False
+    if src_lower in lith_map:
+        relationship["lith_id"] = lith_map[src_lower]
+    elif src_lower in att_map:
+        relationship["lith_att_id"] = att_map[src_lower]
+        perform_swap = True
+
+    if dst_lower in lith_map and "lith_id" not in relationship:
+        relationship["lith_id"] = lith_map[dst_lower]
+        perform_swap = True
+    elif dst_lower in att_map and "lith_att_id" not in relationship:
+        relationship["lith_att_id"] = att_map[dst_lower]
+
+    if perform_swap:
+        relationship["head"], relationship["tail"] = dst, src
+    return "lith_id" in relationship or "lith_att_id" in relationship
+
+def reference_dfs(formation_module, run_id, kg_files, ids_maps):
+    relationship_rows, sources_map, relationships_extracted = [], {}, []
+    for json_file_path in kg_files:
+        search_strat_name = formation_module.get_search_strat_name(json_file_path)
+        for relationship in copy.deepcopy(formation_module.load_json_file(json_file_path)["knowledge_graph"]):
+            relationship_type = relationship["type"]
+            extracted_relationship = False
+            if relationship_type.startswith("strat_name"):
+                extracted_relationship = reference_strat_to_lith(relationship, ids_maps["strat_name_map"], ids_maps["lith_id_map"])
+            elif relationship_type.startswith("lith"):
+                extracted_relationship = reference_lith(relationship, ids_maps["lith_id_map"])
+            elif relationship_type.startswith("att"):
+                extracted_relationship = reference_lith_att(relationship, ids_maps["lith_id_map"], ids_maps["lith_att_map"])
+            if not extracted_relationship:
+                continue
+
+            relationship_id = len(relationship_rows) + 1
+            relationship["relationship_id"] = relationship_id
+            relationship["run_id"] = run_id
+            sources = relationship.pop("sources")
+            relationship_rows.append(relationship)
+            for source in sources:
+                for paragraph_txt in source["txt_used"]:
+                    src_key = (source["article_id"], paragraph_txt, search_strat_name)
+                    if src_key not in sources_map:
+                        sources_map[src_key] = len(sources_map) + 1
+                    relationships_extracted.append({"run_id" : run_id, "relationship_id" : relationship_id, "source_id" : sources_map[src_key]})
+
+    sources_rows = []
+    for (article_id, paragraph_txt, search_strat_name), src_id in sources_map.items():
+        sources_rows.append({
+            "run_id" : run_id,
+            "src_id" : src_id,
+            "search_strat_name" : search_strat_name,
+            "search_strat_id" : ids_maps["strat_name_map"].get(search_strat_name.lower(), -1),
+            "article_id" : article_id,
+            "paragraph_txt" : paragraph_txt,
+        })
+    return pd.DataFrame(relationship_rows), pd.DataFrame(sources_rows), pd.DataFrame(relationships_extracted)
+
+IDS_MAPS = {
+    "strat_name_map" : {"morrison" : 11, "dakota" : 12},
+    "lith_id_map" : {"sandstone" : 21, "shale" : 22},
+    "lith_att_map" : {"color" : {"red" : 31, "grey" : 32}, "grains" : {"fine" : 41}}
+}
+
+def get_source(article_id, *paragraphs):
+    return {"article_id" : article_id, "txt_used" : list(paragraphs)}
+
+def write_kg_files(tmp_path):
+    kg_files = {
+        "Morrison_Formation.json" : [
+            # Dropped, and the only rows with model_used and confidence
+            {"head" : "Unknown", "type" : "strat_name_to_lith", "tail" : "rock", "model_used" : "rebel", "confidence" : 0.5, "sources" : [get_source("a1", "p1")]},
+            {"head" : "Morrison", "type" : "strat_name_to_lith", "tail" : "Sandstone", "sources" : [get_source("a1", "p1", "p2")]},
+            # Lith head so the relationship is swapped and lith_id comes before strat_name_id
+            {"head" : "shale", "type" : "strat_name_to_lith", "tail" : "Dakota", "sources" : [get_source("a2", "p3")]},
+            {"head" : "red", "tail" : "sandstone", "type" : "att_color", "extra" : None, "sources" : [get_source("a1", "p1")]},
+            {"head" : "other", "type" : "unknown_relation", "tail" : "thing", "sources" : [get_source("a3", "p4")]},
+        ],
+        "Dakota_Formation.json" : [
+            {"head" : "fine", "type" : "att_grains", "tail" : "nothing", "count" : 3, "sources" : [get_source("a4", "p5")]},
+            {"head" : "shale", "type" : "lith_to_lith_group", "tail" : "mudrock", "sources" : [get_source("a1", "p1"), get_source("a5")]},
+            {"head" : "grey", "type" : "att_color", "tail" : "none", "model_used" : "seq2rel", "sources" : []},
+            {"head" : "sandstone", "type" : "att_color", "tail" : "blue", "count" : 4, "sources" : [get_source("a4", "p5")]},
+        ]
+    }
+
+    paths = []
+    for file_name, knowledge_graph in kg_files.items():
+        file_path = tmp_path / file_name
+        with open(file_path, 'w') as writer:
+            json.dump({"knowledge_graph" : knowledge_graph}, writer)
+        paths.append(str(file_path))
+    return paths
+
+def test_relationships_dfs_match_row_by_row_implementation(formation_module, tmp_path):
+    kg_files = write_kg_files(tmp_path)
+    expected_dfs = reference_dfs(formation_module, "run_1", kg_files, IDS_MAPS)
+    actual_dfs = formation_module.get_relationships_dfs("run_1", kg_files, IDS_MAPS)
+
+    for expected_df, actual_df in zip(expected_dfs, actual_dfs):
+        assert list(actual_df.columns) == list(expected_df.columns)
+        assert actual_df.to_csv(index = False) == expected_df.to_csv(index = False)
+
+    # Keys that only appear on dropped rows don't make it into the output
+    assert "confidence" not in actual_dfs[0].columns
+    assert list(actual_dfs[0].columns) == ["head", "type", "tail", "strat_name_id", "lith_id", "relationship_id", "run_id", "extra", "lith_att_id", "count", "model_used"]
+
+def test_relationships_dfs_without_any_ids(formation_module, tmp_path):
+    kg_file = tmp_path / "Empty.json"
+    with open(kg_file, 'w') as writer:
+        json.dump({"knowledge_graph" : [{"head" : "a", "type" : "att_color", "tail" : "b", "model_used" : "rebel", "sources" : []}]}, writer)
+
+    relationship_df, sources_df, extracted_df = formation_module.get_relationships_dfs("run_1", [str(kg_file)], IDS_MAPS)
+    assert relationship_df.empty and sources_df.empty and extracted_df.empty
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import model_wrapper
+from extraction_cache import ExtractionCache
+
+class StandInSeq2Rel:
+    # Decodes every line to itself and records the lines of each predictor call
+    def __init__(self, model_path, cuda_device = -1):
+        self._predictor = SimpleNamespace(_model = None)
+        self.calls = []
+
+    def __call__(self, texts, batch_size = None):
+        texts = [texts] if isinstance(texts, str) else texts
+        self.calls.append(list(texts))
+        return list(texts)
+
+def extract_relations(outputs):
+    # One relation per decoded string, plus the empty and unknown entities the wrapper has to drop
+    all_results = []
+    for output in outputs:
+        words = output.split()
+        all_results.append({
+            " part of " : [((["  " + words[0] + " "], "FORMATION"), ([words[-1]], "LITHOLOGY"))],
+            "overlies" : [(([], "FORMATION"), ([words[-1]], "FORMATION"))],
+            "underlies" : [((["unknown"], "FORMATION"), ([words[0]], "FORMATION"))],
+            "count_" + str(len(words)) : [(([words[-1]], "LITHOLOGY"), ([words[0]], "FORMATION"))]
+        })
+    return all_results
+
+LINES = [
+    "Morrison Formation contains red sandstone and shale beds",
+    "Dakota sandstone",
+    "The Green River Formation overlies the Wasatch Formation in the basin",
+    "shale",
+    "Navajo sandstone is cross bedded",
+    "Mancos shale overlies the Dakota sandstone",
+    "The Kayenta Formation"
+]
+
+@pytest.fixture
+def wrapper():
+    with mock.patch.object(model_wrapper, "Seq2Rel", StandInSeq2Rel), mock.patch.object(model_wrapper, "util", SimpleNamespace(extract_relations = extract_relations)):
+        yield model_wrapper.Seq2RelWrapper("seq2rel_model")
+
+def test_batched_lines_match_single_line_path(wrapper):
+    expected_relations = [wrapper.run_model_for_line(line) for line in LINES]
+    assert all(len(relations) == 2 for relations in expected_relations)
+    assert expected_relations[0][0] == {"head" : "Morrison", "type" : "part of", "model_used" : "seq2rel", "tail" : "beds"}
+
+    wrapper.model.calls = []
+    assert wrapper.get_relations_for_lines(LINES, batch_size = 3) == expected_relations
+
+    # The lines are sent shortest first in batches of at most batch_size
+    batch_lines = [line for call in wrapper.model.calls for line in call]
+    assert [len(call) for call in wrapper.model.calls] == [3, 3, 1]
+    assert batch_lines == sorted(LINES, key = lambda line : len(line.split()))
+
+def test_cached_batched_lines_match_single_line_path(wrapper, tmp_path):
+    expected_relations = [wrapper.run_model_for_line(line) for line in LINES]
+    wrapper.cache = ExtractionCache(str(tmp_path / "cache.sqlite"))
+
+    # Only the lines that aren't cached yet go to the predictor
+    lines = LINES[ : 4] + LINES[ : 2]
+    assert wrapper.get_relations_for_lines(lines, batch_size = 2) == expected_relations[ : 4] + expected_relations[ : 2]
+    wrapper.model.calls = []
+    assert wrapper.get_relations_for_lines(LINES, batch_size = 2) == expected_relations
+    assert sorted(line for call in wrapper.model.calls for line in call) == sorted(LINES[4 : ])
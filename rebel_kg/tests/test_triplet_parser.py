@@ -0,0 +1,72 @@
+import random
+
+from triplet_parser import TripletParser, deduplicate_triplets
+
+SPECIAL_TOKENS = ["<s>", "</s>", "<pad>", "<triplet>", "<subj>", "<obj>"]
+WORD_TOKENS = ["Ġrock", "Ġsand", "stone", "Ġshale", "Ġpart", "Ġof", "ĠGreen", "River", "Ġ", "Ġlies", "Ġon"]
+VOCAB = SPECIAL_TOKENS + WORD_TOKENS
+
+class ToyTokenizer:
+    # Decodes like BART, where Ġ marks the start of a word and the added tokens are surrounded by spaces
+    bos_token_id, eos_token_id, pad_token_id = 0, 1, 2
+
+    def convert_tokens_to_ids(self, tokens):
+        return [VOCAB.index(token) for token in tokens]
+
+    def decode(self, token_ids, skip_special_tokens = False):
+        decoded = ""
+        for token_id in token_ids:
+            token = VOCAB[token_id]
+            decoded += " " + token + " " if token in SPECIAL_TOKENS else token.replace("Ġ", " ")
+        return decoded
+
+# The string parser RebelWrapper used on the batch decoded text before the id parser
+def reference_extract_triplets(text):
+    triplets = []
+    relation, subject, relation, object_ = '', '', '', ''
+    text = text.strip()
+    current = 'x'
+    for token in text.replace("<s>", "").replace("<pad>", "").replace("</s>", "").split():
+        if token == "<triplet>":
+            current = 't'
+            if relation != '':
+                triplets.append({'head': subject.strip(), 'type': relation.strip(),'tail': object_.strip()})
+                relation = ''
+            subject = ''
+        elif token == "<subj>":
+            current = 's'
+            if relation != '':
+                triplets.append({'head': subject.strip(), 'type': relation.strip(),'tail': object_.strip()})
+            object_ = ''
+        elif token == "<obj>":
+            current = 'o'
+            relation = ''
+        else:
+            if current == 't':
+                subject += ' ' + token
+            elif current == 's':
+                object_ += ' ' + token
+            elif current == 'o':
+                relation += ' ' + token
+    if subject != '' and relation != '' and object_ != '':
+        triplets.append({'head': subject.strip(), 'type': relation.strip(),'tail': object_.strip()})
+    return triplets
+
+def test_id_parser_matches_string_parser():
+    tokenizer = ToyTokenizer()
+    parser = TripletParser(tokenizer)
+    rng = random.Random(0)
+    for _ in range(20000):
+        # Generated sequences start with <s>, end with </s> and can be padded
+        num_tokens, num_padding = rng.randint(0, 30), rng.randint(0, 3)
+        token_ids = [0] + [rng.randrange(3, len(VOCAB)) for _ in range(num_tokens)] + [1] + [2] * num_padding
+        assert parser.extract_triplets(token_ids) == reference_extract_triplets(tokenizer.decode(token_ids))
+
+def test_extract_triplets_batch():
+    parser = TripletParser(ToyTokenizer())
+    token_ids = parser.tokenizer.convert_tokens_to_ids(["<s>", "<triplet>", "ĠGreen", "River", "<subj>", "Ġshale", "<obj>", "Ġpart", "Ġof", "</s>", "<pad>"])
+    assert parser.extract_triplets_batch([token_ids, token_ids[ : 3]]) == [[{"head" : "GreenRiver", "type" : "part of", "tail" : "shale"}], []]
+
+def test_deduplicate_triplets_keeps_first_copy():
+    triplets = [{"head" : "a", "type" : "b", "tail" : "c", "model_used" : "first"}, {"head" : "a", "type" : "b", "tail" : "c", "model_used" : "second"}, {"head" : "a", "type" : "b", "tail" : "d"}]
+    assert deduplicate_triplets(triplets) == [triplets[0], triplets[2]]
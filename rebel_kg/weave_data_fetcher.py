@@ -1,39 +1,16 @@
 import os
-import weaviate
-import time
 import json
-from nltk.tokenize import sent_tokenize
 
-client = weaviate.Client(
-    "http://cosmos0001.chtc.wisc.edu:8080",
-    auth_client_secret=weaviate.auth.AuthApiKey(os.getenv("HYBRID_API_KEY")),
-)
+from paragraph_retriever import *
 
-def send_query(formation_name, num_results):
-    where_filter = {"operator": "And", "operands": [{
-        "path": ["text_content"],
-        "operator": "ContainsAll",
-        "valueString": formation_name.strip().split(" "),
-    }]}
-    result = client.query.get("Passage", ["text_content", "paper_id"]).with_where(where_filter).with_limit(num_results).do()
-    matching_paragraphs = []
-
-    if "data" in result and "Get" in result["data"] and "Passage" in result["data"]["Get"] and result["data"]["Get"]["Passage"] is not None:
-        paragraphs = result["data"]["Get"]["Passage"]
-        for paragraph_content in paragraphs:
-            paper_id, paragraph_text = paragraph_content["paper_id"], paragraph_content["text_content"]
-            if formation_name.lower() in paragraph_text.lower():
-                matching_paragraphs.append({ "paper_id" : paper_id, "paragraph" : paragraph_text})
-    
-    return matching_paragraphs
-
-def create_weave_cache(save_dir, min_paragraphs_needed = 2, num_results_to_fetch = 50):
+def create_weave_cache(save_dir, min_paragraphs_needed = 2, num_results_to_fetch = 50, store_path = "weave_paragraphs.sqlite", requests_per_second = 2.0, max_concurrency = 8):
     with open("formation_to_process.txt", "r") as reader:
         formation_names = reader.readlines()
     
     os.makedirs(save_dir, exist_ok = True)
     print("Total number of formation names is", len(formation_names), "with", len(os.listdir(save_dir)), "files in dir", save_dir)
     total_formations, num_sucessful, para_sum, para_count = 0, 0, 0, 0
+    formations_to_fetch = []
     for name in formation_names:
         # Determine if the file already exists
         formation_name = name.strip()
@@ -42,10 +19,13 @@ def create_weave_cache(save_dir, min_paragraphs_needed = 2, num_results_to_fetch
         if os.path.exists(save_path):
             num_sucessful += 1
             continue
-        
-        # Get the paraagraphs for this formantion
-        all_paragraphs = send_query(formation_name, num_results_to_fetch)
-        time.sleep(2)
+        formations_to_fetch.append(formation_name)
+    
+    # Get the paragraphs for all of the formations at once, limited by the rate limit rather than a fixed sleep
+    retriever = ParagraphRetriever(store_path, requests_per_second = requests_per_second, max_concurrency = max_concurrency)
+    formation_paragraphs = retriever.get_paragraphs(get_weaviate_source(num_results_to_fetch), formations_to_fetch, get_weaviate_fetcher(num_results_to_fetch))
+    for formation_name in formations_to_fetch:
+        all_paragraphs = formation_paragraphs.get(formation_name, [])
         if len(all_paragraphs) < min_paragraphs_needed:
             continue
         
@@ -54,6 +34,7 @@ def create_weave_cache(save_dir, min_paragraphs_needed = 2, num_results_to_fetch
         para_count += 1
 
         # Save the result
+        save_path = os.path.join(save_dir, formation_name.replace(" ", "_") + ".json")
         with open(save_path, 'w+', encoding='utf-8') as writer:
             json.dump({ "matching_paragraphs" : all_paragraphs}, writer, ensure_ascii=False, indent=4)
     
@@ -65,4 +46,4 @@ def create_weave_cache(save_dir, min_paragraphs_needed = 2, num_results_to_fetch
         print("Average new paragraph length of", para_sum/para_count)
     
 if __name__ == "__main__":
-    create_weave_cache("formation_sample_paragraphs")
\ No newline at end of file
+    create_weave_cache("formation_sample_paragraphs")
@@ -1,6 +1,43 @@
 from fastcoref import FCoref
 import torch
 import spacy
+import bisect
+
+class OccurrenceIndex:
+
+    def __init__(self, rock_terms):
+        # Sort every term occurence by its start so we can bisect into them
+        all_occurences = []
+        for term_idx, rock_term in enumerate(rock_terms):
+            for start_idx, end_idx in rock_term.occurences:
+                all_occurences.append((start_idx, end_idx, term_idx))
+        all_occurences.sort()
+
+        self.starts = [start_idx for start_idx, _, _ in all_occurences]
+        self.ends = [end_idx for _, end_idx, _ in all_occurences]
+        self.term_idxs = [term_idx for _, _, term_idx in all_occurences]
+
+        # The largest end seen so far lets us stop scanning back once no earlier occurence can contain an idx
+        self.max_ends = []
+        for end_idx in self.ends:
+            self.max_ends.append(end_idx if len(self.max_ends) == 0 else max(self.max_ends[-1], end_idx))
+
+    def get_terms_containing(self, idx):
+        containing_terms = set()
+        occurence_idx = bisect.bisect_right(self.starts, idx) - 1
+        while occurence_idx >= 0 and self.max_ends[occurence_idx] - 1 >= idx:
+            if self.ends[occurence_idx] - 1 >= idx:
+                containing_terms.add(self.term_idxs[occurence_idx])
+            occurence_idx -= 1
+
+        return containing_terms
+
+    def get_overlapping_term(self, range):
+        # Return the first term that contains either end of the range
+        overlapping_terms = self.get_terms_containing(range[0]) | self.get_terms_containing(range[1] - 1)
+        if len(overlapping_terms) == 0:
+            return -1
+        return min(overlapping_terms)
 
 class CorefResolver:
 
@@ -9,18 +46,28 @@ class CorefResolver:
     
     def record_cooref_occurences(self, sentence_words, word_ranges, rock_terms):
         prediction = self.model.predict(texts = [sentence_words], is_split_into_words=True)[0]
-        all_clusters = prediction.get_clusters(as_strings=False)
-        
+        self.merge_clusters(prediction.get_clusters(as_strings=False), word_ranges, rock_terms)
+
+    def record_cooref_occurences_batch(self, all_sentence_words, all_word_ranges, all_rock_terms, max_tokens_in_batch = 10000):
+        if len(all_sentence_words) == 0:
+            return
+
+        # Let fastcoref batch the paragraphs together by their number of tokens
+        predictions = self.model.predict(texts = all_sentence_words, is_split_into_words=True, max_tokens_in_batch = max_tokens_in_batch)
+        for prediction, word_ranges, rock_terms in zip(predictions, all_word_ranges, all_rock_terms):
+            self.merge_clusters(prediction.get_clusters(as_strings=False), word_ranges, rock_terms)
+
+    def merge_clusters(self, all_clusters, word_ranges, rock_terms):
+        occurence_index = None
         for curr_cluster in all_clusters:
+            # Merging a cluster changes the occurences so only rebuild the index when needed
+            if occurence_index is None:
+                occurence_index = OccurrenceIndex(rock_terms)
+
             # Check if this cluster overlaps with an existing term
             overlap_idx = -1
             for cluster_term_range in curr_cluster:
-                for idx, rock_term in enumerate(rock_terms):
-                    does_overlap = rock_term.does_range_overlap(cluster_term_range)
-                    if does_overlap:
-                        overlap_idx = idx
-                        break
-
+                overlap_idx = occurence_index.get_overlapping_term(cluster_term_range)
                 if overlap_idx != -1:
                     break
             
@@ -34,6 +81,7 @@ class CorefResolver:
                 word_start, word_end = cluster_term_range[0], cluster_term_range[1]
                 txt_range = (word_ranges[word_start][0], word_ranges[word_end - 1][1])
                 rock_to_update.add_in_range(cluster_term_range, txt_range)
+            occurence_index = None
 
 def main():
     txt = "he artillery formation was named, mapped and discussed by lasky and webber (1949). the formation ranges up to at least 2500 feet in thickness. "
@@ -5,6 +5,8 @@ import numpy as np
 import argparse
 import spacy
 
+from term_matcher import *
+
 class RockTerm:
 
     def __init__(self, term_type, term_tokens, span, txt_range):
@@ -77,82 +79,29 @@ class RockTerm:
         
         return result_json
 
-class TrieNode:
-
-    def __init__(self):
-        self.label = None
-        self.children = {}
-    
-    def contains_child(self, word):
-        return word in self.children
-
-    def add_child(self, word, child_node):
-        self.children[word] = child_node
-    
-    def get_child(self, word):
-        return self.children[word]
-
-    def get_all_children(self):
-        return list(self.children.keys())
-
 class NERExtractor:
 
     tokenizer = spacy.load("en_core_web_lg") 
 
+    # We only read the POS tags, dependencies and sentence boundaries from the parser
+    unused_components = ["ner", "lemmatizer"]
+
     def __init__(self, data_dir):
+        # Load the compiled term matcher, only parsing the terms csv when it changes
         terms_file = os.path.join(data_dir, "all_terms.csv")
-        terms_df = pd.read_csv(terms_file)
-
-        self.root_node = TrieNode()
-        for idx, row in terms_df.iterrows():
-            # Get the current node
-            curr_term = row["term"]
-            curr_term = curr_term.replace("-", " ").replace("(", "").replace(")", "")
-            term_words = [word.lower().strip() for word in curr_term.split(" ")]
-
-            # Update the trie
-            curr_node = self.root_node
-            for word in term_words:
-                if len(word) == 0:
-                    continue
-                
-                if not curr_node.contains_child(word):
-                    curr_node.add_child(word, TrieNode())
-                curr_node = curr_node.get_child(word)
-            
-            curr_node.label = row["term_type"]        
+        self.term_matcher = TermMatcher.load_or_build(terms_file, os.path.join(data_dir, "all_terms_automaton"))
     
     def get_known_terms(self, sentence_words, sentence_terms):
-        search_start_idx = 0
         rock_terms = []
-        while search_start_idx < len(sentence_words):
-            # Perform search from this location
-            curr_node = self.root_node
-            curr_idx = search_start_idx
-            match_idx, match_label = search_start_idx, None
-
-            # Perform DFS on the trie
-            while curr_idx < len(sentence_words) and curr_node.contains_child(sentence_words[curr_idx].lower()):
-                curr_node = curr_node.get_child(sentence_words[curr_idx].lower())
-                if curr_node.label is not None:
-                    match_idx = curr_idx
-                    match_label = curr_node.label
-                
-                curr_idx += 1
-            
-            # Perform the update
-            if match_label is not None:
-                start_idx, end_index = search_start_idx, match_idx + 1
-                sentence_start_idx, sentence_end_idx = sentence_terms[start_idx].idx, sentence_terms[match_idx].idx + len(sentence_terms[match_idx].text)
-                rock_terms.append(RockTerm(
-                    term_type = match_label, 
-                    term_tokens = sentence_words[start_idx : end_index], 
-                    span = (start_idx, end_index),
-                    txt_range = (sentence_start_idx, sentence_end_idx),
-                ))
-                search_start_idx = end_index
-            else:
-                search_start_idx += 1
+        for start_idx, end_index, match_label in self.term_matcher.find_longest_matches(sentence_words):
+            match_idx = end_index - 1
+            sentence_start_idx, sentence_end_idx = sentence_terms[start_idx].idx, sentence_terms[match_idx].idx + len(sentence_terms[match_idx].text)
+            rock_terms.append(RockTerm(
+                term_type = match_label, 
+                term_tokens = sentence_words[start_idx : end_index], 
+                span = (start_idx, end_index),
+                txt_range = (sentence_start_idx, sentence_end_idx),
+            ))
         
         return rock_terms
 
@@ -239,10 +188,12 @@ class NERExtractor:
             curr_term.term_type = "att_amod"
             parent_term.add_child(curr_term)
 
-    def extract_terms(self, sentence):
+    def normalize_text(self, sentence):
+        return sentence.replace("-", " ").replace("(", "").replace(")", "")
+
+    def get_terms_for_doc(self, sentence, doc):
         # Breakup the sentence into words
-        sentence = sentence.replace("-", " ").replace("(", "").replace(")", "")
-        sentence_terms = [token for token in NERExtractor.tokenizer(sentence)]
+        sentence_terms = [token for token in doc]
         sentence_words = [str(token).strip() for token in sentence_terms]
         word_ranges = [(token.idx, token.idx + len(token.text)) for token in sentence_terms]
         
@@ -261,6 +212,17 @@ class NERExtractor:
         # Return the results
         return sentence, sentence_words, rock_terms, sentence_spans, word_ranges
 
+    def extract_terms(self, sentence):
+        sentence = self.normalize_text(sentence)
+        doc = NERExtractor.tokenizer(sentence, disable = NERExtractor.unused_components)
+        return self.get_terms_for_doc(sentence, doc)
+
+    def extract_terms_batch(self, texts, batch_size = 32, n_process = 1):
+        # Run all of the texts through the spacy pipeline together
+        sentences = [self.normalize_text(text) for text in texts]
+        docs = NERExtractor.tokenizer.pipe(sentences, batch_size = batch_size, n_process = n_process, disable = NERExtractor.unused_components)
+        return [self.get_terms_for_doc(sentence, doc) for sentence, doc in zip(sentences, docs)]
+
 def read_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--data_dir", type=str, required=True, help = "The directory containing the model")
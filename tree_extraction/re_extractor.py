@@ -2,6 +2,7 @@ import argparse
 import logging
 import os
 import random
+import sys
 import spacy
 import time
 import json
@@ -15,24 +16,30 @@ from collections import Counter
 from torch.nn import CrossEntropyLoss
 
 from pytorch_pretrained_bert.file_utils import PYTORCH_PRETRAINED_BERT_CACHE, WEIGHTS_NAME, CONFIG_NAME
-from pytorch_pretrained_bert.modeling import BertForSequenceClassification
+from pytorch_pretrained_bert.modeling import BertConfig, BertForSequenceClassification
 from pytorch_pretrained_bert.tokenization import BertTokenizer
 from pytorch_pretrained_bert.optimization import BertAdam, warmup_linear
 
+# The precision helpers are shared with the rebel_kg model wrappers
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rebel_kg"))
+from model_precision import *
+
 CLS = "[CLS]"
 SEP = "[SEP]"
 
 class RE_Extractor:
 
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, max_context_length = 512, precision = "fp32", quantized_cache_dir = QUANTIZED_CACHE_DIR):
         # Load the tokenizer
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        validate_precision(precision)
+        self.device = torch.device(get_precision_device(precision))
         self.bert_tokenizer = BertTokenizer.from_pretrained(data_dir, do_lower_case = False)
 
         # Load the labels
         with open(os.path.join(data_dir, "label_mapping.json"), "r") as reader:
             label_to_id = json.load(reader)["label2id"]
         self.max_seq_length = 512
+        self.max_context_length = min(max_context_length, self.max_seq_length)
 
         self.ids_by_start = {}
         for label_name, label_id in label_to_id.items():
@@ -43,92 +50,113 @@ class RE_Extractor:
             self.ids_by_start[label_start].append(label_id)
 
         # Load the model
-        self.model = BertForSequenceClassification.from_pretrained(data_dir, num_labels = len(label_to_id)).to(self.device)
+        num_labels = len(label_to_id)
+        if precision == "int8":
+            self.model = load_quantized_model(lambda : BertForSequenceClassification(BertConfig.from_json_file(os.path.join(data_dir, CONFIG_NAME)), num_labels = num_labels), 
+                lambda : BertForSequenceClassification.from_pretrained(data_dir, num_labels = num_labels), data_dir, quantized_cache_dir)
+        else:
+            self.model = set_model_precision(BertForSequenceClassification.from_pretrained(data_dir, num_labels = num_labels), precision)
+        self.model = self.model.to(self.device)
     
-    def extract_features(self, inputs, special_tokens = {}):
+    def get_word_pieces(self, words):
+        # Tokenize every word once, word i covers piece_ids[offsets[i] : offsets[i + 1]]
+        piece_ids, offsets = [], [0]
+        for word in words:
+            piece_ids.extend(self.bert_tokenizer.convert_tokens_to_ids(self.bert_tokenizer.tokenize(word)))
+            offsets.append(len(piece_ids))
+        
+        return piece_ids, offsets
+
+    def get_feature_ids(self, inputs, special_tokens = {}, word_pieces = None):
 
         words = inputs["words"]
         def get_special_token(w):
             if w not in special_tokens:
                 special_tokens[w] = "[unused%d]" % (len(special_tokens) + 1)
-            return special_tokens[w]
+            return self.bert_tokenizer.convert_tokens_to_ids([special_tokens[w]])[0]
+
+        if word_pieces is None:
+            word_pieces = self.get_word_pieces(words)
+        piece_ids, offsets = word_pieces
 
         # Get the tokens
-        num_tokens = 0
-        tokens = [CLS]
+        CLS_ID, SEP_ID = self.bert_tokenizer.convert_tokens_to_ids([CLS, SEP])
         SUBJECT_START = get_special_token("SUBJ_START")
         SUBJECT_END = get_special_token("SUBJ_END")
         OBJECT_START = get_special_token("OBJ_START")
         OBJECT_END = get_special_token("OBJ_END")
 
-        # Build the initial tokens
+        # Build the initial tokens, marking the spans the same way the model was trained in run_macrostart
         start_idx = min(inputs["span1"][0], inputs["span2"][0])
         end_idx = max(inputs["span1"][1], inputs["span2"][1])
+        span_ids = [CLS_ID]
         for i in range(start_idx, end_idx):
             if i == inputs["span1"][0]:
-                tokens.append(SUBJECT_START)
+                span_ids.append(SUBJECT_START)
             if i == inputs["span2"][0]:
-                tokens.append(OBJECT_START)
-            for sub_token in self.bert_tokenizer.tokenize(words[i]):
-                tokens.append(sub_token)
+                span_ids.append(OBJECT_START)
+            span_ids.extend(piece_ids[offsets[i] : offsets[i + 1]])
             if i == inputs["span1"][1]:
-                tokens.append(SUBJECT_END)
+                span_ids.append(SUBJECT_END)
             if i == inputs["span2"][1]:
-                tokens.append(OBJECT_END)
-
-        while (start_idx >= 0 or end_idx < len(words)) and len(tokens) < self.max_seq_length:
-            # Include the left word
-            if start_idx >= 0:
-                left_tokens = [sub_token for sub_token in self.bert_tokenizer.tokenize(words[start_idx])]
-                tokens = left_tokens + tokens
-                start_idx -= 1
+                span_ids.append(OBJECT_END)
+
+        # Alternate adding a word on the left and right until we fill the context budget
+        num_tokens = len(span_ids)
+        left_idx, right_idx = start_idx, end_idx
+        while (left_idx >= 0 or right_idx < len(words)) and num_tokens < self.max_context_length:
+            if left_idx >= 0:
+                num_tokens += offsets[left_idx + 1] - offsets[left_idx]
+                left_idx -= 1
             
-            # Include the right word
-            if end_idx < len(words):
-                right_tokens = [sub_token for sub_token in self.bert_tokenizer.tokenize(words[end_idx])]
-                tokens = tokens + right_tokens
-                end_idx += 1
+            if right_idx < len(words):
+                num_tokens += offsets[right_idx + 1] - offsets[right_idx]
+                right_idx += 1
         
-        tokens.append(SEP)
+        # The context on each side is a contiguous range of words so we can just slice it
+        left_ids = piece_ids[offsets[left_idx + 1] : offsets[start_idx + 1]] if left_idx < start_idx else []
+        right_ids = piece_ids[offsets[end_idx] : offsets[right_idx]] if right_idx > end_idx else []
+        input_ids = left_ids + span_ids + right_ids + [SEP_ID]
+        return input_ids[ : self.max_context_length]
 
-        # Extract the features
-        num_tokens += len(tokens)
-        if len(tokens) > self.max_seq_length:
-            tokens = tokens[:self.max_seq_length]
-        
-        # Convert the tokens into ids
-        segment_ids = [0] * len(tokens)
-        input_ids = self.bert_tokenizer.convert_tokens_to_ids(tokens)
-        input_mask = [1] * len(input_ids)
-        padding = [0] * (self.max_seq_length - len(input_ids))
-        input_ids += padding
-        input_mask += padding
-        segment_ids += padding
-        assert len(input_ids) == self.max_seq_length
-        assert len(input_mask) == self.max_seq_length
-        assert len(segment_ids) == self.max_seq_length
+    def pad_features(self, all_input_ids):
+        # Only pad up to the longest sequence in the batch
+        batch_length = max(len(input_ids) for input_ids in all_input_ids)
+        padded_ids, padded_masks = [], []
+        for input_ids in all_input_ids:
+            padding = [0] * (batch_length - len(input_ids))
+            padded_ids.append(input_ids + padding)
+            padded_masks.append([1] * len(input_ids) + padding)
 
         # Return it as tensor
-        input_ids = torch.tensor([input_ids], dtype=torch.long).to(self.device)
-        input_mask = torch.tensor([input_mask], dtype=torch.long).to(self.device)
-        segment_ids = torch.tensor([segment_ids], dtype=torch.long).to(self.device)
+        input_ids = torch.tensor(padded_ids, dtype=torch.long).to(self.device)
+        input_mask = torch.tensor(padded_masks, dtype=torch.long).to(self.device)
+        segment_ids = torch.zeros_like(input_ids)
 
         return input_ids, input_mask, segment_ids
 
+    def extract_features(self, inputs, special_tokens = {}):
+        return self.pad_features([self.get_feature_ids(inputs, special_tokens)])
+
+    def get_label_ids(self, lower_type, upper_type):
+        if upper_type == "strat":
+            return self.ids_by_start[upper_type]
+        elif lower_type == "att":
+            return self.ids_by_start[lower_type]
+        
+        return None
+
     def get_prediction(self, inputs, lower_type, upper_type):
         # Get the probability for each label
         input_ids, input_mask, segment_ids = self.extract_features(inputs)
         with torch.no_grad():
             logits = self.model(input_ids, segment_ids, input_mask, labels=None)
-        probabilities = torch.nn.functional.softmax(logits, dim = -1).detach().cpu().numpy()[0]
+        probabilities = torch.nn.functional.softmax(logits.float(), dim = -1).detach().cpu().numpy()[0]
 
         # Get idxs to use
-        if upper_type == "strat":
-            idxs_to_use = self.ids_by_start[upper_type]
-        elif lower_type == "att":
-            idxs_to_use = self.ids_by_start[lower_type]
-        else:
-            return -1.0
+        idxs_to_use = self.get_label_ids(lower_type, upper_type)
+        if idxs_to_use is None:
+            return None, -1.0
 
         # Get the probabilities for that type
         return None, np.max(probabilities[idxs_to_use])
@@ -147,8 +175,8 @@ class RE_Extractor:
         
         return len(sentence_spans)
 
-    def get_relationship_probability(self, sentence_words, first_rock, second_rock, lower_type, upper_type, sentence_spans):
-        # Find the pair of occurences with the lowest distance
+    def get_closest_spans(self, first_rock, second_rock, sentence_spans):
+        # Find the pair of occurences in the same sentence with the lowest distance
         lowest_first_span, lowest_second_span, lowest_distance = None, None, None
         for curr_first_span in first_rock.occurences:
             for curr_second_span in second_rock.occurences:
@@ -159,33 +187,63 @@ class RE_Extractor:
                 curr_distance = self.get_interval_distance(curr_first_span, curr_second_span)
                 if lowest_distance is None or curr_distance < lowest_distance:
                     lowest_first_span, lowest_second_span = curr_first_span, curr_second_span
+                    lowest_distance = curr_distance
 
-        # Get the probability for this span
-        if lowest_first_span is None or lowest_second_span is None:
-            return -1.0
+        return lowest_first_span, lowest_second_span
 
-        _, first_pair_probability = self.get_prediction({
-            "words" : sentence_words,
-            "span1" : lowest_first_span,
-            "span2" : lowest_second_span
-        }, lower_type, upper_type)
+    def get_relationship_probabilities(self, sentence_words, lower_terms, upper_terms, lower_type, upper_type, sentence_spans, batch_size = 32):
+        # Pairs without a valid span or label keep a probability of -1
+        probabilities = np.full((len(lower_terms), len(upper_terms)), -1.0)
+        idxs_to_use = self.get_label_ids(lower_type, upper_type)
+        if idxs_to_use is None:
+            return probabilities
 
-        _, second_pair_probability = self.get_prediction({
-            "words" : sentence_words,
-            "span1" : lowest_second_span,
-            "span2" : lowest_first_span
-        }, lower_type, upper_type)
+        # Build the features for both directions of every candidate pair, tokenizing the paragraph only once
+        word_pieces = self.get_word_pieces(sentence_words)
+        all_features = []
+        for lower_idx, lower_term in enumerate(lower_terms):
+            for upper_idx, upper_term in enumerate(upper_terms):
+                first_span, second_span = self.get_closest_spans(lower_term, upper_term, sentence_spans)
+                if first_span is None or second_span is None:
+                    continue
+                
+                for span1, span2 in [(first_span, second_span), (second_span, first_span)]:
+                    input_ids = self.get_feature_ids({
+                        "words" : sentence_words,
+                        "span1" : span1,
+                        "span2" : span2
+                    }, word_pieces = word_pieces)
+                    all_features.append((lower_idx, upper_idx, input_ids))
+        
+        # Run the features in length sorted batches so each batch needs little padding
+        all_features.sort(key = lambda feature : len(feature[2]))
+        for batch_start in range(0, len(all_features), batch_size):
+            batch_features = all_features[batch_start : batch_start + batch_size]
+            input_ids, input_mask, segment_ids = self.pad_features([feature[2] for feature in batch_features])
+            with torch.no_grad():
+                logits = self.model(input_ids, segment_ids, input_mask, labels=None)
+            batch_probabilities = torch.nn.functional.softmax(logits.float(), dim = -1).detach().cpu().numpy()
+            batch_probabilities = np.max(batch_probabilities[:, idxs_to_use], axis = -1)
 
-        return max(first_pair_probability, second_pair_probability)
+            # Keep the max probability across the two directions
+            for (lower_idx, upper_idx, _), pair_probability in zip(batch_features, batch_probabilities):
+                probabilities[lower_idx, upper_idx] = max(probabilities[lower_idx, upper_idx], pair_probability)
+        
+        return probabilities
+
+    def get_relationship_probability(self, sentence_words, first_rock, second_rock, lower_type, upper_type, sentence_spans):
+        probabilities = self.get_relationship_probabilities(sentence_words, [first_rock], [second_rock], lower_type, upper_type, sentence_spans)
+        return probabilities[0, 0]
 
 def read_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--model_dir", type=str, required=True, help = "The directory containing the model")
+    parser.add_argument("--precision", type=str, default="fp32", choices=PRECISIONS, help = "The precision the model weights are run in")
     return parser.parse_args()
 
 def main(args):
     # Load the model
-    model = RE_Extractor(args.model_dir)
+    model = RE_Extractor(args.model_dir, precision = args.precision)
 
     # Format the input
     nlp = spacy.load("en_core_web_lg") 
@@ -32,13 +32,15 @@ def generate_tree():
 def read_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--data_dir", type=str, required=True, help = "The directory containing the model")
+    parser.add_argument("--context_length", type=int, default=512, help = "The maximum number of wordpieces used for each relationship candidate")
+    parser.add_argument("--precision", type=str, default="fp32", choices=PRECISIONS, help = "The precision the relationship model weights are run in")
     return parser.parse_args()
 
 def main():
     # Create extractor
     global tree_generator
     args = read_args()
-    tree_generator = TreeGenerator(args.data_dir)
+    tree_generator = TreeGenerator(args.data_dir, args.context_length, args.precision)
 
     # Start the server
     app.run(host = '0.0.0.0', port = 9500, debug = True)
@@ -0,0 +1,236 @@
+import os
+import csv
+import json
+import shutil
+from collections import deque
+import numpy as np
+
+ROOT_STATE = 0
+NO_STATE = -1
+
+def get_term_words(term):
+    # Normalize the term the same way the paragraph text is normalized
+    term = term.replace("-", " ").replace("(", "").replace(")", "")
+    term_words = [word.lower().strip() for word in term.split(" ")]
+    return [word for word in term_words if len(word) > 0]
+
+class TermMatcher:
+
+    ARRAY_NAMES = ["edge_offsets", "edge_tokens", "edge_targets", "fail", "output_link", "state_label", "state_depth"]
+
+    def __init__(self, vocab, labels, arrays, source_signature = None):
+        self.vocab = vocab
+        self.word_to_id = {word : idx for idx, word in enumerate(vocab)}
+        self.labels = labels
+        self.source_signature = source_signature
+        for array_name in TermMatcher.ARRAY_NAMES:
+            setattr(self, array_name, arrays[array_name])
+
+        self.build_lookup_tables()
+
+    @classmethod
+    def build(cls, terms, source_signature = None):
+        # Build the trie over token ids, later rows override the label of earlier ones
+        vocab, word_to_id = [], {}
+        labels, label_to_id = [], {}
+        children, state_label, state_depth = [{}], [NO_STATE], [0]
+        for term, term_type in terms:
+            term_words = get_term_words(term)
+            if len(term_words) == 0:
+                continue
+
+            curr_state = ROOT_STATE
+            for word in term_words:
+                if word not in word_to_id:
+                    word_to_id[word] = len(vocab)
+                    vocab.append(word)
+                token_id = word_to_id[word]
+
+                if token_id not in children[curr_state]:
+                    children[curr_state][token_id] = len(children)
+                    children.append({})
+                    state_label.append(NO_STATE)
+                    state_depth.append(state_depth[curr_state] + 1)
+                curr_state = children[curr_state][token_id]
+
+            if term_type not in label_to_id:
+                label_to_id[term_type] = len(labels)
+                labels.append(term_type)
+            state_label[curr_state] = label_to_id[term_type]
+
+        # Compute the failure and output links with a BFS over the trie
+        num_states = len(children)
+        fail = [ROOT_STATE] * num_states
+        output_link = [NO_STATE] * num_states
+        states_queue = deque(children[ROOT_STATE].values())
+        while len(states_queue) > 0:
+            curr_state = states_queue.popleft()
+            for token_id, child_state in children[curr_state].items():
+                # Follow the failure links until we find a state with this transition
+                fail_state = fail[curr_state]
+                while fail_state != ROOT_STATE and token_id not in children[fail_state]:
+                    fail_state = fail[fail_state]
+                child_fail = children[fail_state].get(token_id, ROOT_STATE)
+                fail[child_state] = child_fail if child_fail != child_state else ROOT_STATE
+
+                # Point at the nearest labeled state on the failure chain
+                child_fail = fail[child_state]
+                output_link[child_state] = child_fail if state_label[child_fail] != NO_STATE else output_link[child_fail]
+                states_queue.append(child_state)
+
+        # Flatten the transitions into sorted CSR arrays
+        edge_offsets, edge_tokens, edge_targets = [0], [], []
+        for state_children in children:
+            for token_id in sorted(state_children):
+                edge_tokens.append(token_id)
+                edge_targets.append(state_children[token_id])
+            edge_offsets.append(len(edge_tokens))
+
+        arrays = {
+            "edge_offsets" : np.array(edge_offsets, dtype = np.int64),
+            "edge_tokens" : np.array(edge_tokens, dtype = np.int64),
+            "edge_targets" : np.array(edge_targets, dtype = np.int64),
+            "fail" : np.array(fail, dtype = np.int64),
+            "output_link" : np.array(output_link, dtype = np.int64),
+            "state_label" : np.array(state_label, dtype = np.int64),
+            "state_depth" : np.array(state_depth, dtype = np.int64)
+        }
+        return cls(vocab, labels, arrays, source_signature)
+
+    @classmethod
+    def from_csv(cls, terms_file):
+        # Take the signature before reading so a file that changes while we read it gets rebuilt next time
+        source_signature = get_file_signature(terms_file)
+        with open(terms_file, 'r', newline = '') as reader:
+            terms = [(row["term"], row["term_type"]) for row in csv.DictReader(reader)]
+        return cls.build(terms, source_signature = source_signature)
+
+    def save(self, save_dir):
+        # Write into a temporary sibling directory and move it into place so other workers never see a partial matcher
+        temp_dir = save_dir + "." + str(os.getpid()) + ".tmp"
+        os.makedirs(temp_dir, exist_ok = True)
+        for array_name in TermMatcher.ARRAY_NAMES:
+            np.save(os.path.join(temp_dir, array_name + ".npy"), getattr(self, array_name))
+
+        with open(os.path.join(temp_dir, "metadata.json"), 'w+') as writer:
+            json.dump({
+                "vocab" : self.vocab,
+                "labels" : self.labels,
+                "source_signature" : self.source_signature
+            }, writer)
+
+        try:
+            os.replace(temp_dir, save_dir)
+        except OSError:
+            # A directory can't replace a non empty one, which happens when another worker saved the matcher first
+            shutil.rmtree(temp_dir, ignore_errors = True)
+            if not os.path.exists(os.path.join(save_dir, "metadata.json")):
+                raise
+
+    @classmethod
+    def load(cls, save_dir):
+        with open(os.path.join(save_dir, "metadata.json"), 'r') as reader:
+            metadata = json.load(reader)
+
+        arrays = {}
+        for array_name in TermMatcher.ARRAY_NAMES:
+            arrays[array_name] = np.load(os.path.join(save_dir, array_name + ".npy"), mmap_mode = "r")
+        return cls(metadata["vocab"], metadata["labels"], arrays, metadata["source_signature"])
+
+    @classmethod
+    def load_or_build(cls, terms_file, save_dir):
+        # Every version of the terms file gets its own directory, so a rebuild never touches files that are mapped
+        matcher_dir = get_matcher_dir(save_dir, get_file_signature(terms_file))
+        if os.path.exists(os.path.join(matcher_dir, "metadata.json")):
+            return cls.load(matcher_dir)
+
+        os.makedirs(save_dir, exist_ok = True)
+        matcher = cls.from_csv(terms_file)
+        matcher.save(get_matcher_dir(save_dir, matcher.source_signature))
+        return matcher
+
+    def build_lookup_tables(self):
+        # Indexing the numpy arrays per word is slow, so each process turns them into plain lists and dicts once
+        edge_offsets, edge_tokens, edge_targets = self.edge_offsets.tolist(), self.edge_tokens.tolist(), self.edge_targets.tolist()
+        self.goto = [dict(zip(edge_tokens[lo : hi], edge_targets[lo : hi])) for lo, hi in zip(edge_offsets, edge_offsets[1:])]
+        self.fail_state = self.fail.tolist()
+        self.depth = self.state_depth.tolist()
+
+        # The full goto table starts as the trie edges and is filled in with the failure transitions that get taken
+        self.transitions = [dict(state_goto) for state_goto in self.goto]
+
+        # Store how far back the longest term ending at each state starts along with its label
+        output_link, state_label = self.output_link.tolist(), self.state_label.tolist()
+        self.output_offset, self.output_label = [], []
+        for state in range(len(state_label)):
+            output_state = state if state_label[state] != NO_STATE else output_link[state]
+            if output_state == NO_STATE:
+                self.output_offset.append(None)
+                self.output_label.append(None)
+            else:
+                self.output_offset.append(self.depth[output_state] - 1)
+                self.output_label.append(self.labels[state_label[output_state]])
+
+    def get_next_state(self, state, token_id):
+        # Follow the failure links until we find a state with this transition and remember where we ended up
+        curr_state = state
+        next_state = self.goto[curr_state].get(token_id)
+        while next_state is None and curr_state != ROOT_STATE:
+            curr_state = self.fail_state[curr_state]
+            next_state = self.goto[curr_state].get(token_id)
+
+        next_state = ROOT_STATE if next_state is None else next_state
+        self.transitions[state][token_id] = next_state
+        return next_state
+
+    def find_longest_matches(self, words):
+        transitions, depth, output_offset, output_label = self.transitions, self.depth, self.output_offset, self.output_label
+        root_transitions = transitions[ROOT_STATE]
+
+        # Words that aren't in any term all share the same token id
+        get_token_id = self.word_to_id.get
+        token_ids = [get_token_id(word.lower(), NO_STATE) for word in words]
+        num_tokens = len(token_ids)
+
+        # Keep the match with the leftmost start seen so far, a start of num_tokens means there is no match yet
+        all_matches = []
+        scan_start_idx = 0
+        while scan_start_idx < num_tokens:
+            curr_state = ROOT_STATE
+            match_start, match_end, match_label = num_tokens, num_tokens, None
+            for token_idx, token_id in enumerate(token_ids[scan_start_idx : ], scan_start_idx):
+                next_state = transitions[curr_state].get(token_id)
+                if next_state is None:
+                    # The root has no failure transitions and never has a pending match, so most words stop here
+                    if curr_state == ROOT_STATE:
+                        continue
+                    next_state = self.get_next_state(curr_state, token_id)
+
+                # The state covers every start that can still grow into a term, so a match behind all of them is final
+                if token_idx - depth[next_state] >= match_start:
+                    all_matches.append((match_start, match_end, match_label))
+                    match_start = num_tokens
+
+                    # Words after the match were only checked against the old match, so scan them again
+                    if match_end < token_idx:
+                        break
+                    next_state = root_transitions.get(token_id, ROOT_STATE)
+                curr_state = next_state
+
+                # The longest term ending here has the leftmost start of all the terms ending here
+                start_offset = output_offset[curr_state]
+                if start_offset is not None and token_idx - start_offset <= match_start:
+                    match_start, match_end, match_label = token_idx - start_offset, token_idx + 1, output_label[curr_state]
+            else:
+                if match_start < num_tokens:
+                    all_matches.append((match_start, match_end, match_label))
+            scan_start_idx = match_end
+
+        return all_matches
+
+def get_file_signature(file_path):
+    file_stats = os.stat(file_path)
+    return [file_stats.st_size, file_stats.st_mtime_ns]
+
+def get_matcher_dir(save_dir, source_signature):
+    return os.path.join(save_dir, "matcher_" + "_".join(str(value) for value in source_signature))
@@ -0,0 +1,127 @@
+import gc
+import os
+import re
+import json
+import time
+import argparse
+import pandas as pd
+
+from term_matcher import *
+
+class TrieNode:
+
+    def __init__(self):
+        self.label = None
+        self.children = {}
+
+def build_legacy_trie(terms_file):
+    # The dict of TrieNode trie NERExtractor used before the compiled matcher
+    terms_df = pd.read_csv(terms_file)
+    root_node = TrieNode()
+    for idx, row in terms_df.iterrows():
+        curr_node = root_node
+        for word in get_term_words(row["term"]):
+            if word not in curr_node.children:
+                curr_node.children[word] = TrieNode()
+            curr_node = curr_node.children[word]
+
+        if curr_node is not root_node:
+            curr_node.label = row["term_type"]
+
+    return root_node
+
+def legacy_find_longest_matches(root_node, sentence_words):
+    search_start_idx = 0
+    all_matches = []
+    while search_start_idx < len(sentence_words):
+        # Walk the trie from this location
+        curr_node = root_node
+        curr_idx = search_start_idx
+        match_idx, match_label = search_start_idx, None
+        while curr_idx < len(sentence_words) and sentence_words[curr_idx].lower() in curr_node.children:
+            curr_node = curr_node.children[sentence_words[curr_idx].lower()]
+            if curr_node.label is not None:
+                match_idx = curr_idx
+                match_label = curr_node.label
+            curr_idx += 1
+
+        if match_label is not None:
+            all_matches.append((search_start_idx, match_idx + 1, match_label))
+            search_start_idx = match_idx + 1
+        else:
+            search_start_idx += 1
+
+    return all_matches
+
+def tokenize(paragraph):
+    # Approximate the spacy tokenization without paying for the spacy pipeline
+    paragraph = paragraph.replace("-", " ").replace("(", "").replace(")", "")
+    return re.findall(r"\w+|[^\w\s]", paragraph)
+
+def load_corpus(paragraphs_dir, corpus_file):
+    all_paragraphs = []
+    if corpus_file is not None:
+        with open(corpus_file, 'r') as reader:
+            all_paragraphs.extend([line.strip() for line in reader if len(line.strip()) > 0])
+
+    if paragraphs_dir is not None:
+        for file_name in os.listdir(paragraphs_dir):
+            if "json" not in file_name or file_name[0] == '.':
+                continue
+
+            with open(os.path.join(paragraphs_dir, file_name), 'r') as reader:
+                data = json.load(reader)
+            if "paragraph_text" in data:
+                all_paragraphs.append(data["paragraph_text"])
+
+    return all_paragraphs
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--data_dir", type=str, required=True, help = "The directory containing all_terms.csv")
+    parser.add_argument("--paragraphs_dir", type=str, default=None, help = "A directory of paragraph json files like the ones tree_generator reads")
+    parser.add_argument("--corpus_file", type=str, default=None, help = "A text file with one paragraph per line")
+    parser.add_argument("--repeat", type=int, default=1, help = "The number of times to repeat the corpus")
+    return parser.parse_args()
+
+def main():
+    args = read_args()
+    if args.paragraphs_dir is None and args.corpus_file is None:
+        raise argparse.ArgumentTypeError('Either a paragraphs directory or corpus file must be specified')
+
+    all_paragraphs = load_corpus(args.paragraphs_dir, args.corpus_file) * args.repeat
+    all_words = [tokenize(paragraph) for paragraph in all_paragraphs]
+    print("Loaded", len(all_words), "paragraphs with", sum(len(words) for words in all_words), "words")
+
+    # Time the startup of both matchers
+    terms_file = os.path.join(args.data_dir, "all_terms.csv")
+    start_time = time.time()
+    root_node = build_legacy_trie(terms_file)
+    print("Legacy trie startup took", round(time.time() - start_time, 3), "seconds")
+
+    save_dir = os.path.join(args.data_dir, "all_terms_automaton")
+    start_time = time.time()
+    TermMatcher.load_or_build(terms_file, save_dir)
+    print("Compiled matcher first startup took", round(time.time() - start_time, 3), "seconds")
+
+    start_time = time.time()
+    term_matcher = TermMatcher.load_or_build(terms_file, save_dir)
+    print("Compiled matcher cached startup took", round(time.time() - start_time, 3), "seconds")
+
+    # Time the matching with the garbage collector off like timeit does, otherwise the second matcher pays for
+    # collecting the first one's matches
+    gc.disable()
+    start_time = time.time()
+    legacy_matches = [legacy_find_longest_matches(root_node, words) for words in all_words]
+    print("Legacy trie matching took", round(time.time() - start_time, 3), "seconds")
+
+    start_time = time.time()
+    compiled_matches = [term_matcher.find_longest_matches(words) for words in all_words]
+    print("Compiled matcher matching took", round(time.time() - start_time, 3), "seconds")
+    gc.enable()
+
+    num_mismatched = sum(1 for legacy, compiled in zip(legacy_matches, compiled_matches) if legacy != compiled)
+    print("Got", sum(len(matches) for matches in compiled_matches), "matches with", num_mismatched, "mismatched paragraphs")
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,10 @@ import datetime
 
 class TreeGenerator:
 
-    def __init__(self, data_dir):
+    def __init__(self, data_dir, context_length = 512, precision = "fp32"):
         self.ner_extractor = NERExtractor(data_dir)
         self.coref_resolver = CorefResolver()
-        self.re_extractor = RE_Extractor(data_dir)
+        self.re_extractor = RE_Extractor(data_dir, max_context_length = context_length, precision = precision)
         self.start_prefixes = ["strat", "lith", "att"]
     
     def get_rock_level(self, rock):
@@ -31,17 +31,15 @@ class TreeGenerator:
         lower_terms, lower_prefix = terms_by_level[lower_level], self.start_prefixes[lower_level]
         upper_terms, upper_prefix = terms_by_level[upper_level], self.start_prefixes[upper_level]
 
-        for lower_term in lower_terms:
+        # Score all of the candidate pairs at once
+        pair_probabilities = self.re_extractor.get_relationship_probabilities(sentence_words, lower_terms, upper_terms, lower_prefix, upper_prefix, sentence_spans)
+        for lower_idx, lower_term in enumerate(lower_terms):
             # Determine term to merge with
-            upper_merge_idx, upper_merge_probability = -1, -1.0
-            for upper_idx, upper_term in enumerate(upper_terms):
-                pair_probability = self.re_extractor.get_relationship_probability(sentence_words, lower_term, upper_term, lower_prefix, upper_prefix, sentence_spans)
-                if pair_probability > upper_merge_probability:
-                    upper_merge_idx = upper_idx
-                    upper_merge_probability = pair_probability
+            upper_merge_idx = int(np.argmax(pair_probabilities[lower_idx]))
+            upper_merge_probability = pair_probabilities[lower_idx, upper_merge_idx]
 
             # Perform the merge
-            if upper_merge_idx >= 0:
+            if upper_merge_probability > -1.0:
                 upper_terms[upper_merge_idx].add_child(lower_term, child_probability = upper_merge_probability)
 
     def format_relationships(self, paragraph, entity, relationships, just_entities):
@@ -86,9 +84,25 @@ class TreeGenerator:
         return relationships, just_entities
         
     def run_for_text(self, text):
-        # Get the rock terms
-        sentence, sentence_words, rock_terms, sentence_spans, word_ranges = self.ner_extractor.extract_terms(text["paragraph_text"])
+        extracted_terms = self.ner_extractor.extract_terms(text["paragraph_text"])
+        sentence, sentence_words, rock_terms, sentence_spans, word_ranges = extracted_terms
         self.coref_resolver.record_cooref_occurences(sentence_words, word_ranges, rock_terms)
+        return self.get_result_for_terms(text, extracted_terms)
+
+    def run_for_texts(self, texts, batch_size = 32, n_process = 1, coref_max_tokens = 10000):
+        # Extract the terms for all of the texts in a single pass through spacy
+        all_extracted_terms = self.ner_extractor.extract_terms_batch([text["paragraph_text"] for text in texts], batch_size = batch_size, n_process = n_process)
+
+        # Resolve the coreferences for all of the texts at once
+        all_sentence_words = [extracted_terms[1] for extracted_terms in all_extracted_terms]
+        all_rock_terms = [extracted_terms[2] for extracted_terms in all_extracted_terms]
+        all_word_ranges = [extracted_terms[4] for extracted_terms in all_extracted_terms]
+        self.coref_resolver.record_cooref_occurences_batch(all_sentence_words, all_word_ranges, all_rock_terms, max_tokens_in_batch = coref_max_tokens)
+
+        return [self.get_result_for_terms(text, extracted_terms) for text, extracted_terms in zip(texts, all_extracted_terms)]
+
+    def get_result_for_terms(self, text, extracted_terms):
+        sentence, sentence_words, rock_terms, sentence_spans, word_ranges = extracted_terms
 
         # Get rocks by level
         rocks_by_level = {}
@@ -127,38 +141,46 @@ def read_args():
     parser.add_argument("--data_dir", type=str, required=True, help = "The directory containing the model")
     parser.add_argument("--paragraphs_dir", type=str, required=True, help = "The path to the directory file with paragraphs")
     parser.add_argument("--save_dir", type=str, required=True, help = "The path to save the directory to save the results to")
+    parser.add_argument("--context_length", type=int, default=512, help = "The maximum number of wordpieces used for each relationship candidate")
+    parser.add_argument("--batch_size", type=int, default=32, help = "The number of paragraphs spacy processes at once")
+    parser.add_argument("--n_process", type=int, default=1, help = "The number of processes spacy uses to parse the paragraphs")
+    parser.add_argument("--chunk_size", type=int, default=256, help = "The number of paragraph files loaded and processed together")
+    parser.add_argument("--coref_max_tokens", type=int, default=10000, help = "The maximum number of tokens in each coreference batch")
+    parser.add_argument("--precision", type=str, default="fp32", choices=PRECISIONS, help = "The precision the relationship model weights are run in")
     return parser.parse_args()
 
 def main():
     # Load the model
     args = read_args()
-    tree_generator = TreeGenerator(args.data_dir)
+    tree_generator = TreeGenerator(args.data_dir, args.context_length, args.precision)
     os.makedirs(args.save_dir, exist_ok = True)
 
-    # Run on the paragraphs
-    for file_name in os.listdir(args.paragraphs_dir):
-        # Generate the tree
-        if "json" not in file_name or file_name[0] == '.':
-            continue
+    # Run on the paragraphs a chunk at a time so spacy and the coreference model see full batches
+    file_names = [file_name for file_name in os.listdir(args.paragraphs_dir) if "json" in file_name and file_name[0] != '.']
+    for chunk_start in range(0, len(file_names), args.chunk_size):
+        # Load the texts
+        input_texts = []
+        for file_name in file_names[chunk_start : chunk_start + args.chunk_size]:
+            file_path = os.path.join(args.paragraphs_dir, file_name)
+            with open(file_path, 'r') as reader:
+                input_texts.append(json.load(reader))
         
-        # Load the text
-        file_path = os.path.join(args.paragraphs_dir, file_name)
-        with open(file_path, 'r') as reader:
-            input_text = json.load(reader)
-        
-        # Save the result
-        run_id = "run_" + str(datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S.%f"))
-        json_to_save = {
-            "run" : run_id,
-            "extraction_pipeline_id" : "0",
-            "model_id" : "tree_based_span_bert_0",
-            "results" : [tree_generator.run_for_text(input_text)]
-        }
-
-        save_name = input_text["weaviate_id"] + "_" + run_id
-        save_path = os.path.join(args.save_dir, save_name + ".json")
-        with open(save_path, "w+") as writer:
-            json.dump(json_to_save, writer, indent = 4)
+        # Generate the trees
+        all_results = tree_generator.run_for_texts(input_texts, batch_size = args.batch_size, n_process = args.n_process, coref_max_tokens = args.coref_max_tokens)
+        for input_text, result in zip(input_texts, all_results):
+            # Save the result
+            run_id = "run_" + str(datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S.%f"))
+            json_to_save = {
+                "run" : run_id,
+                "extraction_pipeline_id" : "0",
+                "model_id" : "tree_based_span_bert_0",
+                "results" : [result]
+            }
+
+            save_name = input_text["weaviate_id"] + "_" + run_id
+            save_path = os.path.join(args.save_dir, save_name + ".json")
+            with open(save_path, "w+") as writer:
+                json.dump(json_to_save, writer, indent = 4)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
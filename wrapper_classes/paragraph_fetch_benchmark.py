@@ -0,0 +1,77 @@
+import os
+import time
+import uuid
+import random
+import argparse
+
+from weaviate_wrapper import *
+
+class DelayedBackend:
+
+    def __init__(self, backend, request_latency_ms, per_id_latency_ms):
+        # Simulate the round trip to a remote weaviate instance on top of a local store
+        self.backend = backend
+        self.request_latency = request_latency_ms / 1000.0
+        self.per_id_latency = per_id_latency_ms / 1000.0
+
+    def fetch_paragraphs(self, paragraph_ids):
+        time.sleep(self.request_latency + self.per_id_latency * len(paragraph_ids))
+        return self.backend.fetch_paragraphs(paragraph_ids)
+
+def create_store(db_path, num_paragraphs, seed):
+    # Fill the store with random paragraphs
+    rng = random.Random(seed)
+    store = SQLiteParagraphStore(db_path)
+    all_paragraphs = []
+    for paragraph_idx in range(num_paragraphs):
+        all_paragraphs.append(WeaviateText(
+            preprocessor_id = "benchmark",
+            paper_id = "paper_" + str(paragraph_idx // 10),
+            hashed_text = str(rng.getrandbits(64)),
+            weaviate_id = str(uuid.UUID(int = rng.getrandbits(128))),
+            paragraph = " ".join(["word" + str(rng.randint(0, 1000)) for _ in range(100)])
+        ))
+    store.add_paragraphs(all_paragraphs)
+    return store, [paragraph.weaviate_id for paragraph in all_paragraphs]
+
+def time_fetch(fetcher, ids_to_load):
+    start_time = time.time()
+    results = list(fetcher.get_paragraphs_for_ids(ids_to_load))
+    return results, time.time() - start_time
+
+def read_args():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--db_path", type=str, default="paragraph_store.sqlite", help = "The sqlite paragraph store to benchmark against")
+    parser.add_argument("--num_paragraphs", type=int, default=5000, help = "The number of paragraphs to put in the store")
+    parser.add_argument("--num_ids", type=int, default=1000, help = "The number of ids to fetch")
+    parser.add_argument("--chunk_size", type=int, default=100, help = "The number of ids fetched in each request")
+    parser.add_argument("--num_workers", type=int, default=4, help = "The number of requests in flight at once")
+    parser.add_argument("--request_latency_ms", type=float, default=20, help = "The simulated latency of each request")
+    parser.add_argument("--per_id_latency_ms", type=float, default=0.2, help = "The simulated latency of each id in a request")
+    parser.add_argument("--seed", type=int, default=42, help = "The seed used to generate the paragraphs")
+    return parser.parse_args()
+
+def main():
+    args = read_args()
+    if os.path.exists(args.db_path):
+        os.remove(args.db_path)
+    store, all_ids = create_store(args.db_path, args.num_paragraphs, args.seed)
+
+    # Ask for some ids that don't exist to make sure they are skipped
+    rng = random.Random(args.seed)
+    ids_to_load = rng.sample(all_ids, min(args.num_ids, len(all_ids))) + ["missing_" + str(idx) for idx in range(10)]
+    rng.shuffle(ids_to_load)
+    backend = DelayedBackend(store, args.request_latency_ms, args.per_id_latency_ms)
+
+    # The per id fetch matches the original one query per id loop
+    sequential_results, sequential_time = time_fetch(BatchedParagraphFetcher(backend, chunk_size = 1, num_workers = 1), ids_to_load)
+    print("Per id fetch of", len(ids_to_load), "ids took", round(sequential_time, 3), "seconds")
+
+    batched_results, batched_time = time_fetch(BatchedParagraphFetcher(backend, chunk_size = args.chunk_size, num_workers = args.num_workers), ids_to_load)
+    print("Batched fetch of", len(ids_to_load), "ids took", round(batched_time, 3), "seconds")
+
+    print("Got", len(batched_results), "paragraphs, results match:", sequential_results == batched_results)
+    print("Speedup of", round(sequential_time / batched_time, 2))
+
+if __name__ == "__main__":
+    main()
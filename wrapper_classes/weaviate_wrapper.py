@@ -1,6 +1,10 @@
 import os
 from dataclasses import dataclass
-from typing import Protocol, Iterable, Any, Callable
+from typing import Protocol, Iterable, Any, Callable, List, Dict
+from collections import deque
+import concurrent.futures
+import sqlite3
+import threading
 import weaviate
 import json
 
@@ -12,12 +16,26 @@ class WeaviateText:
     weaviate_id: str
     paragraph: str
 
+class ParagraphBackend(Protocol):
+
+    def fetch_paragraphs(self, paragraph_ids : "List[str]") -> "Dict[str, WeaviateText]":
+        ...
+
 class WeaviateWrapper:
 
-    def __init__(self, endpoint_url : str, api_key : str):
+    def __init__(self, endpoint_url : str, api_key : str, pool_size : "int | None" = None):
+        # Size the connection pool so concurrent chunk requests reuse connections instead of opening new ones
+        client_kwargs = {}
+        if pool_size is not None:
+            client_kwargs["connection_config"] = weaviate.config.ConnectionConfig(
+                session_pool_connections = pool_size,
+                session_pool_maxsize = pool_size
+            )
+
         self.client = weaviate.Client(
             endpoint_url,
             auth_client_secret=weaviate.auth.AuthApiKey(api_key),
+            **client_kwargs
         )
     
     def get_paragraphs_for_ids(self, ids_to_load : "Iterable[str]") -> "Iterable[WeaviateText]":
@@ -48,6 +66,124 @@ class WeaviateWrapper:
                 paragraph = paragraph_data["text_content"]
             )
 
+    def fetch_paragraphs(self, paragraph_ids : "List[str]") -> "Dict[str, WeaviateText]":
+        # Load all of the ids with a single query, getting the id back so we can match up the results
+        response = (
+            self.client.query
+            .get("Paragraph", ['preprocessor_id', 'paper_id', 'hashed_text', 'text_content'])
+            .with_additional(["id"])
+            .with_where({
+                "operator": "Or",
+                "operands": [{"path": ["id"], "operator": "Equal", "valueText": paragraph_id} for paragraph_id in paragraph_ids]
+            })
+            .with_limit(len(paragraph_ids))
+            .do()
+        )
+
+        # Ensure the result exists
+        if "data" not in response or "Get" not in response["data"] or response["data"]["Get"].get("Paragraph") is None:
+            return {}
+
+        paragraphs = {}
+        for paragraph_data in response["data"]["Get"]["Paragraph"]:
+            paragraph_id = paragraph_data["_additional"]["id"]
+            paragraphs[paragraph_id] = WeaviateText(
+                preprocessor_id = paragraph_data["preprocessor_id"],
+                paper_id = paragraph_data["paper_id"],
+                hashed_text = paragraph_data["hashed_text"],
+                weaviate_id = paragraph_id,
+                paragraph = paragraph_data["text_content"]
+            )
+        
+        return paragraphs
+
+    def get_paragraphs_for_ids_batched(self, ids_to_load : "Iterable[str]", chunk_size : int = 100, num_workers : int = 4) -> "Iterable[WeaviateText]":
+        fetcher = BatchedParagraphFetcher(self, chunk_size = chunk_size, num_workers = num_workers)
+        return fetcher.get_paragraphs_for_ids(ids_to_load)
+
+class SQLiteParagraphStore:
+
+    def __init__(self, db_path : str):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.get_connection().execute("""
+            CREATE TABLE IF NOT EXISTS paragraphs (
+                weaviate_id TEXT PRIMARY KEY,
+                preprocessor_id TEXT,
+                paper_id TEXT,
+                hashed_text TEXT,
+                paragraph TEXT
+            )
+        """)
+
+    def get_connection(self) -> "sqlite3.Connection":
+        # sqlite connections can only be used by the thread that created them
+        if getattr(self.local, "connection", None) is None:
+            self.local.connection = sqlite3.connect(self.db_path)
+        return self.local.connection
+
+    def add_paragraphs(self, paragraphs : "Iterable[WeaviateText]"):
+        connection = self.get_connection()
+        rows = [(text.weaviate_id, text.preprocessor_id, text.paper_id, text.hashed_text, text.paragraph) for text in paragraphs]
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO paragraphs VALUES (?, ?, ?, ?, ?)", rows)
+
+    def fetch_paragraphs(self, paragraph_ids : "List[str]") -> "Dict[str, WeaviateText]":
+        placeholders = ",".join(["?"] * len(paragraph_ids))
+        query_result = self.get_connection().execute(
+            f"SELECT weaviate_id, preprocessor_id, paper_id, hashed_text, paragraph FROM paragraphs WHERE weaviate_id IN ({placeholders})",
+            list(paragraph_ids)
+        )
+
+        paragraphs = {}
+        for weaviate_id, preprocessor_id, paper_id, hashed_text, paragraph in query_result:
+            paragraphs[weaviate_id] = WeaviateText(
+                preprocessor_id = preprocessor_id,
+                paper_id = paper_id,
+                hashed_text = hashed_text,
+                weaviate_id = weaviate_id,
+                paragraph = paragraph
+            )
+        
+        return paragraphs
+
+class BatchedParagraphFetcher:
+
+    def __init__(self, backend : "ParagraphBackend", chunk_size : int = 100, num_workers : int = 4):
+        self.backend = backend
+        self.chunk_size = chunk_size
+        self.num_workers = num_workers
+
+    def get_chunks(self, ids_to_load : "Iterable[str]") -> "Iterable[List[str]]":
+        curr_chunk = []
+        for paragraph_id in ids_to_load:
+            curr_chunk.append(paragraph_id)
+            if len(curr_chunk) == self.chunk_size:
+                yield curr_chunk
+                curr_chunk = []
+        
+        if len(curr_chunk) > 0:
+            yield curr_chunk
+
+    def get_paragraphs_for_ids(self, ids_to_load : "Iterable[str]") -> "Iterable[WeaviateText]":
+        # Keep a bounded number of chunks in flight and yield them in the order they were submitted
+        with concurrent.futures.ThreadPoolExecutor(max_workers = self.num_workers) as executor:
+            pending_chunks = deque()
+            for chunk_ids in self.get_chunks(ids_to_load):
+                pending_chunks.append((chunk_ids, executor.submit(self.backend.fetch_paragraphs, chunk_ids)))
+                if len(pending_chunks) >= 2 * self.num_workers:
+                    yield from self.get_chunk_results(*pending_chunks.popleft())
+
+            while len(pending_chunks) > 0:
+                yield from self.get_chunk_results(*pending_chunks.popleft())
+
+    def get_chunk_results(self, chunk_ids : "List[str]", chunk_future : "concurrent.futures.Future") -> "Iterable[WeaviateText]":
+        # Like the per id queries, ids that weren't found are skipped
+        chunk_paragraphs = chunk_future.result()
+        for paragraph_id in chunk_ids:
+            if paragraph_id in chunk_paragraphs:
+                yield chunk_paragraphs[paragraph_id]
+
 def main():
     weaviate_wrapper = WeaviateWrapper("http://cosmos0001.chtc.wisc.edu:8080", os.getenv("HYBRID_API_KEY"))
     for result in weaviate_wrapper.get_paragraphs_for_ids(["00000085-2145-4b37-b963-8c80d21b6964"]):